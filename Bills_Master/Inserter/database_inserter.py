@@ -1,301 +1,1269 @@
-import sqlite3
-from contextlib import contextmanager
-from typing import Iterator, Dict, Any, Optional
-
-# 从 common.py 导入颜色
-from common import RED, GREEN, RESET
-
-
-class DatabaseManager:
-    """
-    Manages all database interactions including connection, schema creation,
-    and data manipulation.
-    """
-
-    # --- SQL Definitions ---
-    SQL_DEFINITIONS = {
-        'create_year_month': '''
-            CREATE TABLE IF NOT EXISTS YearMonth (
-                id INTEGER PRIMARY KEY,
-                year_month TEXT UNIQUE NOT NULL,
-                remark TEXT
-            )''',
-        'create_parent': '''
-            CREATE TABLE IF NOT EXISTS Parent (
-                id INTEGER PRIMARY KEY,
-                year_month_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                order_num INTEGER NOT NULL,
-                UNIQUE(year_month_id, title)
-            )''',
-        'create_child': '''
-            CREATE TABLE IF NOT EXISTS Child (
-                id INTEGER PRIMARY KEY,
-                parent_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                order_num INTEGER NOT NULL,
-                UNIQUE(parent_id, title)
-            )''',
-        'create_item': '''
-            CREATE TABLE IF NOT EXISTS Item (
-                id INTEGER PRIMARY KEY,
-                child_id INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                description TEXT NOT NULL,
-                order_num INTEGER NOT NULL,
-                UNIQUE(child_id, amount, description)
-            )''',
-        'create_indices': [
-            'CREATE INDEX IF NOT EXISTS idx_parent_ym ON Parent(year_month_id)',
-            'CREATE INDEX IF NOT EXISTS idx_child_parent ON Child(parent_id)',
-            'CREATE INDEX IF NOT EXISTS idx_item_child ON Item(child_id)'
-        ],
-        'year_month_insert': 'INSERT INTO YearMonth (year_month) VALUES (?) ON CONFLICT(year_month) DO NOTHING',
-        'year_month_select': 'SELECT id FROM YearMonth WHERE year_month = ?',
-        'year_month_update_remark': 'UPDATE YearMonth SET remark = ? WHERE year_month = ?',
-        'parent_upsert': 'INSERT INTO Parent (year_month_id, title, order_num) VALUES (?, ?, ?) ON CONFLICT(year_month_id, title) DO UPDATE SET order_num = excluded.order_num',
-        'parent_select': 'SELECT id FROM Parent WHERE year_month_id = ? AND title = ?',
-        'child_upsert': 'INSERT INTO Child (parent_id, title, order_num) VALUES (?, ?, ?) ON CONFLICT(parent_id, title) DO UPDATE SET order_num = excluded.order_num',
-        'child_select': 'SELECT id FROM Child WHERE parent_id = ? AND title = ?',
-        'item_upsert': 'INSERT INTO Item (child_id, amount, description, order_num) VALUES (?, ?, ?, ?) ON CONFLICT(child_id, amount, description) DO UPDATE SET order_num = excluded.order_num'
-    }
-    # --- End SQL Definitions ---
-
-    def __init__(self, db_name: str = 'bills.db'):
-        self.db_name = db_name
-        self.conn: Optional[sqlite3.Connection] = None
-        self.cursor: Optional[sqlite3.Cursor] = None
-
-    def __enter__(self):
-        """Opens the database connection and prepares a cursor."""
-        try:
-            self.conn = sqlite3.connect(self.db_name)
-            self.cursor = self.conn.cursor()
-            return self
-        except sqlite3.Error as e:
-            print(f"{RED}Failed to connect to database {self.db_name}: {e}{RESET}")
-            raise
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Commits or rolls back the transaction and closes the connection."""
-        if self.conn:
-            if exc_type:
-                self.conn.rollback()
-            else:
-                self.conn.commit()
-            self.conn.close()
-
-    def _execute_script(self, script: str):
-        if self.cursor:
-            self.cursor.executescript(script)
-            
-    def _execute(self, sql_key: str, params: tuple = ()):
-        if self.cursor:
-            sql = self.SQL_DEFINITIONS[sql_key]
-            self.cursor.execute(sql, params)
-            return self.cursor
-        return None
-
-    def _executemany(self, sql_key: str, params_list: list):
-        if self.cursor:
-            sql = self.SQL_DEFINITIONS[sql_key]
-            self.cursor.executemany(sql, params_list)
-
-
-    def create_schema(self) -> bool:
-        """Creates database schema. Returns True on success, False on failure."""
-        try:
-            for key in ['create_year_month', 'create_parent', 'create_child', 'create_item']:
-                self._execute(key)
-            for index_query in self.SQL_DEFINITIONS['create_indices']:
-                 if self.cursor:
-                    self.cursor.execute(index_query)
-            print(f"{GREEN}Database schema created/verified successfully.{RESET}")
-            return True
-        except sqlite3.Error as e:
-            print(f"{RED}Error during database schema creation: {e}{RESET}")
-            return False
-
-    def upsert_year_month(self, year_month: str) -> Optional[int]:
-        self._execute('year_month_insert', (year_month,))
-        cursor = self._execute('year_month_select', (year_month,))
-        result = cursor.fetchone() if cursor else None
-        return result[0] if result else None
-
-    def update_year_month_remark(self, remark: str, year_month: str):
-        self._execute('year_month_update_remark', (remark, year_month))
-
-    def upsert_parent(self, year_month_id: int, title: str, order_num: int) -> Optional[int]:
-        self._execute('parent_upsert', (year_month_id, title, order_num))
-        cursor = self._execute('parent_select', (year_month_id, title))
-        result = cursor.fetchone() if cursor else None
-        return result[0] if result else None
-        
-    def upsert_child(self, parent_id: int, title: str, order_num: int) -> Optional[int]:
-        self._execute('child_upsert', (parent_id, title, order_num))
-        cursor = self._execute('child_select', (parent_id, title))
-        result = cursor.fetchone() if cursor else None
-        return result[0] if result else None
-
-    def bulk_upsert_items(self, items: list):
-        if items:
-            self._executemany('item_upsert', items)
-
-
-class DataProcessor:
-    """
-    Processes a stream of structured data and uses a DatabaseManager
-    to insert it into the database.
-    """
-    ITEM_BATCH_SIZE = 100
-
-    def __init__(self, db_manager: DatabaseManager):
-        self.db = db_manager
-        self.current_year_month_id: Optional[int] = None
-        self.current_parent_id: Optional[int] = None
-        self.current_child_id: Optional[int] = None
-        self.items_batch: list = []
-
-    def process_stream(self, data_stream: Iterator[Dict[str, Any]]) -> bool:
-        """
-        Processes the data stream record by record.
-        Returns True on success, False on failure.
-        """
-        try:
-            for record in data_stream:
-                self._process_record(record)
-            
-            self._flush_items_batch() # Final flush for any remaining items
-            return True
-        except ValueError as e:
-            print(f"{RED}Data processing failed. Error: {e}{RESET}")
-            return False
-        except Exception as e:
-            # Catch any other unexpected errors during processing
-            print(f"{RED}An unexpected error occurred during data processing: {e}{RESET}")
-            return False
-            
-    def _process_record(self, record: Dict[str, Any]):
-        """Routes a single record to the appropriate handler."""
-        record_type = record['type']
-        line_num = record.get('line_num', 'N/A')
-
-        try:
-            handler = getattr(self, f"_handle_{record_type}")
-            handler(record)
-        except (AttributeError, TypeError):
-             raise ValueError(f"Unknown or malformed record type '{record_type}' at line {line_num}.")
-        except ValueError as e:
-            # Re-raise ValueErrors with more context
-            raise ValueError(f"Error processing record (approx. line {line_num}): {record}. Details: {e}")
-
-
-    def _flush_items_batch(self):
-        """Writes the current batch of items to the database."""
-        if self.items_batch:
-            self.db.bulk_upsert_items(self.items_batch)
-            self.items_batch = []
-            
-    def _handle_year_month(self, record: Dict[str, Any]):
-        self._flush_items_batch()
-        self.current_year_month_id = self.db.upsert_year_month(record['value'])
-        if not self.current_year_month_id:
-            raise ValueError(f"Failed to insert/find YearMonth ID for {record['value']}")
-        # Reset downstream IDs
-        self.current_parent_id = None
-        self.current_child_id = None
-
-    def _handle_remark(self, record: Dict[str, Any]):
-        if not record.get('year_month'):
-            raise ValueError(f"Remark '{record['text']}' found without an associated DATE.")
-        self.db.update_year_month_remark(record['text'], record['year_month'])
-        
-    def _handle_parent(self, record: Dict[str, Any]):
-        if not self.current_year_month_id:
-            raise ValueError(f"Parent '{record['title']}' found without a preceding DATE.")
-        self._flush_items_batch()
-        self.current_parent_id = self.db.upsert_parent(
-            self.current_year_month_id, record['title'], record['order_num']
-        )
-        if not self.current_parent_id:
-            raise ValueError(f"Failed to get Parent ID for '{record['title']}'")
-        # Reset downstream ID
-        self.current_child_id = None
-        
-    def _handle_child(self, record: Dict[str, Any]):
-        if not self.current_parent_id:
-            raise ValueError(f"Child '{record['title']}' found without a preceding PARENT.")
-        self._flush_items_batch()
-        self.current_child_id = self.db.upsert_child(
-            self.current_parent_id, record['title'], record['order_num']
-        )
-        if not self.current_child_id:
-            raise ValueError(f"Failed to get Child ID for '{record['title']}'")
-
-    def _handle_item(self, record: Dict[str, Any]):
-        if not self.current_child_id:
-            raise ValueError(f"Item '{record['description']}' found without a preceding CHILD.")
-        
-        self.items_batch.append((
-            self.current_child_id,
-            record['amount'],
-            record['description'],
-            record['order_num']
-        ))
-        
-        if len(self.items_batch) >= self.ITEM_BATCH_SIZE:
-            self._flush_items_batch()
-
-# ==============================================================================
-# 公共接口函数
-# ==============================================================================
-
-def create_database(db_name: str = 'bills.db') -> bool:
-    """
-    Creates and initializes the database schema.
-
-    Args:
-        db_name: The name of the database file.
-
-    Returns:
-        True if successful, False otherwise.
-    """
-    try:
-        with DatabaseManager(db_name) as db:
-            return db.create_schema()
-    except Exception as e:
-        # The DatabaseManager will print its own connection error.
-        # This catches other potential issues.
-        print(f"{RED}An unexpected error occurred during DB creation: {e}{RESET}")
-        return False
-
-
-def insert_data(data_stream: Iterator[Dict[str, Any]], db_name: str = 'bills.db') -> bool:
-    """
-    High-level function to process a stream of data and insert it into the database.
-    This function handles database connection, processing, and transactions.
-
-    Args:
-        data_stream: An iterator yielding structured dictionaries.
-        db_name: The name of the database file to use.
-
-    Returns:
-        True on success, False on failure.
-    """
-    print("Starting database insertion process...")
-    try:
-        with DatabaseManager(db_name) as db_manager:
-            processor = DataProcessor(db_manager)
-            success = processor.process_stream(data_stream)
-            if success:
-                print(f"{GREEN}Data insertion process completed successfully.{RESET}")
-            else:
-                # Error message will be printed by the processor
-                print(f"{RED}Data insertion process failed. Rolling back changes.{RESET}")
-            return success
-    except sqlite3.Error as e:
-        print(f"{RED}A database error occurred: {e}. The transaction has been rolled back.{RESET}")
-        return False
-    except Exception as e:
-        print(f"{RED}An unexpected error occurred: {e}. The transaction has been rolled back.{RESET}")
-        return False
\ No newline at end of file
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Dict, Any, Optional, List
+
+# 从 common.py 导入颜色
+from common import RED, GREEN, YELLOW, RESET
+from TextParser.description_key import group_duplicates, item_fingerprint, load_description_rules
+from TextParser.search_tokenizer import tokenize_for_search
+from .db_config import DEFAULT_DATABASE_CONFIG, WRITER_SETTING_KEYS, writer_settings
+from .shard_catalog import ShardCatalog, split_records_by_year
+
+JOURNAL_MODES = ('delete', 'wal')
+BUSY_RETRY_BACKOFF_SECONDS = 0.5
+# Suspected duplicate groups listed at the end of an import; the on-demand report lists all.
+REPORTED_DUPLICATE_GROUPS = 20
+
+
+class DatabaseManager:
+    """
+    Manages all database interactions including connection, schema creation,
+    and data manipulation.
+    """
+
+    # --- SQL Definitions ---
+    SQL_DEFINITIONS = {
+        'create_year_month': '''
+            CREATE TABLE IF NOT EXISTS YearMonth (
+                id INTEGER PRIMARY KEY,
+                year_month TEXT UNIQUE NOT NULL,
+                remark TEXT
+            )''',
+        # Dictionary tables: every distinct category title (parent or child) and item
+        # description is stored once; Parent, Child and Item refer to them by id.
+        'create_category': '''
+            CREATE TABLE IF NOT EXISTS Category (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            )''',
+        # key is the normalized description (see TextParser.description_key), computed
+        # on insert; rollups group by it so spelling variants of one expense add up.
+        'create_description': '''
+            CREATE TABLE IF NOT EXISTS Description (
+                id INTEGER PRIMARY KEY,
+                text TEXT UNIQUE NOT NULL,
+                key TEXT
+            )''',
+        # Fingerprint of the normalization rules the stored keys were computed with.
+        'create_description_key_state': '''
+            CREATE TABLE IF NOT EXISTS DescriptionKeyState (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                rules_fingerprint TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )''',
+        'create_parent': '''
+            CREATE TABLE IF NOT EXISTS Parent (
+                id INTEGER PRIMARY KEY,
+                year_month_id INTEGER NOT NULL,
+                title_id INTEGER NOT NULL,
+                order_num INTEGER NOT NULL,
+                UNIQUE(year_month_id, title_id)
+            )''',
+        'create_child': '''
+            CREATE TABLE IF NOT EXISTS Child (
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER NOT NULL,
+                title_id INTEGER NOT NULL,
+                order_num INTEGER NOT NULL,
+                UNIQUE(parent_id, title_id)
+            )''',
+        'create_item': '''
+            CREATE TABLE IF NOT EXISTS Item (
+                id INTEGER PRIMARY KEY,
+                child_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                description_id INTEGER NOT NULL,
+                order_num INTEGER NOT NULL,
+                fingerprint INTEGER,
+                UNIQUE(child_id, amount, description_id)
+            )''',
+        'create_item_search': '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS ItemSearch USING fts5(tokens)''',
+        'create_import_checkpoint': '''
+            CREATE TABLE IF NOT EXISTS ImportCheckpoint (
+                run_id TEXT PRIMARY KEY,
+                blocks_done INTEGER NOT NULL,
+                last_year_month TEXT,
+                updated_at TEXT NOT NULL
+            )''',
+        'create_indices': [
+            'CREATE INDEX IF NOT EXISTS idx_parent_ym ON Parent(year_month_id)',
+            'CREATE INDEX IF NOT EXISTS idx_child_parent ON Child(parent_id)',
+            'CREATE INDEX IF NOT EXISTS idx_item_child ON Item(child_id)',
+            # Lets the top-N / amount-threshold queries walk items by amount instead of sorting the table.
+            'CREATE INDEX IF NOT EXISTS idx_item_amount ON Item(amount)',
+            # Description rollups for one key look its descriptions up by key, then their items.
+            'CREATE INDEX IF NOT EXISTS idx_description_key ON Description(key)',
+            'CREATE INDEX IF NOT EXISTS idx_item_description ON Item(description_id)',
+            # Duplicate detection: items with equal fingerprints are adjacent in this index.
+            'CREATE INDEX IF NOT EXISTS idx_item_fingerprint ON Item(fingerprint)'
+        ],
+        'year_month_insert': 'INSERT INTO YearMonth (year_month) VALUES (?) ON CONFLICT(year_month) DO NOTHING',
+        'year_month_select': 'SELECT id FROM YearMonth WHERE year_month = ?',
+        'year_month_update_remark': 'UPDATE YearMonth SET remark = ? WHERE year_month = ?',
+        'category_insert': 'INSERT INTO Category (name) VALUES (?) ON CONFLICT(name) DO NOTHING',
+        'category_select': 'SELECT id FROM Category WHERE name = ?',
+        'description_insert': 'INSERT INTO Description (text, key) VALUES (?1, bill_description_key(?1)) ON CONFLICT(text) DO NOTHING',
+        'description_select': 'SELECT id FROM Description WHERE text = ?',
+        'parent_upsert': 'INSERT INTO Parent (year_month_id, title_id, order_num) VALUES (?, ?, ?) ON CONFLICT(year_month_id, title_id) DO UPDATE SET order_num = excluded.order_num',
+        'parent_select': 'SELECT id FROM Parent WHERE year_month_id = ? AND title_id = ?',
+        'child_upsert': 'INSERT INTO Child (parent_id, title_id, order_num) VALUES (?, ?, ?) ON CONFLICT(parent_id, title_id) DO UPDATE SET order_num = excluded.order_num',
+        'child_select': 'SELECT id FROM Child WHERE parent_id = ? AND title_id = ?',
+        'item_upsert': 'INSERT INTO Item (child_id, amount, description_id, order_num) VALUES (?, ?, ?, ?) ON CONFLICT(child_id, amount, description_id) DO UPDATE SET order_num = excluded.order_num',
+        # ItemSearch rowids mirror Item ids. Upserts never change the description of an
+        # existing row, so only Item rows newer than the highest indexed rowid need indexing.
+        'item_search_sync': '''
+            INSERT INTO ItemSearch (rowid, tokens)
+            SELECT i.id, bill_search_tokens(d.text) FROM Item i JOIN Description d ON d.id = i.description_id
+            WHERE i.id > IFNULL((SELECT rowid FROM ItemSearch ORDER BY rowid DESC LIMIT 1), 0)
+            ORDER BY i.id''',
+        # Replace-month mode: drop a month's whole Parent/Child/Item subtree (and its
+        # search index entries), then insert the new contents without conflict handling.
+        'year_month_clear_remark': 'UPDATE YearMonth SET remark = NULL WHERE id = ?',
+        'month_search_delete': '''
+            DELETE FROM ItemSearch WHERE rowid IN (
+                SELECT i.id FROM Item i
+                JOIN Child c ON i.child_id = c.id
+                JOIN Parent p ON c.parent_id = p.id
+                WHERE p.year_month_id = ?
+            )''',
+        'month_item_delete': '''
+            DELETE FROM Item WHERE child_id IN (
+                SELECT c.id FROM Child c JOIN Parent p ON c.parent_id = p.id WHERE p.year_month_id = ?
+            )''',
+        'month_child_delete': 'DELETE FROM Child WHERE parent_id IN (SELECT id FROM Parent WHERE year_month_id = ?)',
+        'month_parent_delete': 'DELETE FROM Parent WHERE year_month_id = ?',
+        'parent_insert': 'INSERT INTO Parent (year_month_id, title_id, order_num) VALUES (?, ?, ?)',
+        'child_insert': 'INSERT INTO Child (parent_id, title_id, order_num) VALUES (?, ?, ?)',
+        'item_insert': 'INSERT INTO Item (child_id, amount, description_id, order_num) VALUES (?, ?, ?, ?)',
+        'checkpoint_select': 'SELECT blocks_done FROM ImportCheckpoint WHERE run_id = ?',
+        'checkpoint_upsert': 'INSERT INTO ImportCheckpoint (run_id, blocks_done, last_year_month, updated_at) VALUES (?, ?, ?, ?) ON CONFLICT(run_id) DO UPDATE SET blocks_done = excluded.blocks_done, last_year_month = excluded.last_year_month, updated_at = excluded.updated_at',
+        'checkpoint_delete': 'DELETE FROM ImportCheckpoint WHERE run_id = ?',
+        # Description keys: with unchanged rules only keys that were never computed are
+        # filled in; after a rules change every key is recomputed, but only the rows
+        # whose key actually changes are written.
+        'description_key_column': "SELECT COUNT(*) FROM pragma_table_info('Description') WHERE name = 'key'",
+        'description_key_add_column': 'ALTER TABLE Description ADD COLUMN key TEXT',
+        'description_key_state_select': 'SELECT rules_fingerprint FROM DescriptionKeyState WHERE id = 1',
+        'description_key_state_upsert': 'INSERT INTO DescriptionKeyState (id, rules_fingerprint, updated_at) VALUES (1, ?, ?) ON CONFLICT(id) DO UPDATE SET rules_fingerprint = excluded.rules_fingerprint, updated_at = excluded.updated_at',
+        'description_key_fill': 'UPDATE Description SET key = bill_description_key(text) WHERE key IS NULL',
+        'description_key_rebuild': 'UPDATE Description SET key = bill_description_key(text) WHERE key IS NOT bill_description_key(text)',
+        # Duplicate fingerprints (see TextParser.description_key.item_fingerprint) of
+        # (year_month, amount, description key). Items get theirs at the next sync after
+        # they are written; a description whose key changes resets the fingerprints of
+        # its items. The items fingerprinted by a sync are kept in FingerprintPending so
+        # the ones matching another item can be reported.
+        'item_fingerprint_column': "SELECT COUNT(*) FROM pragma_table_info('Item') WHERE name = 'fingerprint'",
+        'item_fingerprint_add_column': 'ALTER TABLE Item ADD COLUMN fingerprint INTEGER',
+        'item_fingerprint_reset_rekeyed': '''
+            UPDATE Item SET fingerprint = NULL
+            WHERE description_id IN (SELECT id FROM Description WHERE key IS NOT bill_description_key(text))''',
+        'create_fingerprint_pending': 'CREATE TEMP TABLE IF NOT EXISTS FingerprintPending (id INTEGER PRIMARY KEY)',
+        'fingerprint_pending_fill': 'INSERT INTO FingerprintPending (id) SELECT id FROM Item WHERE fingerprint IS NULL',
+        'fingerprint_pending_clear': 'DELETE FROM FingerprintPending',
+        'item_fingerprint_sync': '''
+            UPDATE Item SET fingerprint = (
+                SELECT bill_item_fingerprint(ym.year_month, Item.amount, d.key)
+                FROM Child c
+                JOIN Parent p ON p.id = c.parent_id
+                JOIN YearMonth ym ON ym.id = p.year_month_id
+                JOIN Description d ON d.id = Item.description_id
+                WHERE c.id = Item.child_id
+            )
+            WHERE id IN (SELECT id FROM FingerprintPending)''',
+        'item_fingerprint_matches': '''
+            SELECT ym.year_month, i.amount, d.key, pc.name, cc.name, d.text, i.id IN (SELECT id FROM FingerprintPending)
+            FROM Item i
+            JOIN Child c ON c.id = i.child_id
+            JOIN Parent p ON p.id = c.parent_id
+            JOIN YearMonth ym ON ym.id = p.year_month_id
+            JOIN Category pc ON pc.id = p.title_id
+            JOIN Category cc ON cc.id = c.title_id
+            JOIN Description d ON d.id = i.description_id
+            WHERE i.fingerprint IN (
+                SELECT n.fingerprint FROM FingerprintPending f JOIN Item n ON n.id = f.id
+                WHERE EXISTS (SELECT 1 FROM Item o WHERE o.fingerprint = n.fingerprint AND o.id <> n.id)
+            )
+            ORDER BY ym.year_month, i.fingerprint, i.id''',
+        'item_search_rebuild': [
+            'DELETE FROM ItemSearch',
+            '''INSERT INTO ItemSearch (rowid, tokens)
+               SELECT i.id, bill_search_tokens(d.text) FROM Item i JOIN Description d ON d.id = i.description_id'''
+        ],
+        # Staging-table bulk loader: records are collected into TEMP tables (seq keeps the
+        # stream order, block numbers the DATE block) and resolved into the real tables
+        # with set-based INSERT ... SELECT. Titles and descriptions are staged as their
+        # dictionary ids, which the loader resolves while staging.
+        'create_staging': [
+            'CREATE TEMP TABLE IF NOT EXISTS StageMonth (block INTEGER PRIMARY KEY, year_month TEXT NOT NULL)',
+            '''CREATE TEMP TABLE IF NOT EXISTS StageRemark (
+                seq INTEGER PRIMARY KEY, block INTEGER NOT NULL, year_month TEXT NOT NULL, remark TEXT
+            )''',
+            '''CREATE TEMP TABLE IF NOT EXISTS StageParent (
+                seq INTEGER PRIMARY KEY, block INTEGER NOT NULL, year_month TEXT NOT NULL,
+                title_id INTEGER NOT NULL, order_num INTEGER NOT NULL
+            )''',
+            '''CREATE TEMP TABLE IF NOT EXISTS StageChild (
+                seq INTEGER PRIMARY KEY, block INTEGER NOT NULL, year_month TEXT NOT NULL, parent_title_id INTEGER NOT NULL,
+                title_id INTEGER NOT NULL, order_num INTEGER NOT NULL
+            )''',
+            '''CREATE TEMP TABLE IF NOT EXISTS StageItem (
+                seq INTEGER PRIMARY KEY, block INTEGER NOT NULL, year_month TEXT NOT NULL, parent_title_id INTEGER NOT NULL,
+                child_title_id INTEGER NOT NULL, amount REAL NOT NULL, description_id INTEGER NOT NULL,
+                order_num INTEGER NOT NULL
+            )'''
+        ],
+        'stage_month_insert': 'INSERT INTO StageMonth (block, year_month) VALUES (?, ?)',
+        'stage_remark_insert': 'INSERT INTO StageRemark (block, year_month, remark) VALUES (?, ?, ?)',
+        'stage_parent_insert': 'INSERT INTO StageParent (block, year_month, title_id, order_num) VALUES (?, ?, ?, ?)',
+        'stage_child_insert': '''
+            INSERT INTO StageChild (block, year_month, parent_title_id, title_id, order_num) VALUES (?, ?, ?, ?, ?)''',
+        'stage_item_insert': '''
+            INSERT INTO StageItem (block, year_month, parent_title_id, child_title_id, amount, description_id, order_num)
+            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        # Rows are created in order of their first occurrence, so ids match the per-record
+        # path. With :upsert every block is merged and a repeated parent/child/item keeps
+        # the order_num of its last occurrence; otherwise (replace) only the last block of
+        # each month counts and the first occurrence within it wins.
+        'staging_year_month_insert': '''
+            INSERT INTO YearMonth (year_month)
+            SELECT year_month FROM StageMonth WHERE true ORDER BY block
+            ON CONFLICT(year_month) DO NOTHING''',
+        'staging_remark_update': '''
+            UPDATE YearMonth SET remark = (
+                SELECT r.remark FROM StageRemark r
+                WHERE r.year_month = YearMonth.year_month
+                  AND (:upsert OR r.block IN (SELECT MAX(block) FROM StageMonth GROUP BY year_month))
+                ORDER BY r.seq DESC LIMIT 1
+            )
+            WHERE year_month IN (SELECT year_month FROM StageRemark)''',
+        'staging_parent_upsert': '''
+            INSERT INTO Parent (year_month_id, title_id, order_num)
+            SELECT ym.id, s.title_id, s.order_num
+            FROM (
+                SELECT year_month, title_id, MIN(seq) AS first_seq,
+                       CASE WHEN :upsert THEN MAX(seq) ELSE MIN(seq) END AS pick_seq
+                FROM StageParent
+                WHERE :upsert OR block IN (SELECT MAX(block) FROM StageMonth GROUP BY year_month)
+                GROUP BY year_month, title_id
+            ) g
+            JOIN StageParent s ON s.seq = g.pick_seq
+            JOIN YearMonth ym ON ym.year_month = g.year_month
+            WHERE true ORDER BY g.first_seq
+            ON CONFLICT(year_month_id, title_id) DO UPDATE SET order_num = excluded.order_num''',
+        'staging_child_upsert': '''
+            INSERT INTO Child (parent_id, title_id, order_num)
+            SELECT p.id, s.title_id, s.order_num
+            FROM (
+                SELECT year_month, parent_title_id, title_id, MIN(seq) AS first_seq,
+                       CASE WHEN :upsert THEN MAX(seq) ELSE MIN(seq) END AS pick_seq
+                FROM StageChild
+                WHERE :upsert OR block IN (SELECT MAX(block) FROM StageMonth GROUP BY year_month)
+                GROUP BY year_month, parent_title_id, title_id
+            ) g
+            JOIN StageChild s ON s.seq = g.pick_seq
+            JOIN YearMonth ym ON ym.year_month = g.year_month
+            JOIN Parent p ON p.year_month_id = ym.id AND p.title_id = g.parent_title_id
+            WHERE true ORDER BY g.first_seq
+            ON CONFLICT(parent_id, title_id) DO UPDATE SET order_num = excluded.order_num''',
+        'staging_item_upsert': '''
+            INSERT INTO Item (child_id, amount, description_id, order_num)
+            SELECT c.id, s.amount, s.description_id, s.order_num
+            FROM (
+                SELECT year_month, parent_title_id, child_title_id, amount, description_id, MIN(seq) AS first_seq,
+                       CASE WHEN :upsert THEN MAX(seq) ELSE MIN(seq) END AS pick_seq
+                FROM StageItem
+                WHERE :upsert OR block IN (SELECT MAX(block) FROM StageMonth GROUP BY year_month)
+                GROUP BY year_month, parent_title_id, child_title_id, amount, description_id
+            ) g
+            JOIN StageItem s ON s.seq = g.pick_seq
+            JOIN YearMonth ym ON ym.year_month = g.year_month
+            JOIN Parent p ON p.year_month_id = ym.id AND p.title_id = g.parent_title_id
+            JOIN Child c ON c.parent_id = p.id AND c.title_id = g.child_title_id
+            WHERE true ORDER BY g.first_seq
+            ON CONFLICT(child_id, amount, description_id) DO UPDATE SET order_num = excluded.order_num''',
+        # Replace-month mode: repeats of an item within one child of the loaded block, which
+        # the UNIQUE(child_id, amount, description_id) constraint merges into its first occurrence.
+        'staging_merged_items': '''
+            SELECT s.year_month, pc.name, cc.name, s.amount, d.text, COUNT(*) - 1
+            FROM StageItem s
+            JOIN Category pc ON pc.id = s.parent_title_id
+            JOIN Category cc ON cc.id = s.child_title_id
+            JOIN Description d ON d.id = s.description_id
+            WHERE s.block IN (SELECT MAX(block) FROM StageMonth GROUP BY year_month)
+            GROUP BY s.year_month, s.parent_title_id, s.child_title_id, s.amount, s.description_id
+            HAVING COUNT(*) > 1
+            ORDER BY MIN(s.seq)''',
+        # Replace-month mode: the month_*_delete statements above, for every staged month at once.
+        'staging_month_replace': [
+            '''UPDATE YearMonth SET remark = NULL
+               WHERE year_month IN (SELECT year_month FROM StageMonth)''',
+            '''DELETE FROM ItemSearch WHERE rowid IN (
+                SELECT i.id FROM Item i
+                JOIN Child c ON i.child_id = c.id
+                JOIN Parent p ON c.parent_id = p.id
+                JOIN YearMonth ym ON p.year_month_id = ym.id
+                WHERE ym.year_month IN (SELECT year_month FROM StageMonth)
+            )''',
+            '''DELETE FROM Item WHERE child_id IN (
+                SELECT c.id FROM Child c
+                JOIN Parent p ON c.parent_id = p.id
+                JOIN YearMonth ym ON p.year_month_id = ym.id
+                WHERE ym.year_month IN (SELECT year_month FROM StageMonth)
+            )''',
+            '''DELETE FROM Child WHERE parent_id IN (
+                SELECT p.id FROM Parent p JOIN YearMonth ym ON p.year_month_id = ym.id
+                WHERE ym.year_month IN (SELECT year_month FROM StageMonth)
+            )''',
+            '''DELETE FROM Parent WHERE year_month_id IN (
+                SELECT id FROM YearMonth WHERE year_month IN (SELECT year_month FROM StageMonth)
+            )'''
+        ],
+        # Databases created before the dictionary tables store titles and descriptions
+        # inline. They are converted in place, keeping every Parent/Child/Item id (and
+        # so the ItemSearch rowids): the old tables are renamed, the new ones created
+        # with create_parent/create_child/create_item and filled from the old ones.
+        'legacy_title_columns': "SELECT COUNT(*) FROM pragma_table_info('Parent') WHERE name = 'title'",
+        'legacy_rename': [
+            'ALTER TABLE Parent RENAME TO LegacyParent',
+            'ALTER TABLE Child RENAME TO LegacyChild',
+            'ALTER TABLE Item RENAME TO LegacyItem'
+        ],
+        'legacy_copy': [
+            '''INSERT INTO Category (name)
+               SELECT title FROM (SELECT title, id FROM LegacyParent UNION ALL SELECT title, id FROM LegacyChild)
+               WHERE true GROUP BY title ORDER BY MIN(id)
+               ON CONFLICT(name) DO NOTHING''',
+            '''INSERT INTO Description (text, key)
+               SELECT description, bill_description_key(description) FROM LegacyItem
+               WHERE true GROUP BY description ORDER BY MIN(id)
+               ON CONFLICT(text) DO NOTHING''',
+            '''INSERT INTO Parent (id, year_month_id, title_id, order_num)
+               SELECT p.id, p.year_month_id, c.id, p.order_num FROM LegacyParent p JOIN Category c ON c.name = p.title''',
+            '''INSERT INTO Child (id, parent_id, title_id, order_num)
+               SELECT ch.id, ch.parent_id, c.id, ch.order_num FROM LegacyChild ch JOIN Category c ON c.name = ch.title''',
+            '''INSERT INTO Item (id, child_id, amount, description_id, order_num)
+               SELECT i.id, i.child_id, i.amount, d.id, i.order_num FROM LegacyItem i JOIN Description d ON d.text = i.description''',
+            'DROP TABLE LegacyParent',
+            'DROP TABLE LegacyChild',
+            'DROP TABLE LegacyItem'
+        ],
+        'staging_clear': [
+            'DELETE FROM StageMonth',
+            'DELETE FROM StageRemark',
+            'DELETE FROM StageParent',
+            'DELETE FROM StageChild',
+            'DELETE FROM StageItem'
+        ]
+    }
+    # --- End SQL Definitions ---
+
+    def __init__(self, db_name: str = 'bills.db', settings: Optional[Dict[str, Any]] = None):
+        """
+        ``settings`` holds the writer options (see db_config.writer_settings):
+        journal_mode, busy_timeout_ms, busy_retries, wal_checkpoint_pages and
+        description_rules_path and report_duplicates. Missing keys fall back to the
+        database_config defaults.
+        """
+        self.db_name = db_name
+        self.settings = {key: DEFAULT_DATABASE_CONFIG[key] for key in WRITER_SETTING_KEYS}
+        self.settings.update(settings or {})
+        self.journal_mode = str(self.settings['journal_mode']).lower()
+        if self.journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode '{self.settings['journal_mode']}'. "
+                             f"Expected one of: {', '.join(JOURNAL_MODES)}")
+        self.description_rules = load_description_rules(self.settings['description_rules_path'])
+        self.conn: Optional[sqlite3.Connection] = None
+        self.cursor: Optional[sqlite3.Cursor] = None
+        # In-memory caches of the dictionary tables (string -> id), filled on first use.
+        # A rollback can discard newly created ids, so it clears them.
+        self.category_ids: Dict[str, int] = {}
+        self.description_ids: Dict[str, int] = {}
+
+    def __enter__(self):
+        """Opens the database connection, applies the journal mode and prepares a cursor."""
+        try:
+            self.conn = sqlite3.connect(self.db_name, timeout=self.settings['busy_timeout_ms'] / 1000)
+            # Write transactions take the write lock up front (BEGIN IMMEDIATE), so a busy
+            # database is only ever reported when a transaction starts and can be retried there.
+            self.conn.isolation_level = 'IMMEDIATE'
+            self.conn.create_function('bill_search_tokens', 1, tokenize_for_search, deterministic=True)
+            self.conn.create_function('bill_description_key', 1, self.description_rules.key, deterministic=True)
+            self.conn.create_function('bill_item_fingerprint', 3, item_fingerprint, deterministic=True)
+            self.cursor = self.conn.cursor()
+            self._apply_journal_mode()
+            return self
+        except sqlite3.Error as e:
+            print(f"{RED}Failed to connect to database {self.db_name}: {e}{RESET}")
+            if self.conn:
+                self.conn.close()
+            raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Commits or rolls back the transaction, truncates the WAL and closes the connection."""
+        if self.conn:
+            try:
+                if exc_type:
+                    self.conn.rollback()
+                else:
+                    self.commit()
+                    self.checkpoint_wal('TRUNCATE')
+            finally:
+                self.conn.close()
+
+    def _apply_journal_mode(self):
+        """
+        Switches the database to the configured journal mode. WAL is persistent, so
+        readers opened by the query modules see it as well; in WAL mode they read a
+        consistent snapshot while an import is writing instead of waiting for it.
+        """
+        current = self.conn.execute('PRAGMA journal_mode').fetchone()[0].lower()
+        if current != self.journal_mode:
+            # Changing the mode needs every other connection to be closed; if that does
+            # not happen within the retries, the import continues in the current mode.
+            try:
+                current = self._retry_busy(
+                    lambda: self.conn.execute(f'PRAGMA journal_mode={self.journal_mode}').fetchone()[0]
+                ).lower()
+            except sqlite3.OperationalError as e:
+                print(f"{YELLOW}Could not switch {self.db_name} to journal mode "
+                      f"'{self.journal_mode}' ({e}); it stays in '{current}'.{RESET}")
+            self.journal_mode = current
+        if self.journal_mode == 'wal':
+            pages = int(self.settings['wal_checkpoint_pages'])
+            page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+            self.conn.execute(f'PRAGMA wal_autocheckpoint={pages}')
+            # A WAL that grew while readers pinned old snapshots is cut back to this size
+            # the next time it is reset, so it does not keep its peak size on disk.
+            self.conn.execute(f'PRAGMA journal_size_limit={pages * page_size}')
+
+    def _retry_busy(self, operation):
+        """
+        Runs ``operation``, retrying it with exponential backoff while the database
+        stays locked by another writer for longer than the busy timeout.
+        """
+        retries = int(self.settings['busy_retries'])
+        for attempt in range(retries + 1):
+            try:
+                return operation()
+            except sqlite3.OperationalError as e:
+                message = str(e).lower()
+                if attempt == retries or ('locked' not in message and 'busy' not in message):
+                    raise
+                delay = BUSY_RETRY_BACKOFF_SECONDS * (2 ** attempt)
+                print(f"{YELLOW}Database {self.db_name} is busy ({e}); "
+                      f"retrying in {delay:.1f}s ({attempt + 1}/{retries})...{RESET}")
+                time.sleep(delay)
+
+    def checkpoint_wal(self, mode: str = 'PASSIVE') -> Optional[tuple]:
+        """
+        Copies committed WAL frames back into the database file. PASSIVE never waits
+        for readers; TRUNCATE (used when the import finishes) waits up to the busy
+        timeout and then resets the WAL file to zero bytes. Does nothing outside WAL
+        mode. Returns SQLite's (busy, log_pages, checkpointed_pages) row.
+        """
+        if not self.conn or self.journal_mode != 'wal':
+            return None
+        try:
+            return self.conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        except sqlite3.Error as e:
+            # The data is already committed; a checkpoint that cannot run now is done later.
+            print(f"{YELLOW}WAL checkpoint of {self.db_name} skipped: {e}{RESET}")
+            return None
+
+    def commit(self):
+        if self.conn:
+            self._retry_busy(self.conn.commit)
+
+    def rollback(self):
+        if self.conn:
+            self.conn.rollback()
+        self.category_ids.clear()
+        self.description_ids.clear()
+
+    def _execute_script(self, script: str):
+        if self.cursor:
+            self.cursor.executescript(script)
+            
+    def _execute(self, sql_key: str, params: tuple = ()):
+        if self.cursor:
+            sql = self.SQL_DEFINITIONS[sql_key]
+            self._run_statement(lambda: self.cursor.execute(sql, params))
+            return self.cursor
+        return None
+
+    def _executemany(self, sql_key: str, params_list: list):
+        if self.cursor:
+            sql = self.SQL_DEFINITIONS[sql_key]
+            self._run_statement(lambda: self.cursor.executemany(sql, params_list))
+
+    def _run_statement(self, operation):
+        """
+        Retries a statement on a busy database only when it opens a new transaction:
+        inside a transaction the write lock is already held, and re-running a
+        partially applied executemany would not be safe.
+        """
+        if self.conn.in_transaction:
+            return operation()
+        return self._retry_busy(operation)
+
+
+    def create_schema(self) -> bool:
+        """Creates database schema. Returns True on success, False on failure."""
+        try:
+            for key in ['create_year_month', 'create_category', 'create_description', 'create_parent',
+                        'create_child', 'create_item', 'create_item_search', 'create_import_checkpoint',
+                        'create_description_key_state']:
+                self._execute(key)
+            if not self._execute('description_key_column').fetchone()[0]:
+                self._execute('description_key_add_column')
+            if self._execute('legacy_title_columns').fetchone()[0]:
+                self._migrate_inline_strings()
+            if not self._execute('item_fingerprint_column').fetchone()[0]:
+                self._execute('item_fingerprint_add_column')
+            for index_query in self.SQL_DEFINITIONS['create_indices']:
+                 if self.cursor:
+                    self.cursor.execute(index_query)
+            updated = self.sync_description_keys()
+            if updated:
+                print(f"{GREEN}Normalized keys of {updated} description(s) updated.{RESET}")
+            # Backfills the fingerprints of older databases and of re-keyed items; the
+            # matches among them are what the on-demand duplicate report is for.
+            self.sync_item_fingerprints()
+            print(f"{GREEN}Database schema created/verified successfully.{RESET}")
+            return True
+        except sqlite3.Error as e:
+            print(f"{RED}Error during database schema creation: {e}{RESET}")
+            return False
+
+    def _migrate_inline_strings(self):
+        """Moves the inline titles and descriptions of an older database into the dictionary tables."""
+        print(f"{YELLOW}Moving the titles and descriptions of {self.db_name} into dictionary tables...{RESET}")
+        try:
+            if not self.conn.in_transaction:
+                self._retry_busy(lambda: self.conn.execute('BEGIN IMMEDIATE'))
+            self._execute_each('legacy_rename')
+            for key in ['create_parent', 'create_child', 'create_item']:
+                self._execute(key)
+            self._execute_each('legacy_copy')
+            self.commit()
+        except sqlite3.Error:
+            self.rollback()
+            raise
+        print(f"{GREEN}Conversion finished; run a VACUUM (database maintenance) to return the freed space.{RESET}")
+
+    def sync_description_keys(self) -> int:
+        """
+        Brings the stored description keys in line with the current normalization rules
+        and returns the number of descriptions whose key was (re)computed. Items are
+        never touched: they refer to descriptions by id.
+        """
+        fingerprint = self.description_rules.fingerprint
+        stored = self._execute('description_key_state_select').fetchone()
+        if stored and stored[0] == fingerprint:
+            return self._execute('description_key_fill').rowcount
+        self._execute('item_fingerprint_reset_rekeyed')
+        changed = self._execute('description_key_rebuild').rowcount
+        self._execute('description_key_state_upsert', (fingerprint, datetime.now().isoformat(timespec='seconds')))
+        return changed
+
+    def sync_item_fingerprints(self) -> List[tuple]:
+        """
+        Computes the duplicate fingerprint of every Item row that has none yet and
+        returns the suspected duplicates involving them: (year_month, amount, key,
+        parent, child, description, is_new) rows of all items sharing a fingerprint
+        with one of the new items, ordered so that each duplicate group is contiguous.
+        """
+        self._execute('create_fingerprint_pending')
+        try:
+            if not self._execute('fingerprint_pending_fill').rowcount:
+                return []
+            self._execute('item_fingerprint_sync')
+            return self._execute('item_fingerprint_matches').fetchall()
+        finally:
+            self._execute('fingerprint_pending_clear')
+
+    def _intern(self, kind: str, cache: Dict[str, int], value: str) -> int:
+        """Returns the dictionary id of ``value``, adding it to the ``kind`` table when it is new."""
+        value_id = cache.get(value)
+        if value_id is None:
+            self._execute(f'{kind}_insert', (value,))
+            cursor = self._execute(f'{kind}_select', (value,))
+            result = cursor.fetchone() if cursor else None
+            if not result:
+                raise ValueError(f"Failed to insert/find the {kind} id of '{value}'")
+            value_id = cache[value] = result[0]
+        return value_id
+
+    def category_id(self, title: str) -> int:
+        """The Category id of a parent or child title."""
+        return self._intern('category', self.category_ids, title)
+
+    def description_id(self, description: str) -> int:
+        """The Description id of an item description."""
+        return self._intern('description', self.description_ids, description)
+
+    def _items_with_description_ids(self, items: list) -> list:
+        """Replaces the descriptions of (child_id, amount, description, order_num) rows by their ids."""
+        return [(child_id, amount, self.description_id(description), order_num)
+                for child_id, amount, description, order_num in items]
+
+    def upsert_year_month(self, year_month: str) -> Optional[int]:
+        self._execute('year_month_insert', (year_month,))
+        cursor = self._execute('year_month_select', (year_month,))
+        result = cursor.fetchone() if cursor else None
+        return result[0] if result else None
+
+    def update_year_month_remark(self, remark: str, year_month: str):
+        self._execute('year_month_update_remark', (remark, year_month))
+
+    def upsert_parent(self, year_month_id: int, title: str, order_num: int) -> Optional[int]:
+        title_id = self.category_id(title)
+        self._execute('parent_upsert', (year_month_id, title_id, order_num))
+        cursor = self._execute('parent_select', (year_month_id, title_id))
+        result = cursor.fetchone() if cursor else None
+        return result[0] if result else None
+        
+    def upsert_child(self, parent_id: int, title: str, order_num: int) -> Optional[int]:
+        title_id = self.category_id(title)
+        self._execute('child_upsert', (parent_id, title_id, order_num))
+        cursor = self._execute('child_select', (parent_id, title_id))
+        result = cursor.fetchone() if cursor else None
+        return result[0] if result else None
+
+    def bulk_upsert_items(self, items: list):
+        """Upserts (child_id, amount, description, order_num) rows."""
+        if items:
+            self._executemany('item_upsert', self._items_with_description_ids(items))
+
+    def delete_month_contents(self, year_month_id: int):
+        """Removes every Parent, Child and Item of a month and clears its remark."""
+        for key in ['month_search_delete', 'month_item_delete', 'month_child_delete', 'month_parent_delete']:
+            self._execute(key, (year_month_id,))
+        self._execute('year_month_clear_remark', (year_month_id,))
+
+    def insert_parent(self, year_month_id: int, title: str, order_num: int) -> Optional[int]:
+        cursor = self._execute('parent_insert', (year_month_id, self.category_id(title), order_num))
+        return cursor.lastrowid if cursor else None
+
+    def insert_child(self, parent_id: int, title: str, order_num: int) -> Optional[int]:
+        cursor = self._execute('child_insert', (parent_id, self.category_id(title), order_num))
+        return cursor.lastrowid if cursor else None
+
+    def bulk_insert_items(self, items: list):
+        """Inserts (child_id, amount, description, order_num) rows."""
+        if items:
+            self._executemany('item_insert', self._items_with_description_ids(items))
+
+    def sync_search_index(self):
+        """Indexes the descriptions of Item rows that are not yet in ItemSearch."""
+        self._execute('item_search_sync')
+
+    def load_checkpoint(self, run_id: str) -> int:
+        """Returns how many DATE blocks of an import run are already durably imported."""
+        cursor = self._execute('checkpoint_select', (run_id,))
+        result = cursor.fetchone() if cursor else None
+        return result[0] if result else 0
+
+    def save_checkpoint(self, run_id: str, blocks_done: int, last_year_month: Optional[str]):
+        self._execute('checkpoint_upsert', (
+            run_id, blocks_done, last_year_month, datetime.now().isoformat(timespec='seconds')
+        ))
+
+    def clear_checkpoint(self, run_id: str):
+        self._execute('checkpoint_delete', (run_id,))
+
+    def rebuild_search_index(self):
+        """Rebuilds the full-text index of item descriptions from scratch."""
+        for sql in self.SQL_DEFINITIONS['item_search_rebuild']:
+            if self.cursor:
+                self.cursor.execute(sql)
+
+    def _execute_each(self, sql_key: str, params: tuple = ()):
+        """Runs every statement of a list-valued SQL definition with the same parameters."""
+        for sql in self.SQL_DEFINITIONS[sql_key]:
+            if self.cursor:
+                self._run_statement(lambda: self.cursor.execute(sql, params))
+
+    def create_staging_tables(self):
+        """Creates the connection's TEMP staging tables used by the bulk loader."""
+        self._execute_each('create_staging')
+
+    def stage_rows(self, kind: str, rows: list):
+        """Appends rows to a staging table ('month', 'remark', 'parent', 'child' or 'item')."""
+        if rows:
+            self._executemany(f'stage_{kind}_insert', rows)
+
+    def resolve_staging(self, replace: bool = False) -> List[tuple]:
+        """
+        Moves the staged rows into YearMonth/Parent/Child/Item with set-based statements
+        and empties the staging tables. With ``replace`` the staged months' contents
+        are deleted first and only the last DATE block of each month is loaded; the
+        repeated items merged while loading it are returned as (year_month, parent,
+        child, amount, description, dropped_copies) rows.
+        """
+        params = {'upsert': not replace}
+        merged_items = []
+        self._execute('staging_year_month_insert')
+        if replace:
+            cursor = self._execute('staging_merged_items')
+            merged_items = cursor.fetchall() if cursor else []
+            self._execute_each('staging_month_replace')
+        for key in ['staging_remark_update', 'staging_parent_upsert', 'staging_child_upsert', 'staging_item_upsert']:
+            self._execute(key, params)
+        self._execute_each('staging_clear')
+        return merged_items
+
+
+class DataProcessor:
+    """
+    Processes a stream of structured data and uses a DatabaseManager
+    to insert it into the database.
+    """
+    ITEM_BATCH_SIZE = 100
+
+    def __init__(self, db_manager: DatabaseManager, commit_every_months: int = 0, run_id: Optional[str] = None):
+        self.db = db_manager
+        self.current_year_month_id: Optional[int] = None
+        self.current_parent_id: Optional[int] = None
+        self.current_child_id: Optional[int] = None
+        self.items_batch: list = []
+
+        # Chunked-commit state. With commit_every_months == 0 the whole stream is
+        # imported in the caller's single transaction, as before.
+        self.commit_every_months = commit_every_months
+        self.run_id = run_id
+        self.blocks_started = 0
+        self.blocks_since_commit = 0
+        self.current_year_month: Optional[str] = None
+        self.skipping_block = False
+        self.resume_from = 0
+        if commit_every_months and run_id:
+            self.resume_from = self.db.load_checkpoint(run_id)
+        # Groups of items that share month, amount and description key with an item of this import.
+        self.suspected_duplicates: List[list] = []
+        # Replace mode: (year_month, parent, child, amount, description, dropped_copies) of the
+        # items repeated within one child of a month, which the Item UNIQUE constraint merges.
+        self.merged_items: List[list] = []
+
+    def process_stream(self, data_stream: Iterator[Dict[str, Any]]) -> bool:
+        """
+        Processes the data stream record by record.
+        Returns True on success, False on failure.
+        """
+        try:
+            if self.resume_from:
+                print(f"Resuming import run: skipping {self.resume_from} month block(s) already committed.")
+            for record in data_stream:
+                if record['type'] == 'year_month':
+                    self._start_block(record)
+                if self.skipping_block:
+                    continue
+                self._process_record(record)
+            
+            self._flush_items_batch() # Final flush for any remaining items
+            self.db.sync_search_index()
+            self._sync_fingerprints()
+            if self.commit_every_months and self.run_id:
+                self.db.clear_checkpoint(self.run_id)
+            self._report_duplicates()
+            self._report_merged_items()
+            return True
+        except ValueError as e:
+            print(f"{RED}Data processing failed. Error: {e}{RESET}")
+            return False
+        except Exception as e:
+            # Catch any other unexpected errors during processing
+            print(f"{RED}An unexpected error occurred during data processing: {e}{RESET}")
+            return False
+            
+    def _process_record(self, record: Dict[str, Any]):
+        """Routes a single record to the appropriate handler."""
+        record_type = record['type']
+        line_num = record.get('line_num', 'N/A')
+
+        try:
+            handler = getattr(self, f"_handle_{record_type}")
+            handler(record)
+        except (AttributeError, TypeError):
+             raise ValueError(f"Unknown or malformed record type '{record_type}' at line {line_num}.")
+        except ValueError as e:
+            # Re-raise ValueErrors with more context
+            raise ValueError(f"Error processing record (approx. line {line_num}): {record}. Details: {e}")
+
+
+    def _start_block(self, record: Dict[str, Any]):
+        """
+        Tracks DATE block boundaries for chunked commits. Blocks already covered by
+        the run's checkpoint are skipped; every N completed blocks are committed
+        together with an updated checkpoint.
+        """
+        self.blocks_started += 1
+        if self.blocks_started <= self.resume_from:
+            self.skipping_block = True
+            return
+        self.skipping_block = False
+        if self.commit_every_months and self.blocks_since_commit >= self.commit_every_months:
+            self._commit_chunk(self.blocks_started - 1)
+        self.blocks_since_commit += 1
+        self.current_year_month = record['value']
+
+    def _commit_chunk(self, blocks_done: int):
+        """Durably commits every block imported so far and records the checkpoint."""
+        self._flush_items_batch()
+        self.db.sync_search_index()
+        self._sync_fingerprints()
+        if self.run_id:
+            self.db.save_checkpoint(self.run_id, blocks_done, self.current_year_month)
+        self.db.commit()
+        # Keeps the WAL bounded during a long import without waiting for readers.
+        self.db.checkpoint_wal()
+        self.blocks_since_commit = 0
+
+    def _sync_fingerprints(self):
+        """Fingerprints the items written since the last sync and collects the suspected duplicates among them."""
+        rows = self.db.sync_item_fingerprints()
+        if self.db.settings['report_duplicates']:
+            self.suspected_duplicates.extend(
+                group for group in group_duplicates(rows) if any(row[6] for row in group)
+            )
+
+    def _report_duplicates(self):
+        """
+        Lists the items of this import that look like a second copy of another item:
+        same month, amount and normalized description, but in another child category
+        or spelled differently (exact repeats within one child are merged on insert).
+        """
+        if not self.suspected_duplicates:
+            return
+        print(f"{YELLOW}Suspected duplicates: {len(self.suspected_duplicates)} group(s) of items with the same "
+              f"month, amount and normalized description:{RESET}")
+        for group in self.suspected_duplicates[:REPORTED_DUPLICATE_GROUPS]:
+            year_month, amount, key = group[0][:3]
+            entries = '; '.join(f"{parent}/{child} '{text}'{' (new)' if is_new else ''}"
+                                for _, _, _, parent, child, text, is_new in group)
+            print(f"{YELLOW}  {year_month} {amount:g} [{key}]: {entries}{RESET}")
+        if len(self.suspected_duplicates) > REPORTED_DUPLICATE_GROUPS:
+            print(f"{YELLOW}  ... and {len(self.suspected_duplicates) - REPORTED_DUPLICATE_GROUPS} more; "
+                  f"the duplicate report lists them all.{RESET}")
+
+    def _report_merged_items(self):
+        """
+        Lists the items a replace-mode import did not store because the same amount and
+        description already appear in the same child of that month; only the first
+        occurrence is kept.
+        """
+        if not self.merged_items:
+            return
+        print(f"{YELLOW}Merged repeats: {len(self.merged_items)} item(s) appear more than once in the same child "
+              f"of a month; only the first occurrence was stored:{RESET}")
+        for year_month, parent, child, amount, description, dropped in self.merged_items[:REPORTED_DUPLICATE_GROUPS]:
+            print(f"{YELLOW}  {year_month} {parent}/{child} {amount:g} '{description}': "
+                  f"{dropped} repeat(s) dropped{RESET}")
+        if len(self.merged_items) > REPORTED_DUPLICATE_GROUPS:
+            print(f"{YELLOW}  ... and {len(self.merged_items) - REPORTED_DUPLICATE_GROUPS} more.{RESET}")
+
+    def _flush_items_batch(self):
+        """Writes the current batch of items to the database."""
+        if self.items_batch:
+            self.db.bulk_upsert_items(self.items_batch)
+            self.items_batch = []
+            
+    def _handle_year_month(self, record: Dict[str, Any]):
+        self._flush_items_batch()
+        self.current_year_month_id = self.db.upsert_year_month(record['value'])
+        if not self.current_year_month_id:
+            raise ValueError(f"Failed to insert/find YearMonth ID for {record['value']}")
+        # Reset downstream IDs
+        self.current_parent_id = None
+        self.current_child_id = None
+
+    def _handle_remark(self, record: Dict[str, Any]):
+        if not record.get('year_month'):
+            raise ValueError(f"Remark '{record['text']}' found without an associated DATE.")
+        self.db.update_year_month_remark(record['text'], record['year_month'])
+        
+    def _handle_parent(self, record: Dict[str, Any]):
+        if not self.current_year_month_id:
+            raise ValueError(f"Parent '{record['title']}' found without a preceding DATE.")
+        self._flush_items_batch()
+        self.current_parent_id = self.db.upsert_parent(
+            self.current_year_month_id, record['title'], record['order_num']
+        )
+        if not self.current_parent_id:
+            raise ValueError(f"Failed to get Parent ID for '{record['title']}'")
+        # Reset downstream ID
+        self.current_child_id = None
+        
+    def _handle_child(self, record: Dict[str, Any]):
+        if not self.current_parent_id:
+            raise ValueError(f"Child '{record['title']}' found without a preceding PARENT.")
+        self._flush_items_batch()
+        self.current_child_id = self.db.upsert_child(
+            self.current_parent_id, record['title'], record['order_num']
+        )
+        if not self.current_child_id:
+            raise ValueError(f"Failed to get Child ID for '{record['title']}'")
+
+    def _handle_item(self, record: Dict[str, Any]):
+        if not self.current_child_id:
+            raise ValueError(f"Item '{record['description']}' found without a preceding CHILD.")
+        
+        self.items_batch.append((
+            self.current_child_id,
+            record['amount'],
+            record['description'],
+            record['order_num']
+        ))
+        
+        if len(self.items_batch) >= self.ITEM_BATCH_SIZE:
+            self._flush_items_batch()
+
+class ReplaceMonthProcessor(DataProcessor):
+    """
+    A DataProcessor with replace-month semantics.
+
+    Every DATE block first deletes its month's existing Parent/Child/Item
+    subtree and then inserts the block's contents with plain INSERTs, so a
+    re-imported month ends up exactly matching its source. The delete and the
+    inserts run in the same transaction (and chunked commits only happen at
+    block boundaries), so each month is replaced atomically.
+
+    Item keeps its UNIQUE(child_id, amount, description_id) constraint, so an
+    item repeated within one child of a month is stored once. Such repeats are
+    set aside before the insert and reported at the end of the import.
+    """
+    ITEM_BATCH_SIZE = 5000
+
+    def __init__(self, db_manager: DatabaseManager, commit_every_months: int = 0, run_id: Optional[str] = None):
+        super().__init__(db_manager, commit_every_months, run_id)
+        # Ids created in the current block, so a title repeated within one month
+        # is merged instead of violating the UNIQUE constraints.
+        self.block_parent_ids: Dict[str, int] = {}
+        self.block_child_ids: Dict[tuple, int] = {}
+        # (child_id, amount, description) of the items inserted in the current block,
+        # mapped to their entry in merged_items once a repeat is seen.
+        self.block_item_keys: Dict[tuple, Optional[list]] = {}
+
+    def _flush_items_batch(self):
+        if self.items_batch:
+            self.db.bulk_insert_items(self.items_batch)
+            self.items_batch = []
+
+    def _handle_year_month(self, record: Dict[str, Any]):
+        super()._handle_year_month(record)
+        self.db.delete_month_contents(self.current_year_month_id)
+        self.block_parent_ids.clear()
+        self.block_child_ids.clear()
+        self.block_item_keys.clear()
+
+    def _handle_parent(self, record: Dict[str, Any]):
+        if not self.current_year_month_id:
+            raise ValueError(f"Parent '{record['title']}' found without a preceding DATE.")
+        # Item rows carry their child_id, so the batch does not need flushing here.
+        parent_id = self.block_parent_ids.get(record['title'])
+        if parent_id is None:
+            parent_id = self.db.insert_parent(self.current_year_month_id, record['title'], record['order_num'])
+            if not parent_id:
+                raise ValueError(f"Failed to insert Parent '{record['title']}'")
+            self.block_parent_ids[record['title']] = parent_id
+        self.current_parent_id = parent_id
+        self.current_child_id = None
+
+    def _handle_child(self, record: Dict[str, Any]):
+        if not self.current_parent_id:
+            raise ValueError(f"Child '{record['title']}' found without a preceding PARENT.")
+        key = (self.current_parent_id, record['title'])
+        child_id = self.block_child_ids.get(key)
+        if child_id is None:
+            child_id = self.db.insert_child(self.current_parent_id, record['title'], record['order_num'])
+            if not child_id:
+                raise ValueError(f"Failed to insert Child '{record['title']}'")
+            self.block_child_ids[key] = child_id
+        self.current_child_id = child_id
+
+    def _handle_item(self, record: Dict[str, Any]):
+        if not self.current_child_id:
+            raise ValueError(f"Item '{record['description']}' found without a preceding CHILD.")
+        key = (self.current_child_id, record['amount'], record['description'])
+        if key not in self.block_item_keys:
+            self.block_item_keys[key] = None
+            super()._handle_item(record)
+            return
+        merged = self.block_item_keys[key]
+        if merged is None:
+            merged = [self.current_year_month, record['parent_title'], record['child_title'],
+                      record['amount'], record['description'], 0]
+            self.merged_items.append(merged)
+            self.block_item_keys[key] = merged
+        merged[5] += 1
+
+
+class StagingDataProcessor(DataProcessor):
+    """
+    A DataProcessor that bulk-loads through TEMP staging tables.
+
+    Records are only validated and collected (with their titles and descriptions
+    resolved to dictionary ids); they reach the staging tables with executemany
+    in batches of STAGE_BATCH_SIZE. Whenever a chunk is committed (and
+    at the end of the stream) the staged rows are resolved into YearMonth, Parent,
+    Child and Item with a few set-based INSERT ... SELECT statements, instead of
+    two statements per parent and child plus an item flush per child. The result
+    is the same as the per-record upserts.
+    """
+    STAGE_BATCH_SIZE = 5000
+    REPLACE_MONTHS = False
+
+    def __init__(self, db_manager: DatabaseManager, commit_every_months: int = 0, run_id: Optional[str] = None):
+        super().__init__(db_manager, commit_every_months, run_id)
+        self.current_parent_title_id: Optional[int] = None
+        self.current_child_title_id: Optional[int] = None
+        self.staged_rows: Dict[str, list] = {kind: [] for kind in ('month', 'remark', 'parent', 'child', 'item')}
+        self.has_staged = False
+        self.db.create_staging_tables()
+
+    def _stage(self, kind: str, row: tuple):
+        rows = self.staged_rows[kind]
+        # Every staged row carries its DATE block number.
+        rows.append((self.blocks_started,) + row)
+        self.has_staged = True
+        if len(rows) >= self.STAGE_BATCH_SIZE:
+            self.db.stage_rows(kind, rows)
+            self.staged_rows[kind] = []
+
+    def _flush_items_batch(self):
+        """Resolves everything staged since the last chunk into the database tables."""
+        if not self.has_staged:
+            return
+        for kind, rows in self.staged_rows.items():
+            self.db.stage_rows(kind, rows)
+            self.staged_rows[kind] = []
+        self.merged_items.extend(self.db.resolve_staging(self.REPLACE_MONTHS))
+        self.has_staged = False
+
+    def _handle_year_month(self, record: Dict[str, Any]):
+        self._stage('month', (record['value'],))
+        # Reset downstream titles
+        self.current_parent_title_id = None
+        self.current_child_title_id = None
+
+    def _handle_remark(self, record: Dict[str, Any]):
+        if not record.get('year_month'):
+            raise ValueError(f"Remark '{record['text']}' found without an associated DATE.")
+        self._stage('remark', (record['year_month'], record['text']))
+
+    def _handle_parent(self, record: Dict[str, Any]):
+        if not self.current_year_month:
+            raise ValueError(f"Parent '{record['title']}' found without a preceding DATE.")
+        self.current_parent_title_id = self.db.category_id(record['title'])
+        self._stage('parent', (self.current_year_month, self.current_parent_title_id, record['order_num']))
+        self.current_child_title_id = None
+
+    def _handle_child(self, record: Dict[str, Any]):
+        if self.current_parent_title_id is None:
+            raise ValueError(f"Child '{record['title']}' found without a preceding PARENT.")
+        self.current_child_title_id = self.db.category_id(record['title'])
+        self._stage('child', (
+            self.current_year_month, self.current_parent_title_id, self.current_child_title_id, record['order_num']
+        ))
+
+    def _handle_item(self, record: Dict[str, Any]):
+        if self.current_child_title_id is None:
+            raise ValueError(f"Item '{record['description']}' found without a preceding CHILD.")
+        self._stage('item', (
+            self.current_year_month, self.current_parent_title_id, self.current_child_title_id,
+            record['amount'], self.db.description_id(record['description']), record['order_num']
+        ))
+
+
+class StagingReplaceProcessor(StagingDataProcessor):
+    """
+    The staging-table bulk loader with replace-month semantics (see
+    ReplaceMonthProcessor): the staged months' contents are deleted before the
+    staged rows are resolved, and only the last DATE block of each month is loaded.
+    """
+    REPLACE_MONTHS = True
+
+
+IMPORT_PROCESSORS = {
+    'upsert': DataProcessor,
+    'replace': ReplaceMonthProcessor,
+}
+
+# Processors of the staging-table bulk loader, by import mode.
+STAGING_PROCESSORS = {
+    'upsert': StagingDataProcessor,
+    'replace': StagingReplaceProcessor,
+}
+
+IMPORT_LOADERS = {
+    'record': IMPORT_PROCESSORS,
+    'staging': STAGING_PROCESSORS,
+}
+
+# ==============================================================================
+# 公共接口函数
+# ==============================================================================
+
+def create_database(db_name: str = 'bills.db', settings: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Creates and initializes the database schema.
+
+    Args:
+        db_name: The name of the database file.
+        settings: Writer concurrency options (see db_config.writer_settings).
+
+    Returns:
+        True if successful, False otherwise.
+    """
+    try:
+        with DatabaseManager(db_name, settings) as db:
+            return db.create_schema()
+    except Exception as e:
+        # The DatabaseManager will print its own connection error.
+        # This catches other potential issues.
+        print(f"{RED}An unexpected error occurred during DB creation: {e}{RESET}")
+        return False
+
+
+def update_description_keys(db_config: Dict[str, Any]) -> bool:
+    """
+    Recomputes the normalized description keys of the configured database (every
+    shard in sharded mode) after the normalization rules were edited. Only the
+    descriptions whose key changes are rewritten; items are not touched.
+    """
+    if db_config['storage_mode'] == 'sharded':
+        db_names = ShardCatalog(db_config['shard_dir']).shard_paths()
+    else:
+        db_names = [db_config['db_path']] if os.path.exists(db_config['db_path']) else []
+    if not db_names:
+        print(f"{YELLOW}No database to update.{RESET}")
+        return True
+    settings = writer_settings(db_config)
+    return all([create_database(db_name, settings) for db_name in db_names])
+
+
+def import_run_id(file_paths: List[str]) -> str:
+    """
+    Identifies an import run by its input files (path, size and mtime), so that an
+    interrupted chunked import of the same, unchanged files can be resumed.
+    """
+    digest = hashlib.sha1()
+    for path in file_paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def insert_data(data_stream: Iterator[Dict[str, Any]], db_name: str = 'bills.db',
+                commit_every_months: int = 0, run_id: Optional[str] = None, import_mode: str = 'upsert',
+                settings: Optional[Dict[str, Any]] = None, loader: str = 'record') -> bool:
+    """
+    High-level function to process a stream of data and insert it into the database.
+    This function handles database connection, processing, and transactions.
+
+    Args:
+        data_stream: An iterator yielding structured dictionaries.
+        db_name: The name of the database file to use.
+        commit_every_months: 0 imports everything in a single transaction. A positive
+            value commits after every N DATE blocks and records a checkpoint, so a
+            failed run only loses the current chunk.
+        run_id: Identifies the run for checkpoint/resume (see import_run_id). A rerun
+            with the same run_id skips the blocks that were already committed.
+        import_mode: 'upsert' merges the records into existing months; 'replace'
+            replaces each imported month with exactly the contents of its DATE block
+            (repeats of an item within one child are stored once and reported).
+        settings: Writer concurrency options (see db_config.writer_settings). With
+            journal_mode 'wal' queries keep reading a consistent snapshot while the
+            import writes; combine it with commit_every_months so the WAL is
+            checkpointed after every chunk instead of growing until the end.
+        loader: 'record' writes the hierarchy record by record; 'staging' collects
+            each chunk into TEMP staging tables and resolves it with a few set-based
+            statements (see StagingDataProcessor).
+
+    Returns:
+        True on success, False on failure.
+    """
+    processors = IMPORT_LOADERS.get(loader)
+    if processors is None:
+        print(f"{RED}Unknown import loader '{loader}'. Expected one of: {', '.join(IMPORT_LOADERS)}.{RESET}")
+        return False
+    processor_class = processors.get(import_mode)
+    if processor_class is None:
+        print(f"{RED}Unknown import mode '{import_mode}'. Expected one of: {', '.join(processors)}.{RESET}")
+        return False
+    print("Starting database insertion process...")
+    try:
+        with DatabaseManager(db_name, settings) as db_manager:
+            processor = processor_class(db_manager, commit_every_months, run_id)
+            success = processor.process_stream(data_stream)
+            if success:
+                print(f"{GREEN}Data insertion process completed successfully.{RESET}")
+            else:
+                # Error message will be printed by the processor
+                db_manager.rollback()
+                if commit_every_months and run_id:
+                    print(f"{RED}Data insertion process failed. Uncommitted changes rolled back; "
+                          f"rerun the same import to resume from the last checkpoint.{RESET}")
+                else:
+                    print(f"{RED}Data insertion process failed. Rolling back changes.{RESET}")
+            return success
+    except sqlite3.Error as e:
+        print(f"{RED}A database error occurred: {e}. The transaction has been rolled back.{RESET}")
+        return False
+    except Exception as e:
+        print(f"{RED}An unexpected error occurred: {e}. The transaction has been rolled back.{RESET}")
+        return False
+
+
+def insert_data_sharded(data_stream: Iterator[Dict[str, Any]], shard_dir: str = 'shards', max_workers: int = 4,
+                        commit_every_months: int = 0, run_id: Optional[str] = None,
+                        import_mode: str = 'upsert', settings: Optional[Dict[str, Any]] = None,
+                        loader: str = 'record') -> bool:
+    """
+    Routes a stream of records into per-year shard databases.
+
+    Records are grouped by the year of their DATE block; every year is imported
+    into its own shard file with its own transaction, so different years run in
+    parallel and never lock each other. A shard is registered in the catalog
+    only after its import succeeded.
+
+    Args:
+        data_stream: An iterator yielding structured dictionaries.
+        shard_dir: The directory holding the shard files and the catalog.
+        max_workers: How many years are imported concurrently.
+        commit_every_months, run_id, import_mode, settings, loader: Applied to every shard
+            (see insert_data).
+
+    Returns:
+        True if every year was imported successfully, False otherwise.
+    """
+    catalog = ShardCatalog(shard_dir)
+    try:
+        records_by_year = split_records_by_year(data_stream)
+    except ValueError as e:
+        print(f"{RED}Data routing failed. Error: {e}{RESET}")
+        return False
+
+    def import_year(year: str) -> bool:
+        shard_path = catalog.shard_path(year)
+        return create_database(shard_path, settings) and insert_data(
+            iter(records_by_year[year]), shard_path, commit_every_months, run_id, import_mode, settings, loader
+        )
+
+    os.makedirs(shard_dir, exist_ok=True)
+    print(f"Routing records into {len(records_by_year)} yearly shard(s) under '{shard_dir}'...")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = dict(zip(records_by_year, executor.map(import_year, records_by_year)))
+
+    for year, success in sorted(results.items()):
+        if success:
+            catalog.register(year)
+        else:
+            print(f"{RED}Import of shard {year} failed; its changes have been rolled back.{RESET}")
+    return all(results.values())
\ No newline at end of file
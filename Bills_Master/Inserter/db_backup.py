@@ -0,0 +1,325 @@
+# db_backup.py
+"""
+Online snapshots of the bills database, built on sqlite3.Connection.backup.
+
+The backup copies BACKUP_STEP_PAGES pages per step and pauses briefly between
+steps. The source is only read-locked while a step runs, so queries and imports
+keep working while a snapshot is taken. If another connection writes to the
+source during the copy, SQLite restarts the copy, and the snapshot is always a
+consistent state of the database.
+
+Snapshots are named ``<database>.<timestamp>.db`` (``.db.gz`` when compressed).
+They are written to snapshot_dir, and only the newest snapshot_keep snapshots
+of every database are kept. In sharded mode every shard is snapshotted
+separately.
+
+Command line usage (from the Bills_Master directory):
+    python -m Inserter.db_backup snapshot [--gzip]
+    python -m Inserter.db_backup list
+    python -m Inserter.db_backup restore snapshots/bills.20250101_120000.db.gz
+    python -m Inserter.db_backup inspect snapshots/bills.20250101_120000.db.gz
+"""
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from common import RED, GREEN, YELLOW, CYAN, RESET
+from .database_inserter import DatabaseManager
+from .db_config import load_database_config, writer_settings
+from .shard_catalog import ShardCatalog, read_only_uri
+
+BACKUP_STEP_PAGES = 256
+# Pause between backup steps, so that waiting writers get the database in between.
+BACKUP_STEP_PAUSE_SECONDS = 0.005
+SNAPSHOT_TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+SNAPSHOT_NAME_PATTERN = re.compile(r'^(?P<stem>.+)\.(?P<timestamp>\d{8}_\d{6}(?:_\d+)?)\.db(?P<gz>\.gz)?$')
+GZIP_CHUNK_SIZE = 1024 * 1024
+
+
+def _copy_pages(source: sqlite3.Connection, target: sqlite3.Connection, label: str):
+    """Copies ``source`` into ``target`` in page-limited steps, printing the progress."""
+    last_percent = [-1]
+
+    def progress(status, remaining, total):
+        percent = 100 * (total - remaining) // total if total else 100
+        if percent // 10 != last_percent[0] // 10:
+            print(f"\r  {label}: {percent}% ({total - remaining}/{total} pages)", end='', flush=True)
+            last_percent[0] = percent
+        if remaining:
+            time.sleep(BACKUP_STEP_PAUSE_SECONDS)
+
+    source.backup(target, pages=BACKUP_STEP_PAGES, progress=progress)
+    print()
+
+
+
+
+@contextmanager
+def _uncompressed(snapshot_path: str):
+    """Yields the path of an uncompressed copy of ``snapshot_path`` (a temporary file for .gz snapshots)."""
+    if not snapshot_path.endswith('.gz'):
+        yield snapshot_path
+        return
+    fd, temp_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(snapshot_path)))
+    try:
+        with os.fdopen(fd, 'wb') as out, gzip.open(snapshot_path, 'rb') as src:
+            shutil.copyfileobj(src, out, GZIP_CHUNK_SIZE)
+        yield temp_path
+    finally:
+        os.remove(temp_path)
+
+
+def list_snapshots(snapshot_dir: str, stem: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Returns the snapshots in ``snapshot_dir`` (optionally of one database), oldest first."""
+    if not os.path.isdir(snapshot_dir):
+        return []
+    snapshots = []
+    for file_name in os.listdir(snapshot_dir):
+        match = SNAPSHOT_NAME_PATTERN.match(file_name)
+        if not match or (stem is not None and match.group('stem') != stem):
+            continue
+        path = os.path.join(snapshot_dir, file_name)
+        snapshots.append({
+            'path': path, 'stem': match.group('stem'), 'timestamp': match.group('timestamp'),
+            'compressed': bool(match.group('gz')), 'bytes': os.path.getsize(path),
+        })
+    # Timestamps of snapshots taken within the same second carry a counter: 20250101_120000_2 < 20250101_120000_10
+    snapshots.sort(key=lambda snapshot: (snapshot['stem'], snapshot['timestamp'][:15],
+                                         int(snapshot['timestamp'][16:] or 0)))
+    return snapshots
+
+
+def _snapshot_path(snapshot_dir: str, db_name: str, compress: bool) -> str:
+    """A new snapshot path; a counter is appended when a snapshot of the same second already exists."""
+    stem = os.path.splitext(os.path.basename(db_name))[0]
+    timestamp = datetime.now().strftime(SNAPSHOT_TIMESTAMP_FORMAT)
+    taken = {snapshot['timestamp'] for snapshot in list_snapshots(snapshot_dir, stem)}
+    unique, counter = timestamp, 0
+    while unique in taken:
+        counter += 1
+        unique = f"{timestamp}_{counter}"
+    return os.path.join(snapshot_dir, f"{stem}.{unique}.db{'.gz' if compress else ''}")
+
+
+def prune_snapshots(snapshot_dir: str, stem: str, keep: int) -> List[str]:
+    """Deletes all but the newest ``keep`` snapshots of one database. Returns the deleted paths."""
+    if keep <= 0:
+        return []
+    snapshots = list_snapshots(snapshot_dir, stem)
+    expired = [snapshot['path'] for snapshot in snapshots[:-keep]]
+    for path in expired:
+        os.remove(path)
+    return expired
+
+
+# ==============================================================================
+# 公共接口函数
+# ==============================================================================
+
+def create_snapshot(db_name: str, snapshot_dir: str = 'snapshots', compress: bool = False,
+                    keep: int = 0) -> Optional[str]:
+    """
+    Copies ``db_name`` into a new snapshot in ``snapshot_dir`` while the database
+    stays in use, optionally gzip-compressed, then applies the retention of
+    ``keep`` snapshots (0 keeps all). Returns the snapshot path, or None on failure.
+    """
+    if not os.path.exists(db_name):
+        print(f"{RED}Database {db_name} does not exist.{RESET}")
+        return None
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_path = _snapshot_path(snapshot_dir, db_name, compress)
+    # Written under a temporary name, so a failed or interrupted snapshot is never listed.
+    partial_path = snapshot_path.removesuffix('.gz') + '.part'
+    try:
+        source = sqlite3.connect(read_only_uri(db_name), uri=True)
+        target = sqlite3.connect(partial_path)
+        try:
+            _copy_pages(source, target, f"Snapshot of {db_name}")
+        finally:
+            target.close()
+            source.close()
+        if compress:
+            with open(partial_path, 'rb') as src, gzip.open(snapshot_path, 'wb') as out:
+                shutil.copyfileobj(src, out, GZIP_CHUNK_SIZE)
+            os.remove(partial_path)
+        else:
+            os.replace(partial_path, snapshot_path)
+    except (sqlite3.Error, OSError) as e:
+        for path in (partial_path, snapshot_path):
+            if os.path.exists(path):
+                os.remove(path)
+        print(f"{RED}Snapshot of {db_name} failed: {e}{RESET}")
+        return None
+    print(f"{GREEN}Snapshot written to {snapshot_path} ({os.path.getsize(snapshot_path) / 1024:.1f} KiB).{RESET}")
+    stem = os.path.splitext(os.path.basename(db_name))[0]
+    for path in prune_snapshots(snapshot_dir, stem, keep):
+        print(f"  Removed expired snapshot {path}")
+    return snapshot_path
+
+
+def restore_snapshot(snapshot_path: str, db_name: str, settings: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Replaces the contents of ``db_name`` with a snapshot. The snapshot is checked
+    first. The target keeps its configured journal mode, and other connections
+    simply see the restored data afterwards.
+    """
+    try:
+        with _uncompressed(snapshot_path) as plain_path:
+            source = sqlite3.connect(read_only_uri(plain_path), uri=True)
+            try:
+                status = source.execute('PRAGMA quick_check').fetchone()[0]
+                if status != 'ok':
+                    print(f"{RED}Snapshot {snapshot_path} is damaged ({status}); nothing was restored.{RESET}")
+                    return False
+                os.makedirs(os.path.dirname(os.path.abspath(db_name)), exist_ok=True)
+                with DatabaseManager(db_name, settings) as db_manager:
+                    db_manager.commit()
+                    _copy_pages(source, db_manager.conn, f"Restore into {db_name}")
+            finally:
+                source.close()
+    except (sqlite3.Error, OSError) as e:
+        print(f"{RED}Restore of {snapshot_path} failed: {e}{RESET}")
+        return False
+    print(f"{GREEN}Restored {db_name} from {snapshot_path}.{RESET}")
+    return True
+
+
+def open_snapshot_in_memory(snapshot_path: str) -> sqlite3.Connection:
+    """
+    Loads a snapshot into a read-only in-memory database. The connection can be
+    injected into the query classes (``query.connection = conn``), which then
+    run without touching the disk.
+    """
+    conn = sqlite3.connect(':memory:')
+    try:
+        with _uncompressed(snapshot_path) as plain_path:
+            source = sqlite3.connect(read_only_uri(plain_path), uri=True)
+            try:
+                source.backup(conn)
+            finally:
+                source.close()
+        conn.execute('PRAGMA query_only = ON')
+    except (sqlite3.Error, OSError):
+        conn.close()
+        raise
+    return conn
+
+
+def storage_databases(db_config: dict) -> List[str]:
+    """The database files of the configured storage: the single database, or every registered shard."""
+    if db_config['storage_mode'] == 'sharded':
+        return ShardCatalog(db_config['shard_dir']).shard_paths()
+    return [db_config['db_path']]
+
+
+def restore_target(db_config: dict, snapshot_path: str) -> Optional[str]:
+    """The database a snapshot belongs to under the configured storage, or None if its name does not match."""
+    match = SNAPSHOT_NAME_PATTERN.match(os.path.basename(snapshot_path))
+    if not match:
+        return None
+    if db_config['storage_mode'] == 'sharded':
+        return os.path.join(db_config['shard_dir'], match.group('stem') + '.db')
+    return db_config['db_path']
+
+
+def snapshot_storage(db_config: dict, compress: Optional[bool] = None) -> bool:
+    """Snapshots every database of the configured storage, applying snapshot_dir, snapshot_compress and snapshot_keep."""
+    db_names = storage_databases(db_config)
+    if not db_names:
+        print(f"{YELLOW}No database to snapshot.{RESET}")
+        return True
+    compress = db_config['snapshot_compress'] if compress is None else compress
+    results = [create_snapshot(db_name, db_config['snapshot_dir'], compress, db_config['snapshot_keep'])
+               for db_name in db_names]
+    return all(results)
+
+
+def restore_storage(db_config: dict, snapshot_path: str, db_name: Optional[str] = None) -> bool:
+    """
+    Restores a snapshot into ``db_name``, by default the database it was taken
+    from. A restored shard is registered in the catalog.
+    """
+    target = db_name or restore_target(db_config, snapshot_path)
+    if target is None:
+        print(f"{RED}Cannot tell which database {snapshot_path} belongs to; pass the target explicitly.{RESET}")
+        return False
+    if not restore_snapshot(snapshot_path, target, writer_settings(db_config)):
+        return False
+    if db_name is None and db_config['storage_mode'] == 'sharded':
+        catalog = ShardCatalog(db_config['shard_dir'])
+        year = SNAPSHOT_NAME_PATTERN.match(os.path.basename(snapshot_path)).group('stem').rsplit('_', 1)[-1]
+        if catalog.shard_path(year) == target:
+            catalog.register(year)
+    return True
+
+
+def describe_snapshot(snapshot_path: str) -> bool:
+    """Loads a snapshot into memory and prints its months, item count and yearly totals."""
+    start_time = time.perf_counter()
+    try:
+        conn = open_snapshot_in_memory(snapshot_path)
+    except (sqlite3.Error, OSError) as e:
+        print(f"{RED}Could not load {snapshot_path}: {e}{RESET}")
+        return False
+    try:
+        load_seconds = time.perf_counter() - start_time
+        first, last, months = conn.execute(
+            'SELECT MIN(year_month), MAX(year_month), COUNT(*) FROM YearMonth').fetchone()
+        yearly = conn.execute('''
+            SELECT substr(ym.year_month, 1, 4), COUNT(i.id), COALESCE(SUM(i.amount), 0)
+            FROM YearMonth ym
+            JOIN Parent p ON p.year_month_id = ym.id
+            JOIN Child c ON c.parent_id = p.id
+            JOIN Item i ON i.child_id = c.id
+            GROUP BY 1 ORDER BY 1''').fetchall()
+    finally:
+        conn.close()
+    print(f"{CYAN}{snapshot_path}: loaded into memory in {load_seconds:.3f}s{RESET}")
+    print(f"  {months} month(s), {first or '-'} to {last or '-'}")
+    for year, items, total in yearly:
+        print(f"  {year}: {items} item(s), {total:.2f}")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot and restore the bills database while it stays in use.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    snapshot_parser = commands.add_parser('snapshot', help="Snapshot the configured database(s)")
+    snapshot_parser.add_argument('--gzip', dest='compress', action='store_true', default=None,
+                                 help="Compress the snapshot (default: snapshot_compress in the config)")
+    snapshot_parser.add_argument('--db', help="Snapshot this database file instead of the configured storage")
+    commands.add_parser('list', help="List the snapshots")
+    restore_parser = commands.add_parser('restore', help="Restore a snapshot")
+    restore_parser.add_argument('snapshot')
+    restore_parser.add_argument('--to', dest='db_name', help="Target database (default: the one it was taken from)")
+    inspect_parser = commands.add_parser('inspect', help="Load a snapshot into memory and summarize it")
+    inspect_parser.add_argument('snapshot')
+    args = parser.parse_args(argv)
+
+    db_config = load_database_config()
+    if args.command == 'snapshot':
+        if args.db:
+            db_config = dict(db_config, storage_mode='single', db_path=args.db)
+        success = snapshot_storage(db_config, args.compress)
+    elif args.command == 'list':
+        for snapshot in list_snapshots(db_config['snapshot_dir']):
+            print(f"{snapshot['path']}  {snapshot['bytes'] / 1024:.1f} KiB")
+        success = True
+    elif args.command == 'restore':
+        success = restore_storage(db_config, args.snapshot, args.db_name)
+    else:
+        success = describe_snapshot(args.snapshot)
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
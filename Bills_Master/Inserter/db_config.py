@@ -0,0 +1,53 @@
+# db_config.py
+import json
+import os
+
+from common import YELLOW, RESET
+
+DATABASE_CONFIG_PATH = 'config/database_config.json'
+
+# 配置文件缺失或缺少某个键时使用的默认值，与此前硬编码的行为保持一致
+DEFAULT_DATABASE_CONFIG = {
+    'storage_mode': 'single',      # 'single': 单个 bills.db; 'sharded': 每年一个分片文件
+    'db_path': 'bills.db',
+    'shard_dir': 'shards',
+    'shard_import_workers': 4,
+    'commit_every_months': 0,      # 0: 整个导入一个事务; N: 每 N 个月提交一次并记录断点
+    'import_mode': 'upsert',       # 'upsert': 合并到已有月份; 'replace': 用 DATE 块整体替换该月数据
+    'import_loader': 'record',     # 'record': 逐条写入; 'staging': 先批量写入临时暂存表，再用少量集合语句整体导入
+    'journal_mode': 'delete',      # 'delete': 传统回滚日志; 'wal': 预写日志，导入期间查询仍可读取一致的快照
+    'busy_timeout_ms': 5000,       # 写入时遇到其他写入者持有锁的等待时间（毫秒）
+    'busy_retries': 3,             # 等待超时后开启事务/提交的重试次数
+    'wal_checkpoint_pages': 1000,  # WAL 模式下自动检查点的阈值（页）；分块提交后还会主动执行检查点
+    'ingest_error_policy': 'skip', # 流水线导入中某个文件出错时: 'skip': 报告并跳过该文件; 'abort': 停止导入
+    'snapshot_dir': 'snapshots',   # 在线快照的存放目录
+    'snapshot_keep': 7,            # 每个数据库保留的快照个数，超出时删除最旧的；0: 全部保留
+    'snapshot_compress': False,    # 快照是否用 gzip 压缩
+    'description_rules_path': 'config/Description_Rules.json',  # 消费描述规范化键的规则（去除备注、别名）
+    'report_duplicates': True,     # 导入结束时列出与已有项目年月、金额和规范化描述都相同的疑似重复项目
+}
+
+# 导入时打开写入连接所需的配置键，见 writer_settings
+WRITER_SETTING_KEYS = ('journal_mode', 'busy_timeout_ms', 'busy_retries', 'wal_checkpoint_pages',
+                       'description_rules_path', 'report_duplicates')
+
+
+def load_database_config(config_path: str = DATABASE_CONFIG_PATH) -> dict:
+    """
+    读取数据库存储配置，并用默认值补齐缺失的键。
+    配置文件不存在时直接返回默认配置；格式错误时给出警告并使用默认配置。
+    """
+    config = dict(DEFAULT_DATABASE_CONFIG)
+    if not os.path.exists(config_path):
+        return config
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"{YELLOW}警告: 无法解析数据库配置 '{config_path}'，将使用默认配置。详细信息: {e}{RESET}")
+    return config
+
+
+def writer_settings(db_config: dict) -> dict:
+    """从数据库配置中取出写入连接的设置（日志模式、忙等待与重试、检查点、描述规范化规则、重复检测），传给 DatabaseManager。"""
+    return {key: db_config.get(key, DEFAULT_DATABASE_CONFIG[key]) for key in WRITER_SETTING_KEYS}
@@ -0,0 +1,282 @@
+# db_maintenance.py
+"""
+Database maintenance, meant to be scheduled after big imports.
+
+Runs integrity checks (PRAGMA integrity_check, PRAGMA foreign_key_check, the
+implicit Parent -> YearMonth / Child -> Parent / Item -> Child references, the
+Category and Description dictionary references and the ItemSearch full-text
+index), an optional incremental or full VACUUM, and
+ANALYZE / PRAGMA optimize so the query planner has statistics. Table and index
+sizes and fragmentation are reported before and after. A database created by an
+older version is migrated to the current schema before it is checked.
+
+Command line usage (from the Bills_Master directory):
+    python -m Inserter.db_maintenance --vacuum full
+"""
+import argparse
+import os
+import sqlite3
+import sys
+from typing import Any, Dict, List, Optional
+
+from common import RED, GREEN, YELLOW, CYAN, RESET
+from .database_inserter import DatabaseManager
+from .db_config import load_database_config, writer_settings
+from .shard_catalog import ShardCatalog
+
+VACUUM_MODES = ('incremental', 'full')
+# PRAGMA auto_vacuum value that enables PRAGMA incremental_vacuum.
+AUTO_VACUUM_INCREMENTAL = 2
+# integrity_check stops after this many problems.
+MAX_INTEGRITY_ERRORS = 20
+
+
+class DatabaseMaintenance:
+    """
+    Maintenance operations on an open DatabaseManager. The schema declares no
+    FOREIGN KEY constraints, so besides PRAGMA foreign_key_check the hierarchy
+    references are checked for orphans explicitly.
+    """
+
+    SQL_DEFINITIONS = {
+        'storage_pages': 'SELECT name, path, pageno, pagetype, pgsize, unused FROM dbstat ORDER BY name, path',
+        'object_types': "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'index')",
+        'orphan_checks': {
+            'Parent without YearMonth': '''
+                SELECT COUNT(*) FROM Parent p
+                WHERE NOT EXISTS (SELECT 1 FROM YearMonth ym WHERE ym.id = p.year_month_id)''',
+            'Child without Parent': '''
+                SELECT COUNT(*) FROM Child c
+                WHERE NOT EXISTS (SELECT 1 FROM Parent p WHERE p.id = c.parent_id)''',
+            'Item without Child': '''
+                SELECT COUNT(*) FROM Item i
+                WHERE NOT EXISTS (SELECT 1 FROM Child c WHERE c.id = i.child_id)''',
+            'Parent or Child without Category': '''
+                SELECT (SELECT COUNT(*) FROM Parent p WHERE NOT EXISTS (SELECT 1 FROM Category c WHERE c.id = p.title_id))
+                     + (SELECT COUNT(*) FROM Child ch WHERE NOT EXISTS (SELECT 1 FROM Category c WHERE c.id = ch.title_id))''',
+            'Item without Description': '''
+                SELECT COUNT(*) FROM Item i
+                WHERE NOT EXISTS (SELECT 1 FROM Description d WHERE d.id = i.description_id)''',
+            'ItemSearch row without Item': '''
+                SELECT COUNT(*) FROM ItemSearch s
+                WHERE NOT EXISTS (SELECT 1 FROM Item i WHERE i.id = s.rowid)''',
+            'Item missing from ItemSearch': '''
+                SELECT COUNT(*) FROM Item i
+                WHERE NOT EXISTS (SELECT 1 FROM ItemSearch s WHERE s.rowid = i.id)''',
+        },
+        'item_search_integrity': "INSERT INTO ItemSearch (ItemSearch) VALUES ('integrity-check')",
+        'item_search_optimize': "INSERT INTO ItemSearch (ItemSearch) VALUES ('optimize')",
+    }
+
+    def __init__(self, db_manager: DatabaseManager):
+        self.db = db_manager
+        self.conn = db_manager.conn
+
+    def _pragma(self, name: str) -> Any:
+        return self.conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+    # --- Storage report ---
+
+    def storage_report(self) -> Dict[str, Any]:
+        """
+        Returns the file-level page counts and, per table and index, its pages,
+        bytes, unused bytes and fragmentation: the share of consecutive leaf pages
+        (in key order) that are not physically adjacent in the file. 'objects' is
+        None when SQLite was built without the dbstat virtual table.
+        """
+        # In WAL mode the file only reaches its current size once the WAL is checkpointed.
+        self.db.checkpoint_wal('TRUNCATE')
+        report = {
+            'file_bytes': os.path.getsize(self.db.db_name),
+            'page_size': self._pragma('page_size'),
+            'page_count': self._pragma('page_count'),
+            'freelist_count': self._pragma('freelist_count'),
+            'objects': None,
+        }
+        try:
+            rows = self.conn.execute(self.SQL_DEFINITIONS['storage_pages']).fetchall()
+        except sqlite3.OperationalError:
+            return report
+        types = dict(self.conn.execute(self.SQL_DEFINITIONS['object_types']).fetchall())
+        objects = {}
+        for name, _, pageno, pagetype, pgsize, unused in rows:
+            stats = objects.setdefault(name, {
+                'type': types.get(name, 'table'), 'pages': 0, 'bytes': 0, 'unused': 0,
+                'leaves': 0, 'jumps': 0, 'last_leaf': None,
+            })
+            stats['pages'] += 1
+            stats['bytes'] += pgsize
+            stats['unused'] += unused
+            if pagetype == 'leaf':
+                if stats['last_leaf'] is not None and pageno != stats['last_leaf'] + 1:
+                    stats['jumps'] += 1
+                stats['leaves'] += 1
+                stats['last_leaf'] = pageno
+        for stats in objects.values():
+            stats['unused_pct'] = stats['unused'] / stats['bytes'] if stats['bytes'] else 0.0
+            stats['fragmentation'] = stats['jumps'] / (stats['leaves'] - 1) if stats['leaves'] > 1 else 0.0
+        report['objects'] = objects
+        return report
+
+    # --- Checks ---
+
+    def check_integrity(self) -> List[str]:
+        """Runs all checks and returns the problems found (an empty list when the database is healthy)."""
+        problems = [row[0] for row in self.conn.execute(f'PRAGMA integrity_check({MAX_INTEGRITY_ERRORS})')
+                    if row[0] != 'ok']
+        for table, rowid, parent, _ in self.conn.execute('PRAGMA foreign_key_check'):
+            problems.append(f"Foreign key violation: {table} row {rowid} references missing {parent} row.")
+        for description, sql in self.SQL_DEFINITIONS['orphan_checks'].items():
+            count = self.conn.execute(sql).fetchone()[0]
+            if count:
+                problems.append(f"{description}: {count} row(s).")
+        try:
+            self.db._run_statement(lambda: self.conn.execute(self.SQL_DEFINITIONS['item_search_integrity']))
+            self.db.commit()
+        except sqlite3.DatabaseError as e:
+            self.db.rollback()
+            problems.append(f"ItemSearch full-text index: {e}. Rebuild it with rebuild_search_index().")
+        return problems
+
+    # --- Vacuum and statistics ---
+
+    def vacuum(self, mode: str) -> str:
+        """
+        'full' rebuilds the whole file. 'incremental' only returns the free pages to
+        the file system; it needs auto_vacuum=INCREMENTAL, which is switched on
+        (with a one-time full VACUUM) the first time. Returns what was done.
+        """
+        if mode not in VACUUM_MODES:
+            raise ValueError(f"Unknown vacuum mode '{mode}'. Expected one of: {', '.join(VACUUM_MODES)}")
+        self.db.commit()
+        if mode == 'incremental' and self._pragma('auto_vacuum') == AUTO_VACUUM_INCREMENTAL:
+            self.db._retry_busy(lambda: self.conn.execute('PRAGMA incremental_vacuum').fetchall())
+            return 'incremental vacuum'
+        if mode == 'incremental':
+            self.conn.execute(f'PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}')
+        self.db._retry_busy(lambda: self.conn.execute('VACUUM'))
+        return 'full vacuum' if mode == 'full' else 'full vacuum (auto_vacuum switched to incremental)'
+
+    def optimize(self):
+        """Merges the full-text index segments, gathers planner statistics and lets SQLite tune them."""
+        self.db._run_statement(lambda: self.conn.execute(self.SQL_DEFINITIONS['item_search_optimize']))
+        self.db.commit()
+        self.db._retry_busy(lambda: self.conn.execute('ANALYZE'))
+        self.db._retry_busy(lambda: self.conn.execute('PRAGMA optimize'))
+        self.db.commit()
+
+
+# ==============================================================================
+# Report formatting
+# ==============================================================================
+
+def _change(before, after, fmt):
+    return fmt(before) if before == after else f"{fmt(before)} -> {fmt(after)}"
+
+
+def format_storage_report(before: Dict[str, Any], after: Dict[str, Any]) -> str:
+    """Formats two storage_report() results side by side."""
+    kib = lambda value: f"{value / 1024:.1f} KiB"
+    pct = lambda value: f"{value * 100:.1f}%"
+    free = lambda report: report['freelist_count'] / report['page_count'] if report['page_count'] else 0.0
+    lines = [
+        f"  File size:  {_change(before['file_bytes'], after['file_bytes'], kib)}",
+        f"  Pages:      {_change(before['page_count'], after['page_count'], str)} "
+        f"x {after['page_size']} B, free pages {_change(before['freelist_count'], after['freelist_count'], str)} "
+        f"({_change(free(before), free(after), pct)})",
+    ]
+    if before['objects'] is None or after['objects'] is None:
+        lines.append(f"  {YELLOW}Per-table sizes unavailable: SQLite was built without the dbstat table.{RESET}")
+        return '\n'.join(lines)
+    empty = {'type': '', 'bytes': 0, 'unused_pct': 0.0, 'fragmentation': 0.0}
+    names = sorted(set(before['objects']) | set(after['objects']),
+                   key=lambda name: -after['objects'].get(name, empty)['bytes'])
+    width = max(len(name) for name in names)
+    lines.append(f"  {'Object':<{width}} {'Type':<6} {'Size':>24} {'Unused':>16} {'Fragmented':>16}")
+    for name in names:
+        old, new = before['objects'].get(name, empty), after['objects'].get(name, empty)
+        lines.append(
+            f"  {name:<{width}} {new['type'] or old['type']:<6} {_change(old['bytes'], new['bytes'], kib):>24} "
+            f"{_change(old['unused_pct'], new['unused_pct'], pct):>16} "
+            f"{_change(old['fragmentation'], new['fragmentation'], pct):>16}"
+        )
+    return '\n'.join(lines)
+
+
+# ==============================================================================
+# 公共接口函数
+# ==============================================================================
+
+def maintain_database(db_name: str, vacuum: Optional[str] = None, settings: Optional[Dict[str, Any]] = None,
+                      run_checks: bool = True) -> bool:
+    """
+    Checks, optionally vacuums and re-analyzes one database file, printing the
+    storage report before and after. A database that fails the checks is not
+    vacuumed. Returns True if the database is healthy and every step succeeded.
+    """
+    if vacuum is not None and vacuum not in VACUUM_MODES:
+        print(f"{RED}Unknown vacuum mode '{vacuum}'. Expected one of: {', '.join(VACUUM_MODES)}.{RESET}")
+        return False
+    if not os.path.exists(db_name):
+        print(f"{RED}Database {db_name} does not exist.{RESET}")
+        return False
+    print(f"{CYAN}Maintaining {db_name}...{RESET}")
+    try:
+        with DatabaseManager(db_name, settings) as db_manager:
+            # The checks query the dictionary tables and the full-text index, so a database
+            # created by an older version is migrated to the current schema first.
+            if not db_manager.create_schema():
+                return False
+            db_manager.sync_search_index()
+            db_manager.commit()
+            maintenance = DatabaseMaintenance(db_manager)
+            before = maintenance.storage_report()
+            problems = maintenance.check_integrity() if run_checks else []
+            for problem in problems:
+                print(f"{RED}  - {problem}{RESET}")
+            if problems:
+                print(f"{RED}  {len(problems)} problem(s) found{'; skipping VACUUM' if vacuum else ''}.{RESET}")
+            elif run_checks:
+                print(f"{GREEN}  Integrity, reference and full-text index checks passed.{RESET}")
+            maintenance.optimize()
+            print("  Done: ANALYZE and PRAGMA optimize.")
+            # After optimize, so the pages freed by merging the full-text index are reclaimed too.
+            if vacuum and not problems:
+                print(f"  Done: {maintenance.vacuum(vacuum)}.")
+            after = maintenance.storage_report()
+    except sqlite3.Error as e:
+        print(f"{RED}Maintenance of {db_name} failed: {e}{RESET}")
+        return False
+    print(format_storage_report(before, after))
+    return not problems
+
+
+def maintain_storage(db_config: dict, vacuum: Optional[str] = None, run_checks: bool = True) -> bool:
+    """Runs maintain_database on the configured database, or on every shard in sharded mode."""
+    settings = writer_settings(db_config)
+    if db_config['storage_mode'] == 'sharded':
+        db_names = ShardCatalog(db_config['shard_dir']).shard_paths()
+        if not db_names:
+            print(f"{YELLOW}No shards registered in '{db_config['shard_dir']}'.{RESET}")
+            return True
+    else:
+        db_names = [db_config['db_path']]
+    results = [maintain_database(db_name, vacuum, settings, run_checks) for db_name in db_names]
+    return all(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check, vacuum and re-analyze the bills database.")
+    parser.add_argument('--vacuum', choices=VACUUM_MODES, help="Also reclaim free pages (incremental) or rebuild the file (full)")
+    parser.add_argument('--no-checks', dest='run_checks', action='store_false', help="Skip the integrity checks")
+    parser.add_argument('--db', help="Database file; defaults to the one(s) selected by config/database_config.json")
+    args = parser.parse_args(argv)
+
+    db_config = load_database_config()
+    if args.db:
+        db_config = dict(db_config, storage_mode='single', db_path=args.db)
+    return 0 if maintain_storage(db_config, args.vacuum, args.run_checks) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
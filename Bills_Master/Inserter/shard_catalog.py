@@ -0,0 +1,233 @@
+# shard_catalog.py
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+from common import RED, RESET
+
+
+def read_only_uri(path: str) -> str:
+    """SQLite URI that opens ``path`` read-only (``sqlite3.connect(..., uri=True)``)."""
+    return 'file:' + quote(os.path.abspath(path).replace(os.sep, '/')) + '?mode=ro'
+
+
+class ShardCatalog:
+    """
+    Manages per-year database shards.
+
+    Every year lives in its own SQLite file (``bills_<year>.db``) inside
+    ``shard_dir``, and ``catalog.db`` records which years exist. Imports write
+    each year to its own shard; queries attach only the shards they touch.
+    """
+    CATALOG_NAME = 'catalog.db'
+    SHARD_NAME_TEMPLATE = 'bills_{year}.db'
+    # Attached shards reuse the same id space, so ids are offset per shard when
+    # several shards are merged into one set of views.
+    SHARD_ID_OFFSET = 1 << 40
+
+    SQL_DEFINITIONS = {
+        'create_shard': '''
+            CREATE TABLE IF NOT EXISTS Shard (
+                year TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )''',
+        'shard_upsert': 'INSERT INTO Shard (year, file_name, updated_at) VALUES (?, ?, ?) ON CONFLICT(year) DO UPDATE SET updated_at = excluded.updated_at',
+        'shard_select': 'SELECT year FROM Shard ORDER BY year',
+        # Merged dictionary ids of a multi-shard connection (see refresh_id_maps).
+        'create_first_id': 'CREATE TEMP TABLE IF NOT EXISTS DictionaryFirstId (value TEXT PRIMARY KEY, merged_id INTEGER NOT NULL) WITHOUT ROWID',
+        'create_id_map': '''
+            CREATE TEMP TABLE IF NOT EXISTS {dictionary}IdMap (
+                shard INTEGER NOT NULL,
+                local_id INTEGER NOT NULL,
+                merged_id INTEGER NOT NULL,
+                PRIMARY KEY (shard, local_id)
+            ) WITHOUT ROWID''',
+        'id_map_clear': 'DELETE FROM temp.{dictionary}IdMap',
+        'first_id_clear': 'DELETE FROM temp.DictionaryFirstId',
+        'first_id_fill': '''
+            INSERT INTO temp.DictionaryFirstId (value, merged_id)
+            SELECT {column}, id + {offset} FROM shard{shard}.{dictionary} WHERE true
+            ON CONFLICT(value) DO NOTHING''',
+        'id_map_fill': '''
+            INSERT INTO temp.{dictionary}IdMap (shard, local_id, merged_id)
+            SELECT {shard}, t.id, f.merged_id
+            FROM shard{shard}.{dictionary} t JOIN temp.DictionaryFirstId f ON f.value = t.{column}
+            WHERE f.merged_id != t.id + {offset}''',
+    }
+
+    # Dictionary tables (see DatabaseManager) and their string column.
+    DICTIONARIES = {'Category': 'name', 'Description': 'text'}
+    # Column lists of the merged views; (column, kind) pairs. 'id' columns are offset
+    # per shard; a dictionary name marks a column holding an id of that dictionary.
+    VIEW_COLUMNS = {
+        'YearMonth': [('id', 'id'), ('year_month', None), ('remark', None)],
+        'Category': [('id', 'Category'), ('name', None)],
+        'Description': [('id', 'Description'), ('text', None), ('key', None)],
+        'Parent': [('id', 'id'), ('year_month_id', 'id'), ('title_id', 'Category'), ('order_num', None)],
+        'Child': [('id', 'id'), ('parent_id', 'id'), ('title_id', 'Category'), ('order_num', None)],
+        'Item': [('id', 'id'), ('child_id', 'id'), ('amount', None), ('description_id', 'Description'),
+                 ('order_num', None), ('fingerprint', None)],
+    }
+
+    def __init__(self, shard_dir: str = 'shards'):
+        self.shard_dir = shard_dir
+        self.catalog_path = os.path.join(shard_dir, self.CATALOG_NAME)
+
+    def __repr__(self):
+        return f"ShardCatalog({self.shard_dir!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, ShardCatalog) and os.path.abspath(other.shard_dir) == os.path.abspath(self.shard_dir)
+
+    def __hash__(self):
+        return hash(os.path.abspath(self.shard_dir))
+
+    def _connect_catalog(self) -> sqlite3.Connection:
+        os.makedirs(self.shard_dir, exist_ok=True)
+        conn = sqlite3.connect(self.catalog_path)
+        conn.execute(self.SQL_DEFINITIONS['create_shard'])
+        return conn
+
+    def shard_path(self, year: str) -> str:
+        return os.path.join(self.shard_dir, self.SHARD_NAME_TEMPLATE.format(year=year))
+
+    def register(self, year: str):
+        """Records (or refreshes) a shard in the catalog after a successful import."""
+        conn = self._connect_catalog()
+        try:
+            with conn:
+                conn.execute(self.SQL_DEFINITIONS['shard_upsert'], (
+                    year, self.SHARD_NAME_TEMPLATE.format(year=year), datetime.now().isoformat(timespec='seconds')
+                ))
+        finally:
+            conn.close()
+
+    def years(self, wanted: Optional[Iterable[str]] = None) -> List[str]:
+        """Returns the registered years, optionally restricted to ``wanted``."""
+        if not os.path.exists(self.catalog_path):
+            return []
+        conn = self._connect_catalog()
+        try:
+            years = [row[0] for row in conn.execute(self.SQL_DEFINITIONS['shard_select'])]
+        finally:
+            conn.close()
+        if wanted is not None:
+            wanted = {str(year) for year in wanted}
+            years = [year for year in years if year in wanted]
+        return years
+
+    def shard_paths(self, wanted: Optional[Iterable[str]] = None) -> List[str]:
+        return [self.shard_path(year) for year in self.years(wanted)]
+
+    def connect(self, wanted: Optional[Iterable[str]] = None, check_same_thread: bool = True,
+                read_only: bool = False) -> sqlite3.Connection:
+        """
+        Opens a connection that exposes YearMonth/Parent/Child/Item for the
+        requested years (all years when ``wanted`` is None).
+
+        A single shard is opened directly. Several shards are ATTACHed to an
+        in-memory database and merged through TEMP views, with ids offset per
+        shard so the usual id joins never cross shard boundaries. Dictionary ids
+        are the exception: a title or description gets the id it has in the first
+        shard containing it, so grouping by them works across shards. That mapping
+        is computed once per connection into TEMP id-map tables (see
+        refresh_id_maps) which the views join on.
+        ``check_same_thread`` is passed through to ``sqlite3.connect``; with
+        ``read_only`` every shard is opened (or attached) read-only.
+        """
+        paths = self.shard_paths(wanted)
+        if read_only:
+            paths = [read_only_uri(path) for path in paths]
+        if len(paths) == 1:
+            return sqlite3.connect(paths[0], check_same_thread=check_same_thread, uri=read_only)
+
+        conn = sqlite3.connect(':memory:', check_same_thread=check_same_thread, uri=read_only)
+        try:
+            for index, path in enumerate(paths):
+                conn.execute(f"ATTACH DATABASE ? AS shard{index}", (path,))
+            self.refresh_id_maps(conn)
+            for table, columns in self.VIEW_COLUMNS.items():
+                conn.execute(f"CREATE TEMP VIEW {table} AS {self._union_sql(table, columns, len(paths))}")
+        except sqlite3.Error as e:
+            conn.close()
+            print(f"{RED}Failed to attach database shards in {self.shard_dir}: {e}{RESET}")
+            raise
+        return conn
+
+    @staticmethod
+    def _attached_shard_count(conn: sqlite3.Connection) -> int:
+        return sum(1 for row in conn.execute("PRAGMA database_list") if row[1].startswith('shard'))
+
+    def refresh_id_maps(self, conn: sqlite3.Connection):
+        """
+        (Re)builds the TEMP id-map tables of a multi-shard connection: for every
+        dictionary entry of a later shard that already exists in an earlier one,
+        the id it has in the first shard containing it. Entries not in the map
+        (including ones imported after the last refresh) keep their own offset id,
+        so long-lived connections should refresh after new imports to merge them.
+        Does nothing on a single-shard connection.
+        """
+        shard_count = self._attached_shard_count(conn)
+        if not shard_count:
+            return
+        sql = self.SQL_DEFINITIONS
+        with conn:
+            conn.execute(sql['create_first_id'])
+            for dictionary, column in self.DICTIONARIES.items():
+                conn.execute(sql['create_id_map'].format(dictionary=dictionary))
+                conn.execute(sql['id_map_clear'].format(dictionary=dictionary))
+                conn.execute(sql['first_id_clear'])
+                for shard in range(shard_count):
+                    params = {'dictionary': dictionary, 'column': column, 'shard': shard,
+                              'offset': shard * self.SHARD_ID_OFFSET}
+                    conn.execute(sql['first_id_fill'].format(**params))
+                    if shard:
+                        conn.execute(sql['id_map_fill'].format(**params))
+            conn.execute(sql['first_id_clear'])
+
+    def _union_sql(self, table: str, columns: list, shard_count: int) -> str:
+        if shard_count == 0:
+            # No shard matches: an empty relation with the expected columns.
+            return "SELECT " + ", ".join(f"NULL AS {name}" for name, _ in columns) + " WHERE 0"
+        selects = []
+        for index in range(shard_count):
+            offset = index * self.SHARD_ID_OFFSET
+            column_sqls, joins, where = [], [], ""
+            for name, kind in columns:
+                if kind == 'id' and offset:
+                    column_sqls.append(f"t.{name} + {offset} AS {name}")
+                elif kind == table and offset:
+                    # A dictionary lists each entry once, in the first shard containing it:
+                    # entries mapped to an earlier shard's id are left out.
+                    column_sqls.append(f"t.{name} + {offset} AS {name}")
+                    joins.append(f" LEFT JOIN temp.{table}IdMap m ON m.shard = {index} AND m.local_id = t.{name}")
+                    where = " WHERE m.local_id IS NULL"
+                elif kind in self.DICTIONARIES and kind != table and offset:
+                    alias = f"m_{name}"
+                    joins.append(f" LEFT JOIN temp.{kind}IdMap {alias} ON {alias}.shard = {index} AND {alias}.local_id = t.{name}")
+                    column_sqls.append(f"COALESCE({alias}.merged_id, t.{name} + {offset}) AS {name}")
+                else:
+                    column_sqls.append(f"t.{name}")
+            selects.append(f"SELECT {', '.join(column_sqls)} FROM shard{index}.{table} t{''.join(joins)}{where}")
+        return " UNION ALL ".join(selects)
+
+
+def split_records_by_year(data_stream: Iterable[Dict]) -> Dict[str, list]:
+    """
+    Routes parsed records to their year using the most recent DATE record.
+    Raises ValueError for records that appear before any DATE.
+    """
+    records_by_year: Dict[str, list] = {}
+    current_year = None
+    for record in data_stream:
+        if record['type'] == 'year_month':
+            current_year = record['value'][:4]
+        elif record['type'] == 'remark' and record.get('year_month'):
+            current_year = record['year_month'][:4]
+        if current_year is None:
+            raise ValueError(f"Record at line {record.get('line_num', 'N/A')} found without a preceding DATE.")
+        records_by_year.setdefault(current_year, []).append(record)
+    return records_by_year
@@ -0,0 +1,227 @@
+# analytics.py
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选依赖，缺失时退回到 array + 纯 Python 循环
+    np = None
+
+from .connection import open_connection, data_version, is_sharded
+
+
+class ColumnarSnapshot:
+    """
+    Item 事实表的列式内存快照。
+    金额保存在 float64 数组中，月份、父分类、子分类保存为整数编码，
+    并配有 编码 -> 标题 的字典。分组求和、月度序列和分类占比都在这些列上完成，
+    不再重复 JOIN 四张规范化表。
+    父/子分类直接按 Category id 编码，标题只在载入结束时解码一次。
+    快照在同一会话中复用，只有当 PRAGMA data_version 变化（有其他连接提交了写入）时才会重建。
+    db_path 为 ShardCatalog 时快照覆盖全部分片，新增分片同样会触发重建。
+    """
+    LOAD_SQL = '''
+        SELECT ym.year_month, p.title_id, c.title_id, i.amount
+        FROM YearMonth ym
+        JOIN Parent p ON ym.id = p.year_month_id
+        JOIN Child c ON p.id = c.parent_id
+        JOIN Item i ON c.id = i.child_id
+    '''
+    CATEGORY_SQL = 'SELECT id, name FROM Category'
+    FETCH_SIZE = 10000
+
+    def __init__(self, db_path='bills.db'):
+        self.db_path = db_path
+        self.conn = None
+        self.shard_years = None
+        self.data_version = None
+        self.amounts = None
+        self.month_codes = None
+        self.parent_codes = None
+        self.child_codes = None
+        self.month_labels = []
+        self.parent_labels = []
+        self.child_labels = []  # 每个编码对应 (父分类, 子分类)
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+            self.data_version = None
+
+    # --- 快照的加载与失效 ---
+
+    def _current_data_version(self):
+        if is_sharded(self.db_path):
+            shard_years = self.db_path.years()
+            if shard_years != self.shard_years:
+                # 分片列表变化时重新 ATTACH，保证新导入的年份进入快照
+                self.close()
+                self.shard_years = shard_years
+        if self.conn is None:
+            self.conn = open_connection(self.db_path)
+        return (self.shard_years, data_version(self.conn))
+
+    def refresh(self):
+        """如果数据库自上次加载后被修改过，则重建快照。返回是否发生了重建。"""
+        version = self._current_data_version()
+        if self.amounts is not None and version == self.data_version:
+            return False
+        self._load()
+        self.data_version = version
+        return True
+
+    def _load(self):
+        amounts = array('d')
+        month_codes, parent_codes, child_codes = array('i'), array('i'), array('i')
+        month_index, parent_index, child_index = {}, {}, {}
+
+        cursor = self.conn.execute(self.LOAD_SQL)
+        while True:
+            rows = cursor.fetchmany(self.FETCH_SIZE)
+            if not rows:
+                break
+            for ym_str, p_title_id, c_title_id, amount in rows:
+                amounts.append(amount)
+                month_codes.append(month_index.setdefault(ym_str, len(month_index)))
+                parent_codes.append(parent_index.setdefault(p_title_id, len(parent_index)))
+                child_codes.append(child_index.setdefault((p_title_id, c_title_id), len(child_index)))
+
+        names = dict(self.conn.execute(self.CATEGORY_SQL))
+        self.month_labels = list(month_index)
+        self.parent_labels = [names[title_id] for title_id in parent_index]
+        self.child_labels = [(names[p_title_id], names[c_title_id]) for p_title_id, c_title_id in child_index]
+        if np is not None:
+            self.amounts = np.frombuffer(amounts, dtype=np.float64)
+            self.month_codes = np.frombuffer(month_codes, dtype=np.int32)
+            self.parent_codes = np.frombuffer(parent_codes, dtype=np.int32)
+            self.child_codes = np.frombuffer(child_codes, dtype=np.int32)
+        else:
+            self.amounts, self.month_codes = amounts, month_codes
+            self.parent_codes, self.child_codes = parent_codes, child_codes
+
+    def __len__(self):
+        return len(self.amounts) if self.amounts is not None else 0
+
+    # --- 列运算的基础操作 ---
+
+    def _columns(self, by):
+        columns = {
+            'month': (self.month_codes, self.month_labels),
+            'parent': (self.parent_codes, self.parent_labels),
+            'child': (self.child_codes, self.child_labels),
+        }
+        if by not in columns:
+            raise ValueError(f"不支持的分组维度: {by}")
+        return columns[by]
+
+    def _mask(self, year_month_prefix=None, parent_title=None, child_title=None):
+        """根据过滤条件返回行掩码；没有任何过滤条件时返回 None。"""
+        conditions = []
+        if year_month_prefix:
+            codes = [code for code, ym in enumerate(self.month_labels) if ym.startswith(str(year_month_prefix))]
+            conditions.append((self.month_codes, codes))
+        if parent_title:
+            codes = [code for code, title in enumerate(self.parent_labels) if title == parent_title]
+            conditions.append((self.parent_codes, codes))
+        if child_title:
+            codes = [code for code, (_, title) in enumerate(self.child_labels) if title == child_title]
+            conditions.append((self.child_codes, codes))
+        if not conditions:
+            return None
+
+        if np is not None:
+            mask = np.ones(len(self.amounts), dtype=bool)
+            for column, codes in conditions:
+                mask &= np.isin(column, codes)
+            return mask
+        mask = [True] * len(self.amounts)
+        for column, codes in conditions:
+            wanted = set(codes)
+            mask = [keep and code in wanted for keep, code in zip(mask, column)]
+        return mask
+
+    def _bincount(self, codes, size, mask):
+        """按编码对金额求和，等价于 GROUP BY code SUM(amount)。"""
+        if np is not None:
+            if mask is not None:
+                codes, weights = codes[mask], self.amounts[mask]
+            else:
+                weights = self.amounts
+            return np.bincount(codes, weights=weights, minlength=size).tolist()
+        totals = [0.0] * size
+        if mask is None:
+            for code, amount in zip(codes, self.amounts):
+                totals[code] += amount
+        else:
+            for code, amount, keep in zip(codes, self.amounts, mask):
+                if keep:
+                    totals[code] += amount
+        return totals
+
+    # --- 对外的分析操作 ---
+
+    def group_sum(self, by='parent', year_month_prefix=None, parent_title=None):
+        """按 month / parent / child 分组求和，返回 {标签: 合计}（不含合计为 0 的分组）。"""
+        self.refresh()
+        codes, labels = self._columns(by)
+        mask = self._mask(year_month_prefix, parent_title)
+        totals = self._bincount(codes, len(labels), mask)
+        return {label: total for label, total in zip(labels, totals) if total}
+
+    def monthly_series(self, parent_title=None, child_title=None):
+        """返回按年月排序的 [(year_month, 合计)]，可限定父分类或子分类。"""
+        self.refresh()
+        mask = self._mask(parent_title=parent_title, child_title=child_title)
+        totals = self._bincount(self.month_codes, len(self.month_labels), mask)
+        return sorted((ym, total) for ym, total in zip(self.month_labels, totals) if total)
+
+    def category_shares(self, by='parent', year_month_prefix=None):
+        """返回 [(标签, 合计, 占比)]，按合计从大到小排序。"""
+        totals = self.group_sum(by, year_month_prefix)
+        grand_total = sum(totals.values())
+        return [
+            (label, total, total / grand_total if grand_total else 0.0)
+            for label, total in sorted(totals.items(), key=lambda kv: -kv[1])
+        ]
+
+
+# ==============================================================================
+# 会话级快照缓存与公共接口函数
+# ==============================================================================
+_SNAPSHOTS = {}
+
+def get_snapshot(db_path='bills.db'):
+    """返回当前会话中该数据库的快照（首次调用时创建），供多次查询复用。"""
+    snapshot = _SNAPSHOTS.get(db_path)
+    if snapshot is None:
+        snapshot = _SNAPSHOTS[db_path] = ColumnarSnapshot(db_path)
+    return snapshot
+
+def _label_text(label):
+    return label[1] if isinstance(label, tuple) else label
+
+def display_category_shares(year_month_prefix=None, by='parent', db_path='bills.db'):
+    """显示各分类的合计与占比，year_month_prefix 可为年份(YYYY)或年月(YYYYMM)。"""
+    shares = get_snapshot(db_path).category_shares(by, year_month_prefix)
+    if not shares:
+        print("无数据")
+        return
+    scope = year_month_prefix or "全部"
+    lines = ["-------------------------------", f"分类占比 ({scope}):"]
+    for label, total, share in shares:
+        lines.append(f"  {_label_text(label)}: {total:.2f}元 ({share * 100:.1f}%)")
+    lines.append("-------------------------------")
+    print("\n".join(lines))
+
+def display_monthly_series(parent_title=None, child_title=None, db_path='bills.db'):
+    """显示全部历史的月度合计序列，可限定父分类或子分类。"""
+    series = get_snapshot(db_path).monthly_series(parent_title, child_title)
+    if not series:
+        print("无数据")
+        return
+    scope = child_title or parent_title or "全部分类"
+    lines = ["-------------------------------", f"月度序列 ({scope}):"]
+    for ym_str, total in series:
+        lines.append(f"  {ym_str[:4]}年{int(ym_str[4:])}月: {total:.2f}元")
+    lines.append("-------------------------------")
+    print("\n".join(lines))
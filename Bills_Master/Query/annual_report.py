@@ -0,0 +1,137 @@
+# annual_report.py
+"""
+年度报告：一次读取全年的消费项目，在内存中生成全部年度报表，
+相当于依次运行 年消费查询、12 次月消费详情、12 次导出月账单 和 每个父分类的年度分类统计，
+但只打开一个连接、只执行一条查询。各部分的格式与对应菜单项的输出完全相同。
+
+输出可以是一个目录:
+    summary.txt           年度总览
+    categories.txt        各父分类的年度合计和分类明细透视表
+    details/<YYYYMM>.txt  各月消费详情
+    bills/<YYYYMM>.txt    各月导出的账单（与 导出月账单 相同）
+也可以是单个文本文件，按上面的顺序依次写入各部分，每部分前有一行标题。
+
+命令行用法（在 Bills_Master 目录下）:
+    python -m Query.annual_report 2024 -o report_2024
+    python -m Query.annual_report 2024 --single-file -o report_2024.txt
+"""
+import argparse
+import os
+import sys
+
+from common import RED, GREEN, RESET
+from Inserter.db_config import load_database_config
+from profiler import enable_profiling, profile_stage, profiling_requested
+from .connection import database_from_config
+from .query_db import (
+    BaseQuery, YearlySummaryQuery, MonthlyDetailsQuery, MonthlyBillExportQuery,
+    CategoryBreakdownQuery, YearlyCategoryQuery
+)
+
+
+class AnnualReportQuery(BaseQuery):
+    """一次取回全年的消费项目，复用各查询类的格式化方法生成年度报告的每一部分。"""
+
+    def __init__(self, year, db_path='bills.db'):
+        super().__init__(db_path)
+        self.year = str(year)
+
+    def _years(self):
+        return [self.year]
+
+    def _fetch_data(self):
+        """按账单顺序返回全年的 (year_month, parent, child, amount, desc) 行。"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(MonthlyDetailsQuery.ITEMS_SQL, (f"{self.year}01", f"{self.year}12"))
+            return cursor.fetchall()
+
+    def _format_data(self, rows):
+        """返回 [(相对路径, 标题, 文本)]，顺序即单文件报告中各部分的顺序。"""
+        if not rows:
+            return []
+        rows_by_month = {}
+        for row in rows:
+            rows_by_month.setdefault(row[0], []).append(row)
+        months = {ym: MonthlyDetailsQuery._structure(month_rows) for ym, month_rows in rows_by_month.items()}
+        pivot = CategoryBreakdownQuery._pivot([(ym, p_title, c_title, amount) for ym, p_title, c_title, amount, _ in rows])
+
+        summary = YearlySummaryQuery(self.year)._format_data([(ym, data[0]) for ym, data in months.items()])
+        category_lines = [
+            YearlyCategoryQuery(self.year, p_title)._format_data(pivot)
+            for p_title in sorted(pivot[self.year], key=lambda title: -sum(pivot[self.year][title]['months']))
+        ]
+        category_lines.append(CategoryBreakdownQuery(self.year)._format_data(pivot))
+        sections = [
+            ('summary.txt', f"{self.year}年消费统计", summary),
+            ('categories.txt', f"{self.year}年分类统计", "\n".join(category_lines)),
+        ]
+        for ym, data in months.items():
+            sections.append((os.path.join('details', f"{ym}.txt"), f"{ym} 月消费详情",
+                             MonthlyDetailsQuery(self.year, ym[4:])._format_data(data).lstrip("\n")))
+        for ym, data in months.items():
+            sections.append((os.path.join('bills', f"{ym}.txt"), f"{ym} 月账单",
+                             MonthlyBillExportQuery(self.year, ym[4:])._format_data(data)))
+        return sections
+
+    def run(self, output_path, single_file=False):
+        """
+        生成报告并写入 output_path：single_file 为 True 时写成一个文本文件，否则写入目录。
+        返回写出的部分数；该年没有数据时不创建任何文件，返回 0。
+        """
+        sections = self._format_data(self._fetch_data())
+        if not sections:
+            print(f"{RED}{self.year}年无数据，未生成报告。{RESET}")
+            return 0
+        if single_file:
+            with open(output_path, 'w', encoding='utf-8') as out:
+                for i, (_, title, text) in enumerate(sections):
+                    if i > 0:
+                        out.write("\n")
+                    out.write(f"===== {title} =====\n{text}\n")
+        else:
+            for relative_path, _, text in sections:
+                path = os.path.join(output_path, relative_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as out:
+                    out.write(text + "\n")
+        print(f"{GREEN}已生成{self.year}年度报告（{len(sections)} 个部分）: '{output_path}'。{RESET}")
+        return len(sections)
+
+
+# ==============================================================================
+# 公共接口函数
+# ==============================================================================
+
+def write_annual_report(year, output_path, single_file=False, db_path='bills.db'):
+    """一次读取全年数据并生成年度报告，写入目录或单个文本文件。返回写出的部分数。"""
+    query = AnnualReportQuery(year, db_path)
+    return query.run(output_path, single_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成年度报告（年度总览、各月详情、各月账单和分类统计）。")
+    parser.add_argument('year', help="年份 YYYY")
+    parser.add_argument('-o', '--output', help="输出目录（--single-file 时为输出文件），缺省为 annual_report_<年份>[.txt]")
+    parser.add_argument('--single-file', action='store_true', help="写成一个文本文件而不是目录")
+    parser.add_argument('--db', help="数据库文件，缺省时按 config/database_config.json 选择")
+    parser.add_argument('--profile', action='store_true', help="按阶段采集 cProfile/tracemalloc 数据，退出时写入 profiles/")
+    args = parser.parse_args(argv)
+    if not (args.year.isdigit() and len(args.year) == 4):
+        parser.error("年份必须是四位数字")
+    if profiling_requested(args.profile):
+        enable_profiling()
+
+    db_config = load_database_config()
+    database = args.db or database_from_config(db_config)
+    if isinstance(database, str) and not os.path.exists(database):
+        print(f"{RED}错误: 数据库 '{database}' 不存在。{RESET}", file=sys.stderr)
+        return 1
+    output_path = args.output or f"annual_report_{args.year}{'.txt' if args.single_file else ''}"
+    with profile_stage('query'):
+        written = write_annual_report(args.year, output_path, args.single_file, database)
+    return 0 if written else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# connection.py
+"""
+查询模块共用的数据库连接工具。
+查询类的 db_path 既可以是单个数据库文件的路径，也可以是 ShardCatalog（按年分片存储）。
+查询连接一律以只读方式打开，并通过 read_snapshot 在一个读事务中执行：数据库处于 WAL 模式时，
+导入进行期间查询读取的是开始时刻一致的快照，既不会被导入阻塞，也不会看到导入到一半的数据。
+"""
+import sqlite3
+from contextlib import contextmanager
+
+from Inserter.shard_catalog import ShardCatalog, read_only_uri
+
+
+def is_sharded(database):
+    return isinstance(database, ShardCatalog)
+
+
+def database_from_config(db_config):
+    """根据 database_config 的存储模式返回查询使用的数据库：单文件路径，或按年分片的 ShardCatalog。"""
+    if db_config['storage_mode'] == 'sharded':
+        return ShardCatalog(db_config['shard_dir'])
+    return db_config['db_path']
+
+
+def open_connection(database, years=None, check_same_thread=True):
+    """
+    打开一个可以直接执行 YearMonth/Parent/Child/Item 查询的只读连接。
+    分片模式下只 ATTACH years 涉及的分片；years 为 None 表示全部年份。
+    check_same_thread 为 False 时连接可以在多个线程间使用，由调用方负责加锁。
+    """
+    if is_sharded(database):
+        return database.connect(years, check_same_thread, read_only=True)
+    return sqlite3.connect(read_only_uri(database), check_same_thread=check_same_thread, uri=True)
+
+
+@contextmanager
+def read_snapshot(conn):
+    """
+    在一个读事务中使用连接：其中的多条查询看到的是同一个数据快照，结束时立即释放，
+    以免长期占用快照而阻止导入对 WAL 执行检查点。连接已处于事务中时直接使用。
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+
+def physical_databases(database, years=None):
+    """
+    返回查询涉及的各个物理数据库文件。
+    FTS5 等虚拟表无法跨分片合并成视图，这类查询需要逐个分片执行后再合并结果。
+    """
+    if is_sharded(database):
+        return database.shard_paths(years)
+    return [database]
+
+
+def data_version(conn):
+    """返回连接上所有数据库（含 ATTACH 的分片）的 PRAGMA data_version，任一分片被其他连接修改时都会变化。"""
+    schemas = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] != 'temp']
+    return tuple(conn.execute(f"PRAGMA {schema}.data_version").fetchone()[0] for schema in schemas)
@@ -0,0 +1,143 @@
+# ledger_dump.py
+"""
+把整个账本导出为扁平的 CSV 或 JSONL（每行一个消费项目），供其他工具读取。
+只使用一个游标并通过 fetchmany 分批读取，内存占用与数据库大小无关；输出可以写入文件或标准输出。
+
+命令行用法（在 Bills_Master 目录下）:
+    python -m Query.ledger_dump --format jsonl --from 202201 --to 202212 > items.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+from common import RED, GREEN, RESET
+from Inserter.db_config import load_database_config
+from profiler import enable_profiling, profile_stage, profiling_requested
+from .connection import database_from_config
+from .query_db import BaseQuery
+
+DUMP_FORMATS = ('csv', 'jsonl')
+
+
+class LedgerDumpQuery(BaseQuery):
+    """逐条导出所有消费项目，可按年月区间过滤。"""
+    FETCH_SIZE = 1000
+    COLUMNS = [
+        'year_month', 'parent_title', 'parent_order', 'child_title', 'child_order',
+        'item_order', 'amount', 'description'
+    ]
+
+    def __init__(self, fmt='csv', start_year_month=None, end_year_month=None, db_path='bills.db'):
+        super().__init__(db_path)
+        if fmt not in DUMP_FORMATS:
+            raise ValueError(f"不支持的导出格式 '{fmt}'，可选: {', '.join(DUMP_FORMATS)}")
+        self.fmt = fmt
+        self.start_year_month = start_year_month
+        self.end_year_month = end_year_month
+
+    def _years(self):
+        return self._years_between(self.start_year_month, self.end_year_month)
+
+    def _iter_rows(self):
+        """在同一个游标上用 fetchmany 分批取回所有行。"""
+        sql = '''
+            SELECT ym.year_month, pc.name, p.order_num, cc.name, c.order_num, i.order_num, i.amount, d.text
+            FROM YearMonth ym
+            JOIN Parent p ON p.year_month_id = ym.id
+            JOIN Child c ON c.parent_id = p.id
+            JOIN Item i ON i.child_id = c.id
+            JOIN Category pc ON pc.id = p.title_id
+            JOIN Category cc ON cc.id = c.title_id
+            JOIN Description d ON d.id = i.description_id
+        '''
+        conditions, params = [], []
+        if self.start_year_month:
+            conditions.append("ym.year_month >= ?")
+            params.append(self.start_year_month)
+        if self.end_year_month:
+            conditions.append("ym.year_month <= ?")
+            params.append(self.end_year_month)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY ym.year_month, p.order_num, c.order_num, i.order_num"
+
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(self.FETCH_SIZE)
+                if not rows:
+                    break
+                yield from rows
+
+    def write(self, out):
+        """把所有行写入文本流 out，返回写出的行数。"""
+        count = 0
+        if self.fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(self.COLUMNS)
+            for row in self._iter_rows():
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in self._iter_rows():
+                out.write(json.dumps(dict(zip(self.COLUMNS, row)), ensure_ascii=False))
+                out.write('\n')
+                count += 1
+        return count
+
+    def run(self, output_path=None):
+        """
+        导出到 output_path；output_path 为空时写到标准输出，此时不打印任何提示，
+        以保证输出是干净的 CSV/JSONL 流。
+        """
+        if not output_path:
+            return self.write(sys.stdout)
+        with open(output_path, 'w', encoding='utf-8', newline='') as out:
+            count = self.write(out)
+        print(f"{GREEN}已导出 {count} 条消费记录到 '{output_path}'。{RESET}")
+        return count
+
+
+# ==============================================================================
+# 公共接口函数
+# ==============================================================================
+
+def dump_ledger(output_path=None, fmt='csv', start_year_month=None, end_year_month=None, db_path='bills.db'):
+    """把所有消费项目导出为 CSV 或 JSONL；output_path 为空时写到标准输出。返回导出的行数。"""
+    query = LedgerDumpQuery(fmt, start_year_month, end_year_month, db_path)
+    return query.run(output_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导出全部消费项目为 CSV 或 JSONL。")
+    parser.add_argument('--format', choices=DUMP_FORMATS, default='csv')
+    parser.add_argument('--from', dest='start_year_month', help="起始年月 YYYYMM")
+    parser.add_argument('--to', dest='end_year_month', help="结束年月 YYYYMM")
+    parser.add_argument('-o', '--output', help="输出文件，缺省时写到标准输出")
+    parser.add_argument('--db', help="数据库文件，缺省时按 config/database_config.json 选择")
+    parser.add_argument('--profile', action='store_true', help="按阶段采集 cProfile/tracemalloc 数据，退出时写入 profiles/")
+    args = parser.parse_args(argv)
+    if profiling_requested(args.profile):
+        enable_profiling()
+
+    db_config = load_database_config()
+    database = args.db or database_from_config(db_config)
+    if isinstance(database, str) and not os.path.exists(database):
+        print(f"{RED}错误: 数据库 '{database}' 不存在。{RESET}", file=sys.stderr)
+        return 1
+    try:
+        with profile_stage('query'):
+            dump_ledger(args.output, args.format, args.start_year_month, args.end_year_month, database)
+    except BrokenPipeError:
+        # 下游（如 head）提前关闭了管道：把 stdout 指向 devnull，避免解释器退出时再次报错
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,171 +1,842 @@
-# query_db.py
-import sqlite3
-
-# ==============================================================================
-# 0. 查询基类 (用于共享逻辑)
-# ==============================================================================
-class BaseQuery:
-    """所有查询类的基类，用于共享数据库路径。"""
-    def __init__(self, db_path='bills.db'):
-        self.db_path = db_path
-
-    def run(self):
-        """运行查询的模板方法。"""
-        # 这是一个抽象方法，子类应该实现自己的版本
-        raise NotImplementedError("每个查询子类必须实现 run() 方法")
-
-# ==============================================================================
-# 1. 针对每种查询的独立类
-# ==============================================================================
-
-class YearlySummaryQuery(BaseQuery):
-    """处理年度消费总览的查询类。"""
-    def __init__(self, year, db_path='bills.db'):
-        super().__init__(db_path)
-        self.year = year
-
-    def _fetch_data(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT ym.year_month, SUM(i.amount)
-                FROM YearMonth ym
-                JOIN Parent p ON ym.id = p.year_month_id
-                JOIN Child c ON p.id = c.parent_id
-                JOIN Item i ON c.id = i.child_id
-                WHERE ym.year_month LIKE ? || '%'
-                GROUP BY ym.year_month
-            ''', (self.year,))
-            return cursor.fetchall()
-
-    def _format_data(self, data):
-        if not data:
-            return "无数据"
-        year_total = sum(row[1] for row in data)
-        month_count = len(data)
-        average = year_total / month_count
-        lines = [
-            "-------------------------------",
-            f"{self.year}年消费统计:",
-            f"年度总消费: {year_total:.2f}元",
-            f"月均消费: {average:.2f}元", "各月消费明细:"
-        ]
-        for ym_str, total in data:
-            lines.append(f"  {self.year}年{int(ym_str[4:])}月: {total:.2f}元")
-        lines.append("-------------------------------")
-        return "\n".join(lines)
-
-    def run(self):
-        data = self._fetch_data()
-        output = self._format_data(data)
-        print(output)
-
-class MonthlyDetailsQuery(BaseQuery):
-    """处理月度消费详情的查询类。"""
-    def __init__(self, year, month, db_path='bills.db'):
-        super().__init__(db_path)
-        self.year = year
-        self.month = f"{int(month):02d}"
-        self.year_month = f"{year}{self.month}"
-
-    def _fetch_data(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT SUM(i.amount) FROM Item i JOIN Child c ON i.child_id = c.id JOIN Parent p ON c.parent_id = p.id JOIN YearMonth ym ON p.year_month_id = ym.id WHERE ym.year_month = ?", (self.year_month,))
-            total_result = cursor.fetchone()
-            if not total_result or total_result[0] is None:
-                return None, None
-            
-            # 使用内部帮助函数来获取结构化数据
-            cursor.execute('''WITH parent_totals AS (...), child_totals AS (...) SELECT ...''', (self.year_month,))
-            structured_data = {} # ... 此处省略与之前版本相同的结构化数据构造逻辑
-            for row in cursor.fetchall():
-                 (p_title, p_total, c_title, c_total, amount, desc) = row
-                 if p_title not in structured_data: structured_data[p_title] = {'total': p_total, 'children': {}}
-                 if c_title not in structured_data[p_title]['children']: structured_data[p_title]['children'][c_title] = {'total': c_total, 'items': []}
-                 structured_data[p_title]['children'][c_title]['items'].append((amount, desc))
-            return total_result[0], structured_data
-
-    def _format_data(self, data):
-        total_amount, detailed_data = data
-        if total_amount is None:
-            return "无数据"
-        lines = [f"\n{self.year_month} 总消费: {total_amount:.2f}元"]
-        for p_title, p_data in detailed_data.items():
-            percentage = (p_data['total'] / total_amount * 100) if total_amount else 0
-            lines.append(f"\n【{p_title}】{p_data['total']:.2f}元 ({percentage:.1f}%)")
-            for c_title, c_data in p_data['children'].items():
-                lines.append(f"\n    {c_title}: {c_data['total']:.2f}元")
-                for amount, desc in c_data['items']:
-                    lines.append(f"        {int(amount) if float(amount).is_integer() else amount} {desc}")
-        return "\n".join(lines)
-
-    def run(self):
-        data = self._fetch_data()
-        output = self._format_data(data)
-        print(output)
-
-class MonthlyBillExportQuery(MonthlyDetailsQuery): # 继承月度详情查询类，因为它需要相同的数据
-    """处理导出月度账单的查询类。"""
-    def _format_data(self, data): # 只重写格式化方法
-        _, detailed_data = data
-        if not detailed_data:
-            return "无数据"
-        output = [f"DATE:{self.year_month}"]
-        for i, (p_title, p_data) in enumerate(detailed_data.items()):
-            if i > 0: output.append('')
-            output.append(p_title)
-            for c_title, c_data in p_data['children'].items():
-                output.append(f"    {c_title}")
-                for amount, desc in c_data['items']:
-                    output.append(f"        {int(amount) if float(amount).is_integer() else amount} {desc}")
-        return "\n".join(output)
-
-class YearlyCategoryQuery(BaseQuery):
-    """处理年度分类统计的查询类。"""
-    def __init__(self, year, parent_title, db_path='bills.db'):
-        super().__init__(db_path)
-        self.year = year
-        self.parent_title = parent_title
-
-    def _fetch_data(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT SUM(i.amount) FROM Item i JOIN Child c ON ... WHERE ym.year_month LIKE ? || '%' AND p.title = ?", (self.year, self.parent_title))
-            result = cursor.fetchone()
-            return result[0] if result else None
-
-    def _format_data(self, total):
-        if total is not None:
-            return f"{self.year}年[{self.parent_title}]总消费: {total:.2f}元"
-        return "无数据"
-
-    def run(self):
-        data = self._fetch_data()
-        output = self._format_data(data)
-        print(output)
-
-
-# ==============================================================================
-# 2. 公共接口函数
-# ==============================================================================
-
-def display_yearly_summary(year):
-    """查询并显示年度消费总览。"""
-    query = YearlySummaryQuery(year)
-    query.run()
-
-def display_monthly_details(year, month):
-    """查询并显示月度消费详情。"""
-    query = MonthlyDetailsQuery(year, month)
-    query.run()
-
-def export_monthly_bill_as_text(year, month):
-    """以纯文本格式导出月度账单。"""
-    query = MonthlyBillExportQuery(year, month)
-    query.run()
-
-def display_yearly_parent_category_summary(year, parent_title):
-    """查询并显示指定父分类的年度总消费。"""
-    query = YearlyCategoryQuery(year, parent_title)
-    query.run()
\ No newline at end of file
+# query_db.py
+import heapq
+import unicodedata
+from contextlib import ExitStack, contextmanager
+
+from TextParser.description_key import group_duplicates
+from TextParser.search_tokenizer import build_match_query
+from .connection import open_connection, physical_databases, read_snapshot
+
+# ==============================================================================
+# 0. 查询基类 (用于共享逻辑)
+# ==============================================================================
+class BaseQuery:
+    """
+    所有查询类的基类，用于共享数据库路径和连接逻辑。
+    db_path 可以是数据库文件路径，也可以是 ShardCatalog（按年分片存储）。
+    """
+    # 长期运行的查询服务（query_service）可以注入一个保持打开的连接；为 None 时每次查询单独打开并关闭连接
+    connection = None
+    # 分类标题和消费描述保存在 Category / Description 字典表中，其余表只保存整数 id。
+    # 查询按 id 过滤和分组，只在输出时解码为文本；按标题过滤时先把标题换成 id。
+    CATEGORY_ID_SQL = "(SELECT id FROM Category WHERE name = ?)"
+
+    def __init__(self, db_path='bills.db'):
+        self.db_path = db_path
+
+    def _years(self):
+        """查询涉及的年份列表，None 表示全部年份。分片存储时只 ATTACH 这些年份的分片。"""
+        return None
+
+    @staticmethod
+    def _years_between(start_year_month=None, end_year_month=None):
+        """年月区间涉及的年份列表；缺省的一端不设限，两端都缺省时返回 None（全部年份）。"""
+        if not start_year_month and not end_year_month:
+            return None
+        first_year = int((start_year_month or '0001')[:4])
+        last_year = int((end_year_month or '9999')[:4])
+        return [str(year) for year in range(first_year, last_year + 1)]
+
+    @contextmanager
+    def _connect(self):
+        """
+        打开查询所需的只读连接，在一个读快照中使用，并在使用完毕后关闭；
+        已注入共享连接时直接使用它，且不关闭。
+        """
+        if self.connection is not None:
+            with read_snapshot(self.connection) as conn:
+                yield conn
+            return
+        conn = open_connection(self.db_path, self._years())
+        try:
+            with read_snapshot(conn):
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connect_each(self):
+        """
+        FTS5 虚拟表等无法合并成跨分片视图的查询使用：为涉及的每个物理数据库打开只读连接，
+        返回按年份排序的连接列表，各自在一个读快照中使用，使用完毕后全部关闭。
+        已注入共享连接时只返回它；注入的应当是单个数据库的连接（如 db_backup.open_snapshot_in_memory 载入的快照），
+        分片存储的 ATTACH 连接只有合并视图，不能用于这类查询。
+        """
+        if self.connection is not None:
+            with read_snapshot(self.connection) as conn:
+                yield [conn]
+            return
+        connections = []
+        try:
+            with ExitStack() as snapshots:
+                for database in physical_databases(self.db_path, self._years()):
+                    connections.append(open_connection(database))
+                    snapshots.enter_context(read_snapshot(connections[-1]))
+                yield connections
+        finally:
+            for conn in connections:
+                conn.close()
+
+    def run(self):
+        """运行查询的模板方法。"""
+        # 这是一个抽象方法，子类应该实现自己的版本
+        raise NotImplementedError("每个查询子类必须实现 run() 方法")
+
+# ==============================================================================
+# 1. 针对每种查询的独立类
+# ==============================================================================
+
+class YearlySummaryQuery(BaseQuery):
+    """处理年度消费总览的查询类。"""
+    def __init__(self, year, db_path='bills.db'):
+        super().__init__(db_path)
+        self.year = year
+
+    def _years(self):
+        return [self.year]
+
+    def _fetch_data(self):
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT ym.year_month, SUM(i.amount)
+                FROM YearMonth ym
+                JOIN Parent p ON ym.id = p.year_month_id
+                JOIN Child c ON p.id = c.parent_id
+                JOIN Item i ON c.id = i.child_id
+                WHERE ym.year_month LIKE ? || '%'
+                GROUP BY ym.year_month
+            ''', (self.year,))
+            return cursor.fetchall()
+
+    def _format_data(self, data):
+        if not data:
+            return "无数据"
+        year_total = sum(row[1] for row in data)
+        month_count = len(data)
+        average = year_total / month_count
+        lines = [
+            "-------------------------------",
+            f"{self.year}年消费统计:",
+            f"年度总消费: {year_total:.2f}元",
+            f"月均消费: {average:.2f}元", "各月消费明细:"
+        ]
+        for ym_str, total in data:
+            lines.append(f"  {self.year}年{int(ym_str[4:])}月: {total:.2f}元")
+        lines.append("-------------------------------")
+        return "\n".join(lines)
+
+    def run(self):
+        data = self._fetch_data()
+        output = self._format_data(data)
+        print(output)
+
+class MonthlyDetailsQuery(BaseQuery):
+    """处理月度消费详情的查询类。"""
+    # 按账单中的顺序取出区间内的全部消费项目；年度报告（annual_report）用同一条语句一次读取全年
+    ITEMS_SQL = '''
+        SELECT ym.year_month, pc.name, cc.name, i.amount, d.text
+        FROM YearMonth ym
+        JOIN Parent p ON ym.id = p.year_month_id
+        JOIN Child c ON p.id = c.parent_id
+        JOIN Item i ON c.id = i.child_id
+        JOIN Category pc ON pc.id = p.title_id
+        JOIN Category cc ON cc.id = c.title_id
+        JOIN Description d ON d.id = i.description_id
+        WHERE ym.year_month BETWEEN ? AND ?
+        ORDER BY ym.year_month, p.order_num, c.order_num, i.order_num
+    '''
+
+    def __init__(self, year, month, db_path='bills.db'):
+        super().__init__(db_path)
+        self.year = year
+        self.month = f"{int(month):02d}"
+        self.year_month = f"{year}{self.month}"
+
+    def _years(self):
+        return [self.year]
+
+    def _fetch_data(self):
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.ITEMS_SQL, (self.year_month, self.year_month))
+            return self._structure(cursor.fetchall())
+
+    @staticmethod
+    def _structure(rows):
+        """
+        将同一个月的 (year_month, parent, child, amount, desc) 行整理为
+        (总消费, {parent: {'total': 合计, 'children': {child: {'total': 合计, 'items': [(amount, desc)]}}}})；
+        没有行时返回 (None, None)。
+        """
+        if not rows:
+            return None, None
+        total_amount = 0.0
+        structured_data = {}
+        for _, p_title, c_title, amount, desc in rows:
+            parent = structured_data.setdefault(p_title, {'total': 0.0, 'children': {}})
+            child = parent['children'].setdefault(c_title, {'total': 0.0, 'items': []})
+            child['items'].append((amount, desc))
+            child['total'] += amount
+            parent['total'] += amount
+            total_amount += amount
+        return total_amount, structured_data
+
+    def _format_data(self, data):
+        total_amount, detailed_data = data
+        if total_amount is None:
+            return "无数据"
+        lines = [f"\n{self.year_month} 总消费: {total_amount:.2f}元"]
+        for p_title, p_data in detailed_data.items():
+            percentage = (p_data['total'] / total_amount * 100) if total_amount else 0
+            lines.append(f"\n【{p_title}】{p_data['total']:.2f}元 ({percentage:.1f}%)")
+            for c_title, c_data in p_data['children'].items():
+                lines.append(f"\n    {c_title}: {c_data['total']:.2f}元")
+                for amount, desc in c_data['items']:
+                    lines.append(f"        {int(amount) if float(amount).is_integer() else amount} {desc}")
+        return "\n".join(lines)
+
+    def run(self):
+        data = self._fetch_data()
+        output = self._format_data(data)
+        print(output)
+
+class MonthlyBillExportQuery(MonthlyDetailsQuery): # 继承月度详情查询类，因为它需要相同的数据
+    """处理导出月度账单的查询类。"""
+    def _format_data(self, data): # 只重写格式化方法
+        _, detailed_data = data
+        if not detailed_data:
+            return "无数据"
+        output = [f"DATE:{self.year_month}"]
+        for i, (p_title, p_data) in enumerate(detailed_data.items()):
+            if i > 0: output.append('')
+            output.append(p_title)
+            for c_title, c_data in p_data['children'].items():
+                output.append(f"    {c_title}")
+                for amount, desc in c_data['items']:
+                    output.append(f"        {int(amount) if float(amount).is_integer() else amount} {desc}")
+        return "\n".join(output)
+
+class CategoryBreakdownQuery(BaseQuery):
+    """
+    处理分类明细统计的查询类。
+    一次 GROUP BY 取出区间内所有父/子分类的逐月合计，并整理成“分类行 × 月份列”的透视表。
+    """
+    def __init__(self, start_year, end_year=None, parent_title=None, db_path='bills.db'):
+        super().__init__(db_path)
+        self.start_year = str(start_year)
+        self.end_year = str(end_year) if end_year else self.start_year
+        self.parent_title = parent_title
+
+    def _years(self):
+        return [str(year) for year in range(int(self.start_year), int(self.end_year) + 1)]
+
+    def _fetch_data(self):
+        sql = '''
+            SELECT ym.year_month, p.title_id AS parent_title_id, c.title_id AS child_title_id, SUM(i.amount) AS total
+            FROM YearMonth ym
+            JOIN Parent p ON ym.id = p.year_month_id
+            JOIN Child c ON p.id = c.parent_id
+            JOIN Item i ON c.id = i.child_id
+            WHERE ym.year_month BETWEEN ? AND ?
+        '''
+        params = [f"{self.start_year}01", f"{self.end_year}12"]
+        if self.parent_title:
+            sql += f" AND p.title_id = {self.CATEGORY_ID_SQL}"
+            params.append(self.parent_title)
+        sql += " GROUP BY ym.year_month, p.title_id, c.title_id"
+        sql = f'''
+            SELECT g.year_month, pc.name, cc.name, g.total
+            FROM ({sql}) g
+            JOIN Category pc ON pc.id = g.parent_title_id
+            JOIN Category cc ON cc.id = g.child_title_id
+        '''
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return self._pivot(cursor.fetchall())
+
+    @staticmethod
+    def _pivot(rows):
+        """
+        将 (year_month, parent, child, total) 行转换为透视表:
+        {year: {parent: {'months': [12个月合计], 'children': {child: [12个月合计]}}}}
+        """
+        pivot = {}
+        for ym_str, p_title, c_title, total in sorted(rows):
+            year, month_index = ym_str[:4], int(ym_str[4:]) - 1
+            parent_row = pivot.setdefault(year, {}).setdefault(
+                p_title, {'months': [0.0] * 12, 'children': {}}
+            )
+            parent_row['months'][month_index] += total
+            child_months = parent_row['children'].setdefault(c_title, [0.0] * 12)
+            child_months[month_index] += total
+        return pivot
+
+    @staticmethod
+    def _pad(text, width):
+        """按终端显示宽度（中文占两列）补齐文本。"""
+        display_width = sum(2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1 for ch in text)
+        return text + ' ' * max(width - display_width, 0)
+
+    def _format_row(self, title, months, title_width):
+        cells = [f"{value:>9.2f}" if value else f"{'-':>9}" for value in months]
+        return f"{self._pad(title, title_width)} {' '.join(cells)} {sum(months):>10.2f}"
+
+    @staticmethod
+    def _parent_total_line(year, parent_title, pivot):
+        """从透视表中取出某个父分类的全年合计。"""
+        parent_row = pivot.get(str(year), {}).get(parent_title)
+        if parent_row is not None:
+            return f"{year}年[{parent_title}]总消费: {sum(parent_row['months']):.2f}元"
+        return "无数据"
+
+    def _format_data(self, pivot):
+        if not pivot:
+            return "无数据"
+        title_width = 24
+        header = f"{self._pad('分类', title_width)} " + ' '.join(f"{f'{m}月':>8}" for m in range(1, 13)) + f" {'合计':>8}"
+        lines = []
+        for year, parents in pivot.items():
+            year_total = [sum(row['months'][m] for row in parents.values()) for m in range(12)]
+            if self.parent_title:
+                # 按父分类过滤时，该父分类的全年合计直接取自同一张透视表，不再单独查询
+                lines.append(self._parent_total_line(year, self.parent_title, pivot))
+            lines.append("-------------------------------")
+            lines.append(f"{year}年分类明细:")
+            lines.append(header)
+            for p_title, p_row in sorted(parents.items(), key=lambda kv: -sum(kv[1]['months'])):
+                lines.append(self._format_row(f"【{p_title}】", p_row['months'], title_width))
+                for c_title, c_months in sorted(p_row['children'].items(), key=lambda kv: -sum(kv[1])):
+                    lines.append(self._format_row(f"    {c_title}", c_months, title_width))
+            lines.append(self._format_row("总计", year_total, title_width))
+        lines.append("-------------------------------")
+        return "\n".join(lines)
+
+    def run(self):
+        data = self._fetch_data()
+        output = self._format_data(data)
+        print(output)
+
+class YearlyCategoryQuery(CategoryBreakdownQuery):
+    """处理年度分类统计的查询类（分类明细引擎按单个父分类过滤后的结果）。"""
+    def __init__(self, year, parent_title, db_path='bills.db'):
+        super().__init__(year, parent_title=parent_title, db_path=db_path)
+        self.year = year
+
+    def _format_data(self, pivot):
+        return self._parent_total_line(self.year, self.parent_title, pivot)
+
+
+class ItemSearchQuery(BaseQuery):
+    """
+    处理按描述全文检索消费项目的查询类。
+    通过 ItemSearch (FTS5) 索引定位匹配的 Item，再沿层级取回年月、父分类和子分类。
+    """
+    MAX_DISPLAY_ROWS = 200
+
+    def __init__(self, keywords, start_year_month=None, end_year_month=None, db_path='bills.db'):
+        super().__init__(db_path)
+        self.keywords = keywords
+        self.start_year_month = start_year_month
+        self.end_year_month = end_year_month
+
+    def _years(self):
+        return self._years_between(self.start_year_month, self.end_year_month)
+
+    def _fetch_data(self):
+        match_query = build_match_query(self.keywords)
+        if not match_query:
+            return None
+        sql = '''
+            SELECT ym.year_month, pc.name, cc.name, i.amount, d.text
+            FROM ItemSearch s
+            JOIN Item i ON i.id = s.rowid
+            JOIN Child c ON c.id = i.child_id
+            JOIN Parent p ON p.id = c.parent_id
+            JOIN YearMonth ym ON ym.id = p.year_month_id
+            JOIN Category pc ON pc.id = p.title_id
+            JOIN Category cc ON cc.id = c.title_id
+            JOIN Description d ON d.id = i.description_id
+            WHERE ItemSearch MATCH ?
+        '''
+        params = [match_query]
+        if self.start_year_month:
+            sql += " AND ym.year_month >= ?"
+            params.append(self.start_year_month)
+        if self.end_year_month:
+            sql += " AND ym.year_month <= ?"
+            params.append(self.end_year_month)
+        sql += " ORDER BY ym.year_month, p.order_num, c.order_num, i.order_num"
+
+        rows, count, total, yearly_totals = [], 0, 0.0, {}
+        # FTS5 虚拟表不能合并成跨分片视图，因此逐个物理数据库检索；分片按年份排序，结果顺序不变
+        with self._connect_each() as connections:
+            for conn in connections:
+                # 统计量在遍历游标时累计，只保留有限的明细行用于显示
+                for row in conn.execute(sql, params):
+                    count += 1
+                    total += row[3]
+                    yearly_totals[row[0][:4]] = yearly_totals.get(row[0][:4], 0.0) + row[3]
+                    if len(rows) < self.MAX_DISPLAY_ROWS:
+                        rows.append(row)
+        return {'rows': rows, 'count': count, 'total': total, 'yearly_totals': yearly_totals}
+
+    def _format_data(self, data):
+        if not data or not data['count']:
+            return "无数据"
+        lines = ["-------------------------------", f"检索 '{self.keywords}' 的结果:"]
+        for ym_str, p_title, c_title, amount, desc in data['rows']:
+            lines.append(f"  {ym_str} 【{p_title}】{c_title}: {int(amount) if float(amount).is_integer() else amount} {desc}")
+        if data['count'] > len(data['rows']):
+            lines.append(f"  ... 另有 {data['count'] - len(data['rows'])} 条结果未显示")
+        lines.append("各年合计:")
+        for year, year_total in sorted(data['yearly_totals'].items()):
+            lines.append(f"  {year}年: {year_total:.2f}元")
+        lines.append(f"共 {data['count']} 条, 合计: {data['total']:.2f}元")
+        lines.append("-------------------------------")
+        return "\n".join(lines)
+
+    def run(self):
+        data = self._fetch_data()
+        output = self._format_data(data)
+        print(output)
+
+
+class TrendQuery(BaseQuery):
+    """
+    处理消费趋势分析的查询类：逐月的环比 (MoM)、同比 (YoY)、近 3 个月和近 12 个月的滚动均值，以及年初至今的累计。
+    先在 SQL 中把全部历史预聚合为逐月合计（按父分类或整体），用覆盖全部账单月份的日历补齐没有消费的月份（计为 0），
+    再用窗口函数一次算出所有指标；年月区间只过滤输出，同比和滚动均值仍然使用区间之前的历史。
+    """
+    TREND_SQL = '''
+        WITH RECURSIVE months AS (
+            SELECT id, CAST(substr(year_month, 1, 4) AS INTEGER) * 12
+                       + CAST(substr(year_month, 5, 2) AS INTEGER) - 1 AS month_index
+            FROM YearMonth
+        ),
+        monthly AS (
+            SELECT ym.month_index, {category} AS category, SUM(i.amount) AS total
+            FROM months ym
+            JOIN Parent p ON ym.id = p.year_month_id
+            JOIN Child c ON p.id = c.parent_id
+            JOIN Item i ON c.id = i.child_id
+            {where}
+            GROUP BY ym.month_index, category
+        ),
+        calendar(month_index) AS (
+            SELECT MIN(month_index) FROM months
+            UNION ALL
+            SELECT month_index + 1 FROM calendar WHERE month_index < (SELECT MAX(month_index) FROM months)
+        ),
+        series AS (
+            SELECT cal.month_index, cat.category, COALESCE(m.total, 0.0) AS total
+            FROM calendar cal
+            CROSS JOIN (SELECT DISTINCT category FROM monthly) cat
+            LEFT JOIN monthly m ON m.month_index = cal.month_index AND m.category = cat.category
+        ),
+        trend AS (
+            SELECT printf('%04d%02d', month_index / 12, month_index % 12 + 1) AS year_month,
+                   category, total,
+                   LAG(total, 1) OVER w AS last_month,
+                   LAG(total, 12) OVER w AS last_year,
+                   CASE WHEN ROW_NUMBER() OVER w >= 3
+                        THEN AVG(total) OVER (w ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) END AS avg_3,
+                   CASE WHEN ROW_NUMBER() OVER w >= 12
+                        THEN AVG(total) OVER (w ROWS BETWEEN 11 PRECEDING AND CURRENT ROW) END AS avg_12,
+                   SUM(total) OVER (PARTITION BY category, month_index / 12 ORDER BY month_index) AS ytd
+            FROM series
+            WINDOW w AS (PARTITION BY category ORDER BY month_index)
+        )
+        SELECT year_month, {label}, total,
+               total - last_month, (total - last_month) / NULLIF(last_month, 0),
+               total - last_year, (total - last_year) / NULLIF(last_year, 0),
+               avg_3, avg_12, ytd
+        FROM trend
+        WHERE year_month BETWEEN ? AND ?
+        ORDER BY category, year_month
+    '''
+    COLUMNS = [
+        'year_month', 'total', 'mom_delta', 'mom_pct', 'yoy_delta', 'yoy_pct', 'avg_3', 'avg_12', 'ytd'
+    ]
+    TOTAL_CATEGORY = '全部'
+
+    def __init__(self, by_parent=False, parent_title=None, start_year_month=None, end_year_month=None,
+                 db_path='bills.db'):
+        super().__init__(db_path)
+        # 指定了父分类时只分析这一个分类
+        self.by_parent = by_parent or bool(parent_title)
+        self.parent_title = parent_title
+        self.start_year_month = start_year_month
+        self.end_year_month = end_year_month
+
+    def _fetch_data(self):
+        """返回 {分类: [每月一个指标字典, ...]}；整体趋势的分类名为 '全部'。"""
+        # 按父分类统计时以 Category id 分组，输出时再解码为标题
+        sql = self.TREND_SQL.format(
+            category="p.title_id" if self.by_parent else "'" + self.TOTAL_CATEGORY + "'",
+            where=f"WHERE p.title_id = {self.CATEGORY_ID_SQL}" if self.parent_title else "",
+            label="(SELECT name FROM Category WHERE id = category)" if self.by_parent else "category"
+        )
+        params = [self.parent_title] if self.parent_title else []
+        params += [self.start_year_month or '000000', self.end_year_month or '999999']
+        trend = {}
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            for year_month, category, *values in cursor.fetchall():
+                trend.setdefault(category, []).append(dict(zip(self.COLUMNS, [year_month] + values)))
+        return trend
+
+    @staticmethod
+    def _rjust(text, width):
+        """按终端显示宽度（中文占两列）右对齐文本。"""
+        display_width = sum(2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1 for ch in text)
+        return ' ' * max(width - display_width, 0) + text
+
+    @staticmethod
+    def _cell(value, pct=False):
+        if value is None:
+            return f"{'-':>10}"
+        return f"{value * 100:>+9.1f}%" if pct else f"{value:>10.2f}"
+
+    def _format_data(self, trend):
+        if not trend:
+            return "无数据"
+        header = "  " + self._rjust('年月', 6) + "  " + "".join(
+            self._rjust(title, 10) for title in ['本月', '环比', '环比%', '同比', '同比%', '近3月均', '近12月均', '年累计']
+        )
+        lines = []
+        categories = sorted(trend, key=lambda title: -sum(row['total'] for row in trend[title]))
+        for category in categories:
+            lines.append("-------------------------------")
+            lines.append(f"【{category}】消费趋势:")
+            lines.append(header)
+            for row in trend[category]:
+                lines.append(
+                    f"  {row['year_month']:<8}{self._cell(row['total'])}"
+                    f" {self._cell(row['mom_delta'])}{self._cell(row['mom_pct'], True)}"
+                    f" {self._cell(row['yoy_delta'])}{self._cell(row['yoy_pct'], True)}"
+                    f" {self._cell(row['avg_3'])} {self._cell(row['avg_12'])} {self._cell(row['ytd'])}"
+                )
+        lines.append("-------------------------------")
+        return "\n".join(lines)
+
+    def run(self):
+        data = self._fetch_data()
+        output = self._format_data(data)
+        print(output)
+
+
+class TopItemsQuery(BaseQuery):
+    """
+    处理大额消费查询的类：区间内金额最高的前 N 条消费，或金额不低于阈值的全部消费（两者可同时指定），
+    可限定父分类和子分类。
+    沿 Item(amount) 索引从大到小扫描，逐条回溯层级检查年月和分类条件，取够 N 条即停止，不需要对整个 Item 表排序；
+    分片存储时每个分片各取前 N 条，再按金额归并。
+    """
+    MAX_DISPLAY_ROWS = 200
+    DEFAULT_LIMIT = 50
+
+    def __init__(self, limit=DEFAULT_LIMIT, min_amount=None, start_year_month=None, end_year_month=None,
+                 parent_title=None, child_title=None, db_path='bills.db'):
+        super().__init__(db_path)
+        self.limit = int(limit) if limit is not None else None
+        self.min_amount = float(min_amount) if min_amount is not None else None
+        if self.limit is not None and self.limit <= 0:
+            raise ValueError(f"条数必须是正整数，收到 {limit}")
+        if self.limit is None and self.min_amount is None:
+            raise ValueError("至少需要指定条数或金额阈值之一")
+        self.start_year_month = start_year_month
+        self.end_year_month = end_year_month
+        self.parent_title = parent_title
+        self.child_title = child_title
+
+    def _years(self):
+        return self._years_between(self.start_year_month, self.end_year_month)
+
+    def _sql(self):
+        sql = '''
+            SELECT ym.year_month, pc.name, cc.name, i.amount, d.text
+            FROM Item i
+            JOIN Child c ON c.id = i.child_id
+            JOIN Parent p ON p.id = c.parent_id
+            JOIN YearMonth ym ON ym.id = p.year_month_id
+            JOIN Category pc ON pc.id = p.title_id
+            JOIN Category cc ON cc.id = c.title_id
+            JOIN Description d ON d.id = i.description_id
+        '''
+        conditions, params = [], []
+        if self.min_amount is not None:
+            conditions.append("i.amount >= ?")
+            params.append(self.min_amount)
+        if self.start_year_month:
+            conditions.append("ym.year_month >= ?")
+            params.append(self.start_year_month)
+        if self.end_year_month:
+            conditions.append("ym.year_month <= ?")
+            params.append(self.end_year_month)
+        if self.parent_title:
+            conditions.append(f"p.title_id = {self.CATEGORY_ID_SQL}")
+            params.append(self.parent_title)
+        if self.child_title:
+            conditions.append(f"c.title_id = {self.CATEGORY_ID_SQL}")
+            params.append(self.child_title)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        # 与 Item(amount) 索引的降序扫描顺序一致（索引隐含 rowid），因此不会产生排序步骤
+        sql += " ORDER BY i.amount DESC, i.id DESC"
+        if self.limit is not None:
+            sql += " LIMIT ?"
+            params.append(self.limit)
+        return sql, params
+
+    def _fetch_data(self):
+        sql, params = self._sql()
+        # 每个物理数据库的结果已按金额降序排列，归并后仍然有序；金额相同时较早的分片在前
+        rows, count, total = [], 0, 0.0
+        with self._connect_each() as connections:
+            streams = [conn.execute(sql, params) for conn in connections]
+            for row in heapq.merge(*streams, key=lambda row: -row[3]):
+                if self.limit is not None and count >= self.limit:
+                    break
+                count += 1
+                total += row[3]
+                if len(rows) < self.MAX_DISPLAY_ROWS:
+                    rows.append(row)
+        return {'rows': rows, 'count': count, 'total': total}
+
+    def _describe(self):
+        period = f"{self.start_year_month or '最早'}-{self.end_year_month or '最新'}"
+        scope = "".join(f"【{title}】" for title in (self.parent_title, self.child_title) if title)
+        if self.min_amount is None:
+            return f"{period} {scope}金额最高的 {self.limit} 条消费:"
+        top = f"前 {self.limit} 条" if self.limit is not None else ""
+        return f"{period} {scope}金额不低于 {self.min_amount:g} 元的{top}消费:"
+
+    def _format_data(self, data):
+        if not data or not data['count']:
+            return "无数据"
+        lines = ["-------------------------------", self._describe()]
+        for rank, (ym_str, p_title, c_title, amount, desc) in enumerate(data['rows'], 1):
+            lines.append(f"  {rank:>3}. {ym_str} 【{p_title}】{c_title}: "
+                         f"{int(amount) if float(amount).is_integer() else amount} {desc}")
+        if data['count'] > len(data['rows']):
+            lines.append(f"  ... 另有 {data['count'] - len(data['rows'])} 条结果未显示")
+        lines.append(f"共 {data['count']} 条, 合计: {data['total']:.2f}元")
+        lines.append("-------------------------------")
+        return "\n".join(lines)
+
+    def run(self):
+        data = self._fetch_data()
+        output = self._format_data(data)
+        print(output)
+
+
+class DescriptionRollupQuery(BaseQuery):
+    """
+    按规范化描述键（Description.key，导入时计算）汇总区间内的消费：每个键的合计、笔数、写法数和首末年月。
+    先按 description_id 分组，再在分组结果上按键合并，整个区间只扫描一遍；
+    指定 key 时只看这一个键，通过 Description(key) 索引找到它的各种写法。
+    """
+    DEFAULT_LIMIT = 50
+
+    def __init__(self, start_year_month=None, end_year_month=None, key=None, limit=DEFAULT_LIMIT, db_path='bills.db'):
+        super().__init__(db_path)
+        self.limit = int(limit) if limit is not None else None
+        if self.limit is not None and self.limit <= 0:
+            raise ValueError(f"条数必须是正整数，收到 {limit}")
+        self.start_year_month = start_year_month
+        self.end_year_month = end_year_month
+        self.key = key
+
+    def _years(self):
+        return self._years_between(self.start_year_month, self.end_year_month)
+
+    def _fetch_data(self):
+        sql = '''
+            SELECT i.description_id, SUM(i.amount) AS total, COUNT(*) AS items,
+                   MIN(ym.year_month) AS first_month, MAX(ym.year_month) AS last_month
+            FROM Item i
+            JOIN Child c ON c.id = i.child_id
+            JOIN Parent p ON p.id = c.parent_id
+            JOIN YearMonth ym ON ym.id = p.year_month_id
+        '''
+        conditions, params = [], []
+        if self.start_year_month:
+            conditions.append("ym.year_month >= ?")
+            params.append(self.start_year_month)
+        if self.end_year_month:
+            conditions.append("ym.year_month <= ?")
+            params.append(self.end_year_month)
+        if self.key:
+            conditions.append("i.description_id IN (SELECT id FROM Description WHERE key = ?)")
+            params.append(self.key)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " GROUP BY i.description_id"
+        sql = f'''
+            SELECT d.key, SUM(g.total) AS total, SUM(g.items), COUNT(*), MIN(g.first_month), MAX(g.last_month)
+            FROM ({sql}) g
+            JOIN Description d ON d.id = g.description_id
+            GROUP BY d.key
+            ORDER BY total DESC, d.key
+        '''
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return {
+            'rows': rows[:self.limit] if self.limit is not None else rows,
+            'keys': len(rows),
+            'total': sum(row[1] for row in rows),
+        }
+
+    def _format_data(self, data):
+        if not data or not data['rows']:
+            return "无数据"
+        period = f"{self.start_year_month or '最早'}-{self.end_year_month or '最新'}"
+        key_width = max(16, *(len(row[0]) * 2 for row in data['rows']))
+        lines = [
+            "-------------------------------",
+            f"{period} 按规范化描述汇总{f' [{self.key}]' if self.key else ''}:",
+            f"  {'':>4} {CategoryBreakdownQuery._pad('描述键', key_width)} {'合计':>10} {'笔数':>6} {'写法':>4}  首末年月",
+        ]
+        for rank, (key, total, items, variants, first_month, last_month) in enumerate(data['rows'], 1):
+            lines.append(f"  {rank:>3}. {CategoryBreakdownQuery._pad(key, key_width)} {total:>12.2f} "
+                         f"{items:>8} {variants:>6}  {first_month}-{last_month}")
+        if data['keys'] > len(data['rows']):
+            lines.append(f"  ... 另有 {data['keys'] - len(data['rows'])} 个描述键未显示")
+        lines.append(f"共 {data['keys']} 个描述键, 合计: {data['total']:.2f}元")
+        lines.append("-------------------------------")
+        return "\n".join(lines)
+
+    def run(self):
+        data = self._fetch_data()
+        output = self._format_data(data)
+        print(output)
+
+
+class DuplicateItemsQuery(BaseQuery):
+    """
+    疑似重复消费检测：年月、金额和规范化描述键都相同，但分属不同分类或写法不同的消费项目
+    （同一子分类下完全相同的项目在导入时已被合并）。
+    Item.fingerprint 是这三个值的哈希并建有索引：沿索引扫描一遍找出出现不止一次的指纹，
+    只取回这些项目的明细，再按原值分组核对，不需要两两比较。
+    不同年份的项目不可能重复，分片存储时逐个分片检测后合并。
+    """
+    SQL = '''
+        SELECT ym.year_month, i.amount, d.key, pc.name, cc.name, d.text
+        FROM Item i
+        JOIN Child c ON c.id = i.child_id
+        JOIN Parent p ON p.id = c.parent_id
+        JOIN YearMonth ym ON ym.id = p.year_month_id
+        JOIN Category pc ON pc.id = p.title_id
+        JOIN Category cc ON cc.id = c.title_id
+        JOIN Description d ON d.id = i.description_id
+        WHERE i.fingerprint IN (
+            SELECT fingerprint FROM Item WHERE fingerprint IS NOT NULL GROUP BY fingerprint HAVING COUNT(*) > 1
+        )
+    '''
+
+    def __init__(self, start_year_month=None, end_year_month=None, db_path='bills.db'):
+        super().__init__(db_path)
+        self.start_year_month = start_year_month
+        self.end_year_month = end_year_month
+
+    def _years(self):
+        return self._years_between(self.start_year_month, self.end_year_month)
+
+    def _fetch_data(self):
+        sql, params = self.SQL, []
+        if self.start_year_month:
+            sql += " AND ym.year_month >= ?"
+            params.append(self.start_year_month)
+        if self.end_year_month:
+            sql += " AND ym.year_month <= ?"
+            params.append(self.end_year_month)
+        sql += " ORDER BY ym.year_month, i.fingerprint, i.id"
+        rows = []
+        with self._connect_each() as connections:
+            for conn in connections:
+                rows.extend(conn.execute(sql, params))
+        return group_duplicates(rows)
+
+    def _format_data(self, groups):
+        if not groups:
+            return "未发现疑似重复的消费"
+        period = f"{self.start_year_month or '最早'}-{self.end_year_month or '最新'}"
+        lines = ["-------------------------------", f"{period} 疑似重复的消费 (年月、金额和规范化描述相同):"]
+        extra = 0.0
+        for group in groups:
+            year_month, amount, key = group[0][:3]
+            same_child = len({(p_title, c_title) for _, _, _, p_title, c_title, _ in group}) == 1
+            lines.append(f"  {year_month} {int(amount) if float(amount).is_integer() else amount} [{key}] "
+                         f"{'同一子分类, 写法不同' if same_child else '不同分类'}:")
+            for _, _, _, p_title, c_title, desc in group:
+                lines.append(f"      【{p_title}】{c_title}: {desc}")
+            extra += amount * (len(group) - 1)
+        lines.append(f"共 {len(groups)} 组, {sum(len(group) for group in groups)} 个项目, "
+                     f"若均为重复则多计 {extra:.2f}元")
+        lines.append("-------------------------------")
+        return "\n".join(lines)
+
+    def run(self):
+        data = self._fetch_data()
+        output = self._format_data(data)
+        print(output)
+
+
+# ==============================================================================
+# 2. 公共接口函数
+# ==============================================================================
+
+def display_yearly_summary(year, db_path='bills.db'):
+    """查询并显示年度消费总览。"""
+    query = YearlySummaryQuery(year, db_path)
+    query.run()
+
+def display_monthly_details(year, month, db_path='bills.db'):
+    """查询并显示月度消费详情。"""
+    query = MonthlyDetailsQuery(year, month, db_path)
+    query.run()
+
+def export_monthly_bill_as_text(year, month, db_path='bills.db'):
+    """以纯文本格式导出月度账单。"""
+    query = MonthlyBillExportQuery(year, month, db_path)
+    query.run()
+
+def display_yearly_parent_category_summary(year, parent_title, db_path='bills.db'):
+    """查询并显示指定父分类的年度总消费。"""
+    query = YearlyCategoryQuery(year, parent_title, db_path)
+    query.run()
+
+def display_category_breakdown(start_year, end_year=None, parent_title=None, db_path='bills.db'):
+    """查询并显示区间内所有父/子分类的逐月透视表，可按父分类过滤。"""
+    query = CategoryBreakdownQuery(start_year, end_year, parent_title, db_path)
+    query.run()
+
+def display_item_search(keywords, start_year_month=None, end_year_month=None, db_path='bills.db'):
+    """按描述关键词检索消费项目，并显示所在年月、分类及合计。"""
+    query = ItemSearchQuery(keywords, start_year_month, end_year_month, db_path)
+    query.run()
+
+def display_trend(by_parent=False, parent_title=None, start_year_month=None, end_year_month=None, db_path='bills.db'):
+    """查询并显示逐月的环比、同比、滚动均值和年累计，可按父分类分别统计或只看某个父分类。"""
+    query = TrendQuery(by_parent, parent_title, start_year_month, end_year_month, db_path)
+    query.run()
+
+def display_top_items(limit=TopItemsQuery.DEFAULT_LIMIT, min_amount=None, start_year_month=None, end_year_month=None,
+                      parent_title=None, child_title=None, db_path='bills.db'):
+    """查询并显示区间内金额最高的前 N 条消费，或金额不低于阈值的消费，可限定父/子分类。"""
+    query = TopItemsQuery(limit, min_amount, start_year_month, end_year_month, parent_title, child_title, db_path)
+    query.run()
+
+def display_description_rollup(start_year_month=None, end_year_month=None, key=None,
+                               limit=DescriptionRollupQuery.DEFAULT_LIMIT, db_path='bills.db'):
+    """按规范化描述键汇总区间内的消费并显示，可只看某一个键。"""
+    query = DescriptionRollupQuery(start_year_month, end_year_month, key, limit, db_path)
+    query.run()
+
+def display_duplicate_items(start_year_month=None, end_year_month=None, db_path='bills.db'):
+    """检测并显示区间内年月、金额和规范化描述都相同的疑似重复消费。"""
+    query = DuplicateItemsQuery(start_year_month, end_year_month, db_path)
+    query.run()
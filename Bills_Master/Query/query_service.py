@@ -0,0 +1,354 @@
+# query_service.py
+"""
+常驻的本地查询服务。
+看板等客户端需要全天轮询年度、月度统计；每次都启动 Python 进程、连接 SQLite 并从零预热的开销远大于查询本身。
+本服务常驻运行，每个工作线程保持一个打开的连接，并缓存查询结果，通过本机 HTTP 或 Unix 套接字以 JSON 返回
+与 query_db 相同的各类报表。每次请求前检查 PRAGMA data_version（分片模式下还检查分片列表），
+发现有新的导入时清空结果缓存（分片列表变化时还会重建连接），因此无需重启服务即可看到新数据。
+
+启动（在 Bills_Master 目录下）:
+    python -m Query.query_service --port 8765
+    python -m Query.query_service --unix /tmp/bills.sock
+
+请求示例:
+    GET /yearly_summary?year=2024
+    GET /category_breakdown?start_year=2022&end_year=2024&parent=RENT房租水电
+    GET /trend?by=parent&start=202301&end=202412
+    GET /top_items?limit=50&start=202401&end=202412&parent=RENT房租水电
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from common import RED, GREEN, CYAN, RESET
+from Inserter.db_config import load_database_config
+from profiler import enable_profiling, profile_stage, profiling_requested
+from .connection import database_from_config, data_version, is_sharded, open_connection
+from .query_db import (
+    YearlySummaryQuery, MonthlyDetailsQuery, MonthlyBillExportQuery,
+    CategoryBreakdownQuery, YearlyCategoryQuery, ItemSearchQuery, TrendQuery, TopItemsQuery
+)
+
+
+# ==============================================================================
+# 报表：把查询类的 _fetch_data 结果转换为可序列化为 JSON 的结构
+# ==============================================================================
+
+def _yearly_summary(params, conn, database):
+    query = YearlySummaryQuery(_required(params, 'year'), database)
+    query.connection = conn
+    rows = query._fetch_data()
+    total = sum(row[1] for row in rows)
+    return {
+        'year': query.year, 'total': total,
+        'average': total / len(rows) if rows else 0.0,
+        'months': [{'year_month': ym_str, 'total': month_total} for ym_str, month_total in rows],
+    }
+
+
+def _monthly_details(params, conn, database):
+    query = MonthlyDetailsQuery(_required(params, 'year'), _required(params, 'month'), database)
+    query.connection = conn
+    total, structured = query._fetch_data()
+    return {'year_month': query.year_month, 'total': total, 'parents': structured or {}}
+
+
+def _monthly_export(params, conn, database):
+    query = MonthlyBillExportQuery(_required(params, 'year'), _required(params, 'month'), database)
+    query.connection = conn
+    return {'year_month': query.year_month, 'text': query._format_data(query._fetch_data())}
+
+
+def _category_breakdown(params, conn, database):
+    query = CategoryBreakdownQuery(
+        _required(params, 'start_year'), params.get('end_year'), params.get('parent'), database
+    )
+    query.connection = conn
+    return query._fetch_data()
+
+
+def _yearly_category(params, conn, database):
+    query = YearlyCategoryQuery(_required(params, 'year'), _required(params, 'parent'), database)
+    query.connection = conn
+    parent_row = query._fetch_data().get(str(query.year), {}).get(query.parent_title)
+    return {
+        'year': str(query.year), 'parent': query.parent_title,
+        'total': sum(parent_row['months']) if parent_row else 0.0,
+        'months': parent_row['months'] if parent_row else [0.0] * 12,
+    }
+
+
+def _item_search(params, conn, database):
+    query = ItemSearchQuery(_required(params, 'keywords'), params.get('start'), params.get('end'), database)
+    if not is_sharded(database):
+        # 分片模式下 ItemSearch 不在跨分片视图中，由查询类逐个分片检索
+        query.connection = conn
+    data = query._fetch_data()
+    return data or {'rows': [], 'count': 0, 'total': 0.0, 'yearly_totals': {}}
+
+
+def _trend(params, conn, database):
+    query = TrendQuery(
+        params.get('by') == 'parent', params.get('parent'), params.get('start'), params.get('end'), database
+    )
+    query.connection = conn
+    return query._fetch_data()
+
+
+def _top_items(params, conn, database):
+    # 只给出 min_amount 时返回阈值以上的全部消费，两者都缺省时取前 DEFAULT_LIMIT 条
+    default_limit = None if 'min_amount' in params else TopItemsQuery.DEFAULT_LIMIT
+    try:
+        query = TopItemsQuery(
+            params.get('limit', default_limit), params.get('min_amount'), params.get('start'), params.get('end'),
+            params.get('parent'), params.get('child'), database
+        )
+    except (TypeError, ValueError) as e:
+        raise QueryParameterError(f"参数格式错误: {e}")
+    if not is_sharded(database):
+        # 分片模式下由查询类逐个分片按金额索引取数后归并
+        query.connection = conn
+    return query._fetch_data()
+
+
+REPORTS = {
+    'yearly_summary': _yearly_summary,
+    'monthly_details': _monthly_details,
+    'monthly_export': _monthly_export,
+    'category_breakdown': _category_breakdown,
+    'yearly_category': _yearly_category,
+    'item_search': _item_search,
+    'trend': _trend,
+    'top_items': _top_items,
+}
+
+
+class QueryParameterError(ValueError):
+    """请求缺少必需参数或参数格式错误。"""
+
+
+def _required(params, name):
+    value = params.get(name)
+    if not value:
+        raise QueryParameterError(f"缺少参数 '{name}'")
+    return value
+
+
+# ==============================================================================
+# 服务核心：线程内连接 + 结果缓存 + 新数据检测
+# ==============================================================================
+
+class QueryService:
+    """
+    线程安全的查询执行器。
+    每个工作线程持有自己的查询连接；另有一个加锁共享的监视连接，每次请求前读取 data_version
+    （分片模式下还有分片列表）判断是否有新的导入。结果缓存按 (报表, 参数) 保存，检测到新数据时整体清空。
+    """
+    MAX_CACHED_RESULTS = 256
+
+    def __init__(self, database):
+        self.database = database
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._generation = 0
+        self._shards = None
+        self._monitor_conn = None
+        self._monitor_version = None
+
+    def _current_shards(self):
+        return tuple(self.database.years()) if is_sharded(self.database) else None
+
+    def _current_generation(self, shards):
+        """检测是否有新的导入；有变化时递增代号并清空结果缓存。"""
+        with self._lock:
+            if self._monitor_conn is None or shards != self._shards:
+                if self._monitor_conn is not None:
+                    self._monitor_conn.close()
+                # 监视连接只在持有锁时使用，因此允许跨线程
+                self._monitor_conn = open_connection(self.database, check_same_thread=False)
+                self._shards = shards
+                self._monitor_version = None
+            version = data_version(self._monitor_conn)
+            if version != self._monitor_version:
+                if self._monitor_version is not None or self._results:
+                    self._generation += 1
+                    self._results.clear()
+                self._monitor_version = version
+            return self._generation
+
+    def _thread_connection(self, shards, generation):
+        """
+        返回当前线程的查询连接；分片列表变化后重新打开，以 ATTACH 新的分片。
+        分片模式下检测到新的导入时重建连接上的分类/描述 id 映射，使新导入的条目也按名称合并。
+        """
+        local = self._local
+        if getattr(local, 'conn', None) is None or local.shards != shards:
+            if getattr(local, 'conn', None) is not None:
+                local.conn.close()
+            local.conn = open_connection(self.database)
+            local.shards = shards
+        elif shards is not None and local.generation != generation:
+            self.database.refresh_id_maps(local.conn)
+        local.generation = generation
+        return local.conn
+
+    def execute(self, report, params):
+        """执行一个报表并返回 (是否命中缓存, 结果)。"""
+        handler = REPORTS.get(report)
+        if handler is None:
+            raise KeyError(report)
+        shards = self._current_shards()
+        generation = self._current_generation(shards)
+        key = (report, tuple(sorted(params.items())))
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return True, self._results[key]
+
+        with profile_stage('query'):
+            result = handler(params, self._thread_connection(shards, generation), self.database)
+
+        with self._lock:
+            # 查询期间检测到了新数据，结果可能已过期，不写入缓存
+            if generation == self._generation:
+                self._results[key] = result
+                if len(self._results) > self.MAX_CACHED_RESULTS:
+                    self._results.popitem(last=False)
+        return False, result
+
+
+# ==============================================================================
+# 传输层：HTTP（本机 TCP 或 Unix 套接字），请求由固定大小的线程池处理
+# ==============================================================================
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """GET /<报表名>?参数=值 → JSON。"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        report = url.path.strip('/')
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if report == 'health':
+            self._send_json(200, {'status': 'ok', 'reports': sorted(REPORTS)})
+            return
+        try:
+            cached, data = self.server.service.execute(report, params)
+            self._send_json(200, {'report': report, 'params': params, 'cached': cached, 'data': data})
+        except KeyError:
+            self._send_json(404, {'error': f"未知的报表 '{report}'", 'reports': sorted(REPORTS)})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            self._send_json(500, {'error': f"查询失败: {e}"})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix 套接字的 client_address 是空字符串
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _ThreadPoolMixIn:
+    """用固定大小的线程池代替“每个请求一个线程”处理连接。"""
+
+    def __init__(self, server_address, handler_class, service, max_workers=4, verbose=False):
+        self.service = service
+        self.verbose = verbose
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query')
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_in_pool, request, client_address)
+
+    def _process_request_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class PooledHTTPServer(_ThreadPoolMixIn, HTTPServer):
+    pass
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class PooledUnixHTTPServer(_ThreadPoolMixIn, socketserver.UnixStreamServer):
+        pass
+
+
+def create_server(database, host='127.0.0.1', port=8765, unix_socket=None, max_workers=4, verbose=False):
+    """创建查询服务（尚未开始监听循环）；unix_socket 不为空时监听 Unix 套接字，否则监听本机 TCP 端口。"""
+    service = QueryService(database)
+    if unix_socket:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError("当前平台不支持 Unix 套接字，请改用 --port")
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return PooledUnixHTTPServer(unix_socket, QueryRequestHandler, service, max_workers, verbose)
+    return PooledHTTPServer((host, port), QueryRequestHandler, service, max_workers, verbose)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="常驻的本地账单查询服务，以 JSON 返回报表。")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', dest='unix_socket', help="监听的 Unix 套接字路径，指定后忽略 --host/--port")
+    parser.add_argument('--workers', type=int, default=4, help="处理请求的线程数")
+    parser.add_argument('--db', help="数据库文件，缺省时按 config/database_config.json 选择")
+    parser.add_argument('--verbose', action='store_true', help="打印每个请求的访问日志")
+    parser.add_argument('--profile', action='store_true', help="按阶段采集 cProfile/tracemalloc 数据，退出时写入 profiles/")
+    args = parser.parse_args(argv)
+    if profiling_requested(args.profile):
+        enable_profiling()
+
+    database = args.db or database_from_config(load_database_config())
+    if isinstance(database, str) and not os.path.exists(database):
+        print(f"{RED}错误: 数据库 '{database}' 不存在。{RESET}", file=sys.stderr)
+        return 1
+    try:
+        server = create_server(database, args.host, args.port, args.unix_socket, args.workers, args.verbose)
+    except OSError as e:
+        print(f"{RED}查询服务启动失败: {e}{RESET}", file=sys.stderr)
+        return 1
+
+    address = args.unix_socket or f"http://{args.host}:{args.port}"
+    print(f"{GREEN}查询服务已启动: {address} (报表: {', '.join(sorted(REPORTS))}){RESET}")
+    print(f"{CYAN}按 Ctrl+C 停止。{RESET}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,7 @@
-# Reprocessor/__init__.py
-
-"""
-This file makes the Reprocessor directory a Python package.
-We also make the BillProcessor class directly available when importing the package.
-"""
+# Reprocessor/__init__.py
+
+"""
+This file makes the Reprocessor directory a Python package.
+We also make the BillProcessor class directly available when importing the package.
+"""
 from .BillProcessor import BillProcessor
\ No newline at end of file
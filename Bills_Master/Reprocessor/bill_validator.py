@@ -1,176 +1,266 @@
-import re
-import time
-import json
-from collections import defaultdict
-
-# --- 辅助函数 ---
-def _load_config(config_path):
-    """加载并解析JSON配置文件。"""
-    with open(config_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def _transform_config_for_validation(config_data):
-    """将新的结构化配置转换为验证逻辑所需的简单字典格式。"""
-    validation_map = {}
-    if 'categories' not in config_data or not isinstance(config_data['categories'], list):
-        return {}
-    for category in config_data.get('categories', []):
-        if isinstance(category, dict) and 'parent_item' in category and 'sub_items' in category:
-            parent_name = category['parent_item']
-            sub_items_list = category['sub_items']
-            validation_map[parent_name] = sub_items_list
-    return validation_map
-
-# --- NEW: Helper function to initialize the state object ---
-def _initialize_validation_state():
-    """Creates and returns the initial state dictionary for validation."""
-    return {
-        'expecting': 'parent', 'current_parent': None, 'current_sub': None,
-        'parents': set(), 'subs': defaultdict(set), 'content_counts': defaultdict(int),
-        'errors': [], 'warnings': [], 'config': {}
-    }
-
-# --- NEW: Helper function to format the final return value ---
-def _format_validation_result(is_valid, processed_lines, errors, warnings, time_taken):
-    """Formats the validation results into a standard dictionary."""
-    unique_errors = sorted(list(set(errors)), key=lambda x: x[0])
-    unique_warnings = sorted(list(set(warnings)), key=lambda x: x[0])
-    return (is_valid, {
-        'processed_lines': processed_lines, 'errors': unique_errors,
-        'warnings': unique_warnings, 'time': time_taken
-    })
-
-
-# --- 核心验证逻辑函数 (保持不变) ---
-def _read_and_preprocess(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return [(lineno, line.strip()) for lineno, line in enumerate(f, 1) if line.strip()]
-
-def _validate_date_and_remark(lines):
-    errors = []
-    if len(lines) < 2:
-        errors.append((0, "文件必须包含至少DATE和REMARK两行"))
-        return errors
-    date_lineno, date_line = lines[0]
-    if not re.fullmatch(r'^DATE:\d{6}$', date_line):
-        errors.append((date_lineno, "DATE格式错误,必须为DATE:后接6位数字"))
-    remark_lineno, remark_line = lines[1]
-    if not re.fullmatch(r'^REMARK:.*$', remark_line):
-        errors.append((remark_lineno, "REMARK格式错误,必须为REMARK:开头"))
-    return errors
-
-def _handle_parent_state(line, lineno, state):
-    if line in state['config']:
-        state['current_parent'] = (lineno, line)
-        state['parents'].add(state['current_parent'])
-        state['expecting'] = 'sub'
-        return []
-    elif re.fullmatch(r'^[A-Z]+[\u4e00-\u9fff]+[\d]*$', line):
-        return [(lineno, f"父标题 '{line}' 不在配置文件中")]
-    else:
-        return [(lineno, "期望一个在配置文件中定义的父级标题, 但找到不匹配的内容")]
-
-def _handle_sub_state(line, lineno, state):
-    errors = []
-    current_parent = state['current_parent']
-    if not current_parent: return [(lineno, "未找到父级标题")]
-    parent_lineno, parent_name = current_parent
-    valid_subs = state['config'].get(parent_name, [])
-    if line in valid_subs:
-        state['current_sub'] = (lineno, line)
-        state['subs'][current_parent].add(state['current_sub'])
-        state['expecting'] = 'content'
-    elif line in state['config']:
-        errors.append((parent_lineno, f"父级标题 '{parent_name}' 缺少子标题"))
-        state['current_parent'] = (lineno, line)
-        state['parents'].add(state['current_parent'])
-        state['expecting'] = 'sub'
-    else:
-        errors.append((lineno, f"子标题 '{line}' 对于父级标题 '{parent_name}' 无效, 或该行不是一个有效的父标题"))
-    return errors
-
-def _handle_content_state(line, lineno, state):
-    errors = []
-    current_sub, current_parent = state['current_sub'], state['current_parent']
-    is_content = re.fullmatch(r'^\d+(?:\.\d+)?(?:[^\d\s][\d\u4e00-\u9fffa-zA-Z_-]*)+$', line)
-    is_new_parent = line in state['config']
-    is_new_sub = current_parent and line in state['config'].get(current_parent[1], [])
-    if is_content:
-        if not current_sub:
-            errors.append((lineno, "找到内容行，但当前没有活动的子标题"))
-        else:
-            state['content_counts'][current_sub] += 1
-    elif is_new_parent:
-        if current_sub and state['content_counts'][current_sub] == 0:
-            state['warnings'].append((current_sub[0], f"子标题 '{current_sub[1]}' 缺少内容行"))
-        state['current_parent'] = (lineno, line)
-        state['parents'].add(state['current_parent'])
-        state['current_sub'] = None
-        state['expecting'] = 'sub'
-    elif is_new_sub:
-        if current_sub and state['content_counts'][current_sub] == 0:
-            state['warnings'].append((current_sub[0], f"子标题 '{current_sub[1]}' 缺少内容行"))
-        state['current_sub'] = (lineno, line)
-        state['subs'][current_parent].add(state['current_sub'])
-        state['expecting'] = 'content'
-    else:
-        errors.append((lineno, "期望内容行、配置文件中有效的子标题或父标题, 但找到其他内容"))
-    return errors
-
-def _process_lines(lines, state):
-    for i in range(2, len(lines)):
-        lineno, line = lines[i]
-        handler = { 'parent': _handle_parent_state, 'sub': _handle_sub_state, 'content': _handle_content_state }[state['expecting']]
-        state['errors'].extend(handler(line, lineno, state))
-
-def _post_validation_checks(state):
-    errors, warnings = [], []
-    if state['expecting'] == 'content' and state['current_sub'] and state['content_counts'][state['current_sub']] == 0:
-        warnings.append((state['current_sub'][0], f"子标题 '{state['current_sub'][1]}' 缺少内容行"))
-    for parent in state['parents']:
-        subs_of_parent = state['subs'].get(parent)
-        if not subs_of_parent:
-            errors.append((parent[0], f"父级标题 '{parent[1]}' 缺少子标题"))
-        elif all(state['content_counts'][sub] == 0 for sub in subs_of_parent):
-            warnings.append((parent[0], f"父标题 '{parent[1]}' 的所有子标题均缺少内容行"))
-    return errors, warnings
-
-
-# --- REFACTORED: The main function is now a high-level coordinator ---
-def validate_file(file_path, config_path):
-    """验证单个账单文件，返回 (is_valid: bool, result: dict)"""
-    start_time = time.perf_counter()
-    try:
-        # 1. Initialize state and load config
-        state = _initialize_validation_state()
-        raw_config = _load_config(config_path)
-        state['config'] = _transform_config_for_validation(raw_config)
-        
-        if not state['config']:
-            err_msg = f"错误: 配置文件 '{config_path}' 格式不正确或内容为空。"
-            return _format_validation_result(False, 0, [(0, err_msg)], [], time.perf_counter() - start_time)
-        
-        # 2. Read and process file lines
-        lines = _read_and_preprocess(file_path)
-        
-        # 3. Run validation checks
-        state['errors'].extend(_validate_date_and_remark(lines))
-        if len(lines) >= 2:
-            _process_lines(lines, state)
-        
-        post_errors, post_warnings = _post_validation_checks(state)
-        state['errors'].extend(post_errors)
-        state['warnings'].extend(post_warnings)
-        
-        # 4. Format and return the result
-        is_valid = not bool(state['errors'])
-        return _format_validation_result(
-            is_valid, len(lines), state['errors'], state['warnings'], time.perf_counter() - start_time
-        )
-
-    except FileNotFoundError:
-        err_msg = f"错误: 文件 '{file_path}' 或配置文件 '{config_path}' 未找到。"
-        return _format_validation_result(False, 0, [(0, err_msg)], [], time.perf_counter() - start_time)
-    except Exception as e:
-        err_msg = f"处理文件时发生意外错误: {e}"
-        return _format_validation_result(False, 0, [(0, err_msg)], [], time.perf_counter() - start_time)
\ No newline at end of file
+import re
+import sys
+import time
+import json
+
+from TextParser.parse_cache import (
+    iter_file_tokens, tokenize_lines, TOKEN_DATE, TOKEN_PARENT_NUMBERED, TOKEN_CONTENT
+)
+
+# 结果中最多保留的错误和警告条数；超出的只计数，内存占用不随错误行数增长
+MAX_REPORTED_FINDINGS = 100
+
+# --- 辅助函数 ---
+def _load_config(config_path):
+    """加载并解析JSON配置文件。"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _transform_config_for_validation(config_data):
+    """将新的结构化配置转换为验证逻辑所需的简单字典格式。"""
+    validation_map = {}
+    if 'categories' not in config_data or not isinstance(config_data['categories'], list):
+        return {}
+    for category in config_data.get('categories', []):
+        if isinstance(category, dict) and 'parent_item' in category and 'sub_items' in category:
+            parent_name = category['parent_item']
+            sub_items_list = category['sub_items']
+            validation_map[parent_name] = sub_items_list
+    return validation_map
+
+# --- NEW: Helper function to initialize the state object ---
+def _initialize_validation_state(max_errors=None):
+    """
+    Creates and returns the initial state dictionary for validation.
+    Only the currently open parent/sub title is tracked and errors/warnings are counted
+    with a bounded sample kept, so memory does not grow with the file size.
+    """
+    return {
+        'expecting': 'date', 'current_parent': None, 'current_sub': None,
+        'parent_sub_count': 0, 'parent_has_content': False, 'sub_content_count': 0,
+        'errors': [], 'warnings': [], 'counts': {'errors': 0, 'warnings': 0}, 'config': {},
+        'max_errors': max_errors, 'stopped_early': False
+    }
+
+def _record(state, kind, findings):
+    """Counts findings of the given kind ('errors' or 'warnings') and keeps the first MAX_REPORTED_FINDINGS."""
+    if not findings:
+        return
+    state['counts'][kind] += len(findings)
+    sample = state[kind]
+    sample.extend(findings[:MAX_REPORTED_FINDINGS - len(sample)])
+
+# --- NEW: Helper function to format the final return value ---
+def _format_validation_result(is_valid, processed_lines, errors, warnings, time_taken, stopped_early=False,
+                              error_count=None, warning_count=None):
+    """
+    Formats the validation results into a standard dictionary. errors/warnings are the kept
+    samples; error_count/warning_count are the totals (default: the sample sizes).
+    """
+    # 流式验证不会重复产生同一条错误，这里只需按行号排序
+    return (is_valid, {
+        'processed_lines': processed_lines, 'errors': sorted(errors, key=lambda x: x[0]),
+        'warnings': sorted(warnings, key=lambda x: x[0]), 'time': time_taken,
+        'stopped_early': stopped_early,
+        'error_count': len(errors) if error_count is None else error_count,
+        'warning_count': len(warnings) if warning_count is None else warning_count,
+    })
+
+
+# --- 核心验证逻辑函数 ---
+# 每个处理函数都接收 parse_cache 词流中的一项：行内容、行号和分词时识别出的格式标志位
+def _handle_date_state(line, lineno, flags, state):
+    state['expecting'] = 'remark'
+    if not re.fullmatch(r'^DATE:\d{6}$', line):
+        return [(lineno, "DATE格式错误,必须为DATE:后接6位数字")]
+    return []
+
+def _handle_remark_state(line, lineno, flags, state):
+    state['expecting'] = 'parent'
+    if not re.fullmatch(r'^REMARK:.*$', line):
+        return [(lineno, "REMARK格式错误,必须为REMARK:开头")]
+    return []
+
+def _close_sub(state):
+    """结束当前子标题：没有内容行时给出警告。"""
+    warnings = []
+    current_sub = state['current_sub']
+    if current_sub and state['sub_content_count'] == 0:
+        warnings.append((current_sub[0], f"子标题 '{current_sub[1]}' 缺少内容行"))
+    state['current_sub'] = None
+    return warnings
+
+def _close_parent(state):
+    """结束当前父标题：没有子标题是错误，所有子标题都没有内容行是警告。返回 (errors, warnings)。"""
+    current_parent = state['current_parent']
+    if not current_parent:
+        return [], []
+    if state['parent_sub_count'] == 0:
+        return [(current_parent[0], f"父级标题 '{current_parent[1]}' 缺少子标题")], []
+    if not state['parent_has_content']:
+        return [], [(current_parent[0], f"父标题 '{current_parent[1]}' 的所有子标题均缺少内容行")]
+    return [], []
+
+def _open_parent(line, lineno, state):
+    state['current_parent'] = (lineno, line)
+    state['parent_sub_count'] = 0
+    state['parent_has_content'] = False
+    state['current_sub'] = None
+    state['expecting'] = 'sub'
+
+def _open_sub(line, lineno, state):
+    state['current_sub'] = (lineno, line)
+    state['parent_sub_count'] += 1
+    state['sub_content_count'] = 0
+    state['expecting'] = 'content'
+
+def _close_month(state):
+    """结束当前月份（遇到下一个 DATE 或输入结束），补做子标题和父标题的收尾检查。"""
+    _record(state, 'warnings', _close_sub(state))
+    errors, warnings = _close_parent(state)
+    _record(state, 'errors', errors)
+    _record(state, 'warnings', warnings)
+    state['current_parent'] = None
+
+def _handle_parent_state(line, lineno, flags, state):
+    if line in state['config']:
+        _open_parent(line, lineno, state)
+        return []
+    elif flags & TOKEN_PARENT_NUMBERED:
+        return [(lineno, f"父标题 '{line}' 不在配置文件中")]
+    else:
+        return [(lineno, "期望一个在配置文件中定义的父级标题, 但找到不匹配的内容")]
+
+def _handle_sub_state(line, lineno, flags, state):
+    errors = []
+    current_parent = state['current_parent']
+    if not current_parent: return [(lineno, "未找到父级标题")]
+    parent_name = current_parent[1]
+    valid_subs = state['config'].get(parent_name, [])
+    if line in valid_subs:
+        _open_sub(line, lineno, state)
+    elif line in state['config']:
+        errors.extend(_close_parent(state)[0])
+        _open_parent(line, lineno, state)
+    else:
+        errors.append((lineno, f"子标题 '{line}' 对于父级标题 '{parent_name}' 无效, 或该行不是一个有效的父标题"))
+    return errors
+
+def _handle_content_state(line, lineno, flags, state):
+    errors = []
+    current_sub, current_parent = state['current_sub'], state['current_parent']
+    is_content = flags & TOKEN_CONTENT
+    is_new_parent = line in state['config']
+    is_new_sub = current_parent and line in state['config'].get(current_parent[1], [])
+    if is_content:
+        if not current_sub:
+            errors.append((lineno, "找到内容行，但当前没有活动的子标题"))
+        else:
+            state['sub_content_count'] += 1
+            state['parent_has_content'] = True
+    elif is_new_parent:
+        _record(state, 'warnings', _close_sub(state))
+        parent_errors, parent_warnings = _close_parent(state)
+        errors.extend(parent_errors)
+        _record(state, 'warnings', parent_warnings)
+        _open_parent(line, lineno, state)
+    elif is_new_sub:
+        _record(state, 'warnings', _close_sub(state))
+        _open_sub(line, lineno, state)
+    else:
+        errors.append((lineno, "期望内容行、配置文件中有效的子标题或父标题, 但找到其他内容"))
+    return errors
+
+STATE_HANDLERS = {
+    'date': _handle_date_state, 'remark': _handle_remark_state,
+    'parent': _handle_parent_state, 'sub': _handle_sub_state, 'content': _handle_content_state
+}
+
+def _process_tokens(tokens, state):
+    """
+    用词流驱动状态机，返回处理的非空行数。
+    拼接在一起的多个月份会在每个 DATE 行处结束上一个月并重新开始检查；
+    错误数达到 max_errors 时立即停止读取。
+    """
+    processed_lines = 0
+    max_errors = state['max_errors']
+    for lineno, flags, line in tokens:
+        processed_lines += 1
+        if flags & TOKEN_DATE and state['expecting'] in ('parent', 'sub', 'content'):
+            _close_month(state)
+            state['expecting'] = 'date'
+        _record(state, 'errors', STATE_HANDLERS[state['expecting']](line, lineno, flags, state))
+        if max_errors and state['counts']['errors'] >= max_errors:
+            state['stopped_early'] = True
+            return processed_lines
+    _close_month(state)
+    return processed_lines
+
+
+# --- REFACTORED: The main function is now a high-level coordinator ---
+def validate_lines(lines, config_path, max_errors=None):
+    """
+    以流式方式验证任意行迭代器（文件对象、sys.stdin、解析流水线等），返回 (is_valid: bool, result: dict)。
+    内存占用与输入大小无关：result 中的 errors/warnings 最多各保留 MAX_REPORTED_FINDINGS 条，
+    总数见 error_count/warning_count。max_errors 为 None 时使用配置文件中的 max_errors（0 或缺省表示不限制），
+    错误数达到该值后停止读取。
+    """
+    return validate_tokens(tokenize_lines(lines), config_path, max_errors)
+
+
+def validate_tokens(tokens, config_path, max_errors=None):
+    """验证 parse_cache 词流，参数和返回值与 validate_lines 相同。"""
+    start_time = time.perf_counter()
+    try:
+        # 1. Load config and initialize state
+        raw_config = _load_config(config_path)
+        if max_errors is None:
+            max_errors = raw_config.get('max_errors') or None
+        state = _initialize_validation_state(max_errors)
+        state['config'] = _transform_config_for_validation(raw_config)
+        
+        if not state['config']:
+            err_msg = f"错误: 配置文件 '{config_path}' 格式不正确或内容为空。"
+            return _format_validation_result(False, 0, [(0, err_msg)], [], time.perf_counter() - start_time)
+        
+        # 2. Stream tokens through the state machine
+        processed_lines = _process_tokens(tokens, state)
+        counts = state['counts']
+        if processed_lines < 2 and not state['stopped_early']:
+            state['errors'] = [(0, "文件必须包含至少DATE和REMARK两行")]
+            counts['errors'] = 1
+        elif state['stopped_early']:
+            del state['errors'][max_errors:]
+            counts['errors'] = min(counts['errors'], max_errors)
+        
+        # 3. Format and return the result
+        is_valid = counts['errors'] == 0
+        return _format_validation_result(
+            is_valid, processed_lines, state['errors'], state['warnings'],
+            time.perf_counter() - start_time, state['stopped_early'], counts['errors'], counts['warnings']
+        )
+
+    except FileNotFoundError:
+        err_msg = f"错误: 配置文件 '{config_path}' 未找到。"
+        return _format_validation_result(False, 0, [(0, err_msg)], [], time.perf_counter() - start_time)
+    except Exception as e:
+        err_msg = f"处理文件时发生意外错误: {e}"
+        return _format_validation_result(False, 0, [(0, err_msg)], [], time.perf_counter() - start_time)
+
+
+def validate_file(file_path, config_path, max_errors=None):
+    """
+    验证单个账单文件，返回 (is_valid: bool, result: dict)。file_path 为 '-' 时从标准输入读取。
+    文件的词流通过 parse_cache 按内容哈希缓存，文件未变化时不再重新分词。
+    """
+    if file_path == '-':
+        return validate_lines(sys.stdin, config_path, max_errors)
+    start_time = time.perf_counter()
+    try:
+        return validate_tokens(iter_file_tokens(file_path), config_path, max_errors)
+    except FileNotFoundError:
+        err_msg = f"错误: 文件 '{file_path}' 或配置文件 '{config_path}' 未找到。"
+        return _format_validation_result(False, 0, [(0, err_msg)], [], time.perf_counter() - start_time)
+    except Exception as e:
+        err_msg = f"处理文件时发生意外错误: {e}"
+        return _format_validation_result(False, 0, [(0, err_msg)], [], time.perf_counter() - start_time)
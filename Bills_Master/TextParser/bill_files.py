@@ -0,0 +1,56 @@
+# bill_files.py
+"""
+账单文件的发现与打开。
+账单文件可以是普通的 .txt，也可以是 gzip (.txt.gz) 或 xz (.txt.xz) 压缩的归档，
+验证、修改、解析和导入都通过 open_bill_file 以流的方式读取，不需要先解压到磁盘。
+压缩文件不能 mmap，也不能按字节偏移直接定位：偏移索引对压缩文件分块流式解压扫描，
+并行解析对压缩文件自动退回顺序读取。
+"""
+import gzip
+import lzma
+import os
+
+BILL_FILE_SUFFIXES = ('.txt', '.txt.gz', '.txt.xz')
+# 压缩扩展名 -> 提供 open() 的模块
+COMPRESSORS = {'.gz': gzip, '.xz': lzma}
+# 读取账单文件可能出现的 I/O 错误：截断的归档抛出 EOFError，损坏的 xz 数据抛出 LZMAError
+BILL_READ_ERRORS = (OSError, EOFError, lzma.LZMAError)
+
+
+def compression_of(file_path):
+    """返回文件的压缩扩展名（'.gz' 或 '.xz'），未压缩时返回 None。"""
+    suffix = os.path.splitext(file_path)[1].lower()
+    return suffix if suffix in COMPRESSORS else None
+
+
+def is_compressed(file_path):
+    return compression_of(file_path) is not None
+
+
+def is_bill_file(file_path):
+    """文件名是否是账单文件：.txt、.txt.gz 或 .txt.xz（不区分大小写）。"""
+    return file_path.lower().endswith(BILL_FILE_SUFFIXES)
+
+
+def open_bill_file(file_path, mode='r', compression=None):
+    """
+    打开账单文件。'r' / 'w' 以 UTF-8 文本模式打开（通用换行符，与内置 open 一致），
+    'rb' / 'wb' 返回字节流。compression 缺省时按扩展名判断，写临时文件时可以显式指定。
+    """
+    module = COMPRESSORS.get(compression or compression_of(file_path))
+    if 'b' in mode:
+        return module.open(file_path, mode) if module else open(file_path, mode)
+    if module:
+        return module.open(file_path, mode + 't', encoding='utf-8')
+    return open(file_path, mode, encoding='utf-8')
+
+
+def find_bill_files(path):
+    """返回 path 本身（是账单文件时）或目录中递归找到的全部账单文件。"""
+    if os.path.isfile(path):
+        return [path] if is_bill_file(path) else []
+    return [
+        os.path.join(root, file)
+        for root, _, dir_files in os.walk(path)
+        for file in dir_files if is_bill_file(file)
+    ]
@@ -0,0 +1,103 @@
+# description_key.py
+"""
+消费描述的规范化键。
+同一笔消费在不同月份的写法常有细微差别：空格、全角/半角、大小写、修改器自动续费时追加的 "(auto-renewal)"，
+以及描述末尾的备注。导入时为每个描述计算一个规范化键，跨年份汇总时按键分组，这些写法就会归到一起：
+
+    1. NFKC 归一（全角字母、数字和括号转为半角）并转为小写
+    2. 反复去掉末尾匹配 strip_patterns 的部分（默认是括号中的备注和 " - " 之后的说明）
+    3. 去掉全部空白
+    4. 依次尝试 aliases 中的规则（模式用 re.search 匹配上一步得到的键），第一条匹配的规则把键替换为它的 key
+
+规则保存在 config/Description_Rules.json 中，可以随时修改；规则的指纹记录在数据库中，
+下次导入（或手动更新描述键）时只重新计算键发生变化的描述，不需要重新导入账单。
+
+item_fingerprint 把 (年月, 金额, 规范化键) 压缩为一个 64 位整数，作为疑似重复消费检测的哈希索引键。
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+from common import YELLOW, RESET
+
+DESCRIPTION_RULES_PATH = 'config/Description_Rules.json'
+
+# 规则文件缺失或缺少某个键时使用的默认规则
+DEFAULT_DESCRIPTION_RULES = {
+    'strip_patterns': [r'\([^()]*\)$', r'\s+-\s.*$'],
+    'aliases': [],
+}
+
+
+class DescriptionKeyRules:
+    """编译后的规范化规则；key() 可以直接注册为 SQLite 函数。"""
+
+    def __init__(self, rules=None):
+        rules = {**DEFAULT_DESCRIPTION_RULES, **(rules or {})}
+        self.strip_patterns = [re.compile(pattern) for pattern in rules['strip_patterns']]
+        self.aliases = [
+            (self._normalize(alias['key']), [re.compile(pattern) for pattern in alias['patterns']])
+            for alias in rules['aliases']
+        ]
+        # 规则的指纹：规则修改后，已保存的描述键需要重新计算
+        canonical = json.dumps(rules, ensure_ascii=False, sort_keys=True)
+        self.fingerprint = hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _normalize(text):
+        return ''.join(unicodedata.normalize('NFKC', text).lower().split())
+
+    def key(self, text):
+        """返回描述的规范化键；去掉备注后为空时保留备注本身。"""
+        if text is None:
+            return None
+        folded = ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+        stripped = folded
+        while True:
+            shortened = stripped
+            for pattern in self.strip_patterns:
+                shortened = pattern.sub('', shortened).rstrip()
+            if shortened == stripped:
+                break
+            stripped = shortened
+        key = ''.join((stripped or folded).split())
+        for alias_key, patterns in self.aliases:
+            if any(pattern.search(key) for pattern in patterns):
+                return alias_key
+        return key
+
+
+def item_fingerprint(year_month, amount, key):
+    """
+    消费项目的重复检测指纹：年月、金额和规范化描述键都相同的项目指纹相同（不同的项目极少碰撞，
+    检测时仍会核对原值）。使用 blake2b 而不是 hash()，不同进程、不同次运行得到的值一致。
+    """
+    digest = hashlib.blake2b(f"{year_month}\x1f{float(amount)!r}\x1f{key}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def group_duplicates(rows):
+    """
+    把以 (year_month, amount, key) 开头的行按这三个原值分组（排除指纹碰撞），
+    按首次出现的顺序返回至少包含两行的组。
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault((row[0], float(row[1]), row[2]), []).append(row)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def load_description_rules(rules_path=DESCRIPTION_RULES_PATH):
+    """
+    读取规范化规则，并用默认规则补齐缺失的键。
+    规则文件不存在时使用默认规则；格式错误时给出警告并使用默认规则。
+    """
+    if os.path.exists(rules_path):
+        try:
+            with open(rules_path, 'r', encoding='utf-8') as f:
+                return DescriptionKeyRules(json.load(f))
+        except (json.JSONDecodeError, OSError, KeyError, TypeError, re.error) as e:
+            print(f"{YELLOW}警告: 无法解析描述规范化规则 '{rules_path}'，将使用默认规则。详细信息: {e}{RESET}")
+    return DescriptionKeyRules()
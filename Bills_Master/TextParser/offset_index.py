@@ -0,0 +1,246 @@
+# offset_index.py
+"""
+账单文件的 DATE 偏移索引。
+一个账单文件可以包含多个 DATE 块，而解析器在遇到 DATE 行时会重置全部月度状态，
+因此每个 DATE 块都可以脱离文件其余部分单独解析。本模块为文件建立 “YYYYMM -> 字节区间” 的
+旁路索引（<文件名>.idx.json），按文件大小和修改时间判断是否失效，用于：
+  - 只读取并解析/导出某一个月，不必从头扫描整个文件；
+  - 在 DATE 边界把大文件切分成若干段，由多个进程并行解析。
+压缩的账单文件（.txt.gz / .txt.xz）的索引记录的是解压后内容的偏移：建立索引时分块流式解压扫描，
+内存占用与归档大小无关；读取某个月时顺序解压并跳过之前的内容；压缩文件不做并行解析。
+并行解析的同时各进程写出自己那一段的词流，全部成功后拼接为该文件的解析缓存，之后的验证、修改和导入直接复用。
+"""
+import json
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from common import RED, YELLOW, RESET
+from .bill_files import BILL_READ_ERRORS, is_compressed, open_bill_file
+from .text_parser import BillParser, parse_bill_file
+from .parse_cache import (
+    content_hash, discard_token_parts, is_cached, record_tokens, store_token_parts, token_part_paths, tokenize_buffer
+)
+
+INDEX_SUFFIX = '.idx.json'
+INDEX_VERSION = 1
+# 小于该大小的文件直接顺序解析，进程池的启动和结果传输开销不值得
+PARALLEL_PARSE_THRESHOLD = 4 * 1024 * 1024
+# 流式扫描压缩文件时每次解压的字节数
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+RE_DATE_BYTES = re.compile(rb'DATE:')
+RE_LINE_END_BYTES = re.compile(rb'[\r\n]')
+
+
+def _count_lines(segment):
+    """统计一段字节中的行结束符个数，\n、\r\n 和单独的 \r 各算一个，与文本模式的通用换行符一致。"""
+    return segment.count(b'\n') + segment.count(b'\r') - segment.count(b'\r\n')
+
+
+def _find_date_lines(buffer, base=0, line_num=1):
+    """
+    扫描以行首开始的一段字节中的 DATE 行，返回 (块列表, 这段字节之后的行号)。
+    与解析器一致：去掉首尾空白后以 'DATE:' 开头的行就是 DATE 行；格式错误的 DATE 行同样作为边界，
+    解析到该块时再由解析器报错。块的 start 是加上 base 之后的偏移，line_num 从传入的行号开始计数。
+    """
+    blocks = []
+    counted_to = 0
+    for match in RE_DATE_BYTES.finditer(buffer):
+        pos = match.start()
+        newline = buffer.rfind(b'\n', 0, pos)
+        line_start = max(newline, buffer.rfind(b'\r', max(newline, 0), pos)) + 1
+        prefix = buffer[line_start:pos]
+        if prefix and prefix.decode('utf-8', 'replace').strip():
+            continue  # 'DATE:' 出现在行中间，不是 DATE 行
+
+        line_end_match = RE_LINE_END_BYTES.search(buffer, pos)
+        line_end = line_end_match.start() if line_end_match else len(buffer)
+        line_num += _count_lines(buffer[counted_to:line_start])
+        counted_to = line_start
+        blocks.append({
+            'year_month': buffer[pos + 5:line_end].decode('utf-8', 'replace').strip(),
+            'start': base + line_start,
+            'line_num': line_num,
+        })
+    return blocks, line_num + _count_lines(buffer[counted_to:])
+
+
+def _close_blocks(blocks, size):
+    """每个块结束于下一个块的开头，最后一个块结束于文件末尾。"""
+    for block, next_block in zip(blocks, blocks[1:] + [None]):
+        block['end'] = next_block['start'] if next_block else size
+    return blocks
+
+
+def _scan_date_blocks(buffer):
+    """扫描所有 DATE 行，返回按出现顺序排列的块列表。"""
+    blocks, _ = _find_date_lines(buffer)
+    return _close_blocks(blocks, len(buffer))
+
+
+def _scan_date_blocks_stream(infile, block_size=SCAN_BLOCK_SIZE):
+    """
+    与 _scan_date_blocks 相同，但从流中分块读取（用于压缩文件的解压流），偏移是解压后内容的偏移。
+    每块只扫描到最后一个 \n，剩余部分并入下一块，因此 DATE 行和 \r\n 都不会被拆开。
+    """
+    blocks, base, line_num, pending = [], 0, 1, b''
+    while True:
+        chunk = infile.read(block_size)
+        data = pending + chunk
+        cut = data.rfind(b'\n') + 1 if chunk else len(data)
+        found, line_num = _find_date_lines(data[:cut], base, line_num)
+        blocks.extend(found)
+        base += cut
+        pending = data[cut:]
+        if not chunk:
+            return _close_blocks(blocks, base)
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_offset_index(file_path):
+    """扫描文件并返回偏移索引（不写入磁盘）。"""
+    size, mtime_ns = _file_signature(file_path)
+    blocks = []
+    if size and is_compressed(file_path):
+        with open_bill_file(file_path, 'rb') as infile:
+            blocks = _scan_date_blocks_stream(infile)
+    elif size:
+        with open(file_path, 'rb') as infile:
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                blocks = _scan_date_blocks(buffer)
+    return {'version': INDEX_VERSION, 'size': size, 'mtime_ns': mtime_ns, 'blocks': blocks}
+
+
+def load_offset_index(file_path):
+    """
+    返回文件的偏移索引。旁路索引存在且文件大小、修改时间都没有变化时直接使用，
+    否则重新扫描并写回旁路文件；写入失败（如目录只读）时仅使用内存中的索引。
+    """
+    index_path = file_path + INDEX_SUFFIX
+    size, mtime_ns = _file_signature(file_path)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if (index.get('version'), index.get('size'), index.get('mtime_ns')) == (INDEX_VERSION, size, mtime_ns):
+            return index
+    except (OSError, ValueError):
+        pass
+
+    index = build_offset_index(file_path)
+    try:
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+    except OSError as e:
+        print(f"{YELLOW}警告: 无法写入偏移索引 '{index_path}': {e}{RESET}")
+    return index
+
+
+def month_blocks(index, year_month):
+    """返回某个 YYYYMM 对应的全部块；同一个月可能在文件中出现多次。"""
+    return [block for block in index['blocks'] if block['year_month'] == year_month]
+
+
+def _read_ranges(file_path, ranges):
+    """读取若干 (start, end) 字节区间，只 seek 到需要的位置（压缩文件的区间按出现顺序，只需向前解压）。"""
+    chunks = []
+    with open_bill_file(file_path, 'rb') as infile:
+        for start, end in ranges:
+            infile.seek(start)
+            chunks.append(infile.read(end - start))
+    return chunks
+
+
+def read_month_text(file_path, year_month):
+    """返回文件中某个月的原始文本（多个同月块按出现顺序拼接）；没有该月时返回 None。"""
+    blocks = month_blocks(load_offset_index(file_path), year_month)
+    if not blocks:
+        return None
+    chunks = _read_ranges(file_path, [(block['start'], block['end']) for block in blocks])
+    return ''.join(chunk.decode('utf-8') for chunk in chunks)
+
+
+def parse_month(file_path, year_month):
+    """
+    只解析文件中的某一个月。返回值与 parse_bill_file 相同：成功返回 (True, records_list)，
+    失败返回 (False, None)。记录中的行号仍是其在整个文件中的行号。
+    """
+    try:
+        blocks = month_blocks(load_offset_index(file_path), year_month)
+        if not blocks:
+            print(f"{YELLOW}警告: 文件 '{os.path.basename(file_path)}' 中没有 {year_month} 的数据。{RESET}")
+            return True, []
+        chunks = _read_ranges(file_path, [(block['start'], block['end']) for block in blocks])
+        records = []
+        for block, chunk in zip(blocks, chunks):
+            parser = BillParser(file_path)
+            parser._parse_buffer(chunk, block['line_num'])
+            records.extend(parser.records)
+        return True, records
+    except (ValueError, *BILL_READ_ERRORS) as e:
+        print(f"{RED}Error parsing file '{os.path.basename(file_path)}': {e}{RESET}")
+        return False, None
+
+
+def _split_segments(index, parts):
+    """
+    在 DATE 边界把文件切成至多 parts 段，每段大小尽量接近，返回 (start, end, first_line_num) 列表。
+    第一段从文件开头开始，以保留第一个 DATE 之前的内容（及其报错）。
+    """
+    blocks = index['blocks']
+    target = index['size'] / parts
+    segments = []
+    start, first_line_num = 0, 1
+    for block in blocks[1:]:
+        if block['start'] - start >= target and len(segments) < parts - 1:
+            segments.append((start, block['start'], first_line_num))
+            start, first_line_num = block['start'], block['line_num']
+    segments.append((start, index['size'], first_line_num))
+    return segments
+
+
+def _parse_segment(file_path, start, end, first_line_num, part_path):
+    """进程池中执行：解析文件的一段并返回记录列表，同时把这一段的词流写入 part_path。"""
+    (chunk,) = _read_ranges(file_path, [(start, end)])
+    parser = BillParser(file_path)
+    parser._parse_tokens(record_tokens(tokenize_buffer(chunk, first_line_num), part_path))
+    return parser.records
+
+
+def parse_bill_file_parallel(file_path, max_workers=None):
+    """
+    在 DATE 边界切分文件并用多个进程并行解析，结果与 parse_bill_file 完全一致，并同样写入解析缓存。
+    小文件、只有一个 DATE 块的文件、压缩文件，以及词流已经缓存的文件直接走顺序解析。
+    """
+    try:
+        if os.path.getsize(file_path) < PARALLEL_PARSE_THRESHOLD or is_compressed(file_path):
+            return parse_bill_file(file_path)
+        digest = content_hash(file_path)
+        if is_cached(file_path, digest=digest):
+            return parse_bill_file(file_path, digest=digest)
+        index = load_offset_index(file_path)
+        workers = max_workers or os.cpu_count() or 1
+        segments = _split_segments(index, workers)
+        if len(segments) < 2:
+            return parse_bill_file(file_path, digest=digest)
+
+        records = []
+        part_paths = token_part_paths(digest, len(segments))
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(segments))) as executor:
+                futures = [executor.submit(_parse_segment, file_path, *segment, part_path)
+                           for segment, part_path in zip(segments, part_paths)]
+                for future in futures:
+                    records.extend(future.result())
+            store_token_parts(digest, part_paths)
+        finally:
+            discard_token_parts(part_paths)
+        return True, records
+    except (ValueError, IOError) as e:
+        print(f"{RED}Error parsing file '{os.path.basename(file_path)}': {e}{RESET}")
+        return False, None
@@ -0,0 +1,262 @@
+# parse_cache.py
+"""
+账单文件的词法缓存。
+验证、修改和导入都会逐行识别账单文件（DATE/REMARK 行、父标题、子标题、金额行……），
+这里把识别结果——“词流”——按文件内容的哈希保存到缓存目录中，文件字节不变时各模块直接复用，
+不再重复执行正则匹配。
+
+词流是 (行号, 标志位, 去掉首尾空白的行内容) 的序列，只包含非空行；标志位只描述行本身的格式，
+与配置文件无关，因此同一份缓存可以被三个模块共用。
+缓存文件由若干个独立压缩的块组成，读写都是流式的，内存占用与文件大小无关。
+
+解析器只有词流这一套语法实现：不论词流来自缓存、文件还是按偏移读出的字节，行格式都由 classify_line 识别。
+并行解析时各进程把自己那一段的词流写入分段文件，全部成功后按顺序拼接为缓存条目（块是独立的，可以直接拼接）。
+"""
+import hashlib
+import io
+import marshal
+import os
+import re
+import shutil
+import struct
+import zlib
+
+from common import YELLOW, RESET
+from .bill_files import open_bill_file
+
+PARSE_CACHE_DIR = 'cache/parsed'
+# 词流格式或标志位定义变化时递增，旧缓存自动失效
+TOKEN_FORMAT_VERSION = 1
+TOKENS_PER_CHUNK = 4096
+MAX_CACHE_ENTRIES = 256
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# --- 标志位 ---
+TOKEN_DATE = 1              # 以 'DATE:' 开头
+TOKEN_REMARK = 2            # 以 'REMARK:' 开头
+TOKEN_PARENT = 4            # 父标题（解析器规则：大写字母 + 汉字）
+TOKEN_PARENT_NUMBERED = 8   # 父标题（验证/修改规则：允许末尾带数字）
+TOKEN_SUB = 16              # 子标题
+TOKEN_AMOUNT = 32           # 以数字开头（金额行）
+TOKEN_CONTENT = 64          # 符合验证器内容行规则的金额行
+
+RE_TOKEN_PARENT = re.compile(r'[A-Z]+[\u4e00-\u9fff]+')
+RE_TOKEN_PARENT_NUMBERED = re.compile(r'[A-Z]+[\u4e00-\u9fff]+\d*')
+RE_TOKEN_SUB = re.compile(r'[a-z]+(?:_[a-z]+)+')
+RE_TOKEN_AMOUNT = re.compile(r'\d')
+RE_TOKEN_CONTENT = re.compile(r'\d+(?:\.\d+)?(?:[^\d\s][\d\u4e00-\u9fffa-zA-Z_-]*)+')
+
+CHUNK_HEADER = struct.Struct('<I')
+
+
+def classify_line(text):
+    """计算一行（已去掉首尾空白）的标志位。"""
+    if text.startswith('DATE:'):
+        return TOKEN_DATE
+    if text.startswith('REMARK:'):
+        return TOKEN_REMARK
+    if RE_TOKEN_AMOUNT.match(text):
+        return TOKEN_AMOUNT | (TOKEN_CONTENT if RE_TOKEN_CONTENT.fullmatch(text) else 0)
+    flags = 0
+    if RE_TOKEN_PARENT_NUMBERED.fullmatch(text):
+        flags |= TOKEN_PARENT_NUMBERED
+        if RE_TOKEN_PARENT.fullmatch(text):
+            flags |= TOKEN_PARENT
+    elif RE_TOKEN_SUB.fullmatch(text):
+        flags |= TOKEN_SUB
+    return flags
+
+
+def tokenize_lines(lines):
+    """把行迭代器转换为词流；行号从 1 开始，空行只占行号不产生词。"""
+    for lineno, line in enumerate(lines, 1):
+        text = line.strip()
+        if text:
+            yield lineno, classify_line(text), text
+
+
+def tokenize_text(text):
+    """对一段文本做与文本模式读取文件相同的通用换行符处理后生成词流。"""
+    return tokenize_lines(io.StringIO(text, newline=None))
+
+
+def tokenize_buffer(buffer, first_line_num=1):
+    """对一段原始 UTF-8 字节（如按偏移索引读出的某个 DATE 块）生成词流，行号从 first_line_num 开始。"""
+    for lineno, flags, text in tokenize_text(buffer.decode('utf-8')):
+        yield lineno + first_line_num - 1, flags, text
+
+
+def tokenize_file(file_path):
+    """按文本逐行读取源文件生成词流（不使用缓存）。"""
+    with open_bill_file(file_path) as infile:
+        yield from tokenize_lines(infile)
+
+
+def content_hash(file_path):
+    """按块计算文件内容的 SHA-1；压缩文件按压缩后的字节计算，不需要解压。"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_entry_path(digest, cache_dir):
+    return os.path.join(cache_dir, f"{digest}.v{TOKEN_FORMAT_VERSION}.tok")
+
+
+def _read_cached_tokens(entry_path):
+    """逐块读取缓存文件中的词流；缓存损坏时抛出 ValueError。"""
+    with open(entry_path, 'rb') as f:
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if not header:
+                return
+            if len(header) != CHUNK_HEADER.size:
+                raise ValueError(f"truncated token cache '{entry_path}'")
+            (length,) = CHUNK_HEADER.unpack(header)
+            try:
+                chunk = marshal.loads(zlib.decompress(f.read(length)))
+            except (zlib.error, EOFError, TypeError) as e:
+                raise ValueError(f"corrupted token cache '{entry_path}': {e}")
+            yield from chunk
+
+
+def _write_chunk(f, tokens):
+    data = zlib.compress(marshal.dumps(tokens), 1)
+    f.write(CHUNK_HEADER.pack(len(data)))
+    f.write(data)
+
+
+def _prune_cache(cache_dir):
+    """缓存条目超过 MAX_CACHE_ENTRIES 时，删除最久未使用的条目。"""
+    try:
+        entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith('.tok')]
+        if len(entries) <= MAX_CACHE_ENTRIES:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - MAX_CACHE_ENTRIES]:
+            os.remove(entry.path)
+    except OSError:
+        pass
+
+
+def record_tokens(tokens, path):
+    """
+    原样产出词流，同时把词流分块写入 path；词流被完整读完时返回 True（生成器的返回值），
+    否则删除 path。无法写入时给出警告，词流照常产出。
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cache_file = open(path, 'wb')
+    except OSError as e:
+        print(f"{YELLOW}警告: 无法写入解析缓存目录 '{os.path.dirname(path)}': {e}{RESET}")
+        yield from tokens
+        return False
+
+    completed = False
+    try:
+        pending = []
+        for token in tokens:
+            yield token
+            pending.append(token)
+            if len(pending) >= TOKENS_PER_CHUNK:
+                _write_chunk(cache_file, pending)
+                pending = []
+        if pending:
+            _write_chunk(cache_file, pending)
+        completed = True
+    finally:
+        cache_file.close()
+        if not completed:
+            _remove_quietly(path)
+    return True
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _tokenize_and_store(file_path, entry_path, cache_dir):
+    """
+    读取源文件生成词流，同时把词流分块写入临时文件；完整读完后才把临时文件改名为缓存条目，
+    调用方提前停止读取（如验证器达到错误上限）时不会留下不完整的缓存。
+    """
+    temp_path = f"{entry_path}.{os.getpid()}.tmp"
+    if (yield from record_tokens(tokenize_file(file_path), temp_path)):
+        try:
+            os.replace(temp_path, entry_path)
+            _prune_cache(cache_dir)
+        except OSError:
+            pass
+
+
+def is_cached(file_path, cache_dir=PARSE_CACHE_DIR, digest=None):
+    """文件当前内容的词流是否已经缓存；digest 为已经算好的 content_hash。"""
+    return os.path.exists(_cache_entry_path(digest or content_hash(file_path), cache_dir))
+
+
+def iter_file_tokens(file_path, cache_dir=PARSE_CACHE_DIR, digest=None):
+    """
+    返回文件的词流（生成器）。内容哈希命中缓存时直接读取缓存，否则读取源文件并写入缓存。
+    调用方已经算好 content_hash 时通过 digest 传入，不再重复读取整个文件。
+    哈希在调用时立即计算，因此文件不存在等错误会在这里直接抛出；
+    源文件不是合法的 UTF-8 时，迭代过程中抛出 UnicodeDecodeError，与直接读取文本文件的行为一致。
+    """
+    entry_path = _cache_entry_path(digest or content_hash(file_path), cache_dir)
+    if not os.path.exists(entry_path):
+        return _tokenize_and_store(file_path, entry_path, cache_dir)
+    return _iter_cache_entry(file_path, entry_path, cache_dir)
+
+
+def token_part_paths(digest, count, cache_dir=PARSE_CACHE_DIR):
+    """并行解析时各段词流的分段文件路径，按段的顺序排列。"""
+    base = _cache_entry_path(digest, cache_dir)
+    return [f"{base}.{os.getpid()}.part{i}" for i in range(count)]
+
+
+def store_token_parts(digest, part_paths, cache_dir=PARSE_CACHE_DIR):
+    """
+    把完整写好的各段词流按顺序拼接为 digest 的缓存条目。
+    缺少任何一段（如某个进程无法写入缓存目录）时不生成缓存条目；分段文件由 discard_token_parts 删除。
+    """
+    entry_path = _cache_entry_path(digest, cache_dir)
+    temp_path = f"{entry_path}.{os.getpid()}.tmp"
+    if not all(os.path.exists(path) for path in part_paths):
+        return
+    try:
+        with open(temp_path, 'wb') as out:
+            for path in part_paths:
+                with open(path, 'rb') as part:
+                    shutil.copyfileobj(part, out)
+        os.replace(temp_path, entry_path)
+        _prune_cache(cache_dir)
+    except OSError as e:
+        print(f"{YELLOW}警告: 无法写入解析缓存 '{entry_path}': {e}{RESET}")
+        _remove_quietly(temp_path)
+
+
+def discard_token_parts(part_paths):
+    for path in part_paths:
+        _remove_quietly(path)
+
+
+def _iter_cache_entry(file_path, entry_path, cache_dir):
+    try:
+        os.utime(entry_path)  # 记录最近使用时间，供 _prune_cache 淘汰
+    except OSError:
+        pass
+    last_lineno = 0
+    try:
+        for token in _read_cached_tokens(entry_path):
+            last_lineno = token[0]
+            yield token
+    except (OSError, ValueError):
+        # 缓存不可读或已损坏：删除后从源文件重建，并跳过已经产出的行
+        _remove_quietly(entry_path)
+        for token in _tokenize_and_store(file_path, entry_path, cache_dir):
+            if token[0] > last_lineno:
+                yield token
@@ -0,0 +1,37 @@
+# search_tokenizer.py
+"""
+消费项目描述的全文检索分词。
+FTS5 自带的 unicode61 分词器会把一整段连续的汉字当作一个词，无法检索“电费”这类词中的片段；
+trigram 分词器又无法匹配少于三个字的关键词。因此在写入索引前先把描述切分为：
+每个汉字（及其他非 ASCII 字符）单独成词，连续的 ASCII 字母/数字保持为一个词，
+检索时再把关键词按同样规则切分为短语查询。
+"""
+import re
+
+RE_SEARCH_TOKEN = re.compile(r'[0-9A-Za-z]+|[^\s0-9A-Za-z]')
+RE_ASCII_WORD = re.compile(r'^[0-9A-Za-z]+$')
+
+
+def tokenize_for_search(text):
+    """把描述切分为以空格分隔的检索词，供写入 FTS5 索引。"""
+    if text is None:
+        return ''
+    return ' '.join(RE_SEARCH_TOKEN.findall(text.lower()))
+
+
+def build_match_query(keywords):
+    """
+    把用户输入的关键词转换为 FTS5 MATCH 表达式。
+    以空格分隔的多个关键词之间是 AND 关系；以 ASCII 单词结尾的关键词按前缀匹配。
+    没有可检索内容时返回 None。
+    """
+    phrases = []
+    for keyword in keywords.split():
+        tokens = [token for token in RE_SEARCH_TOKEN.findall(keyword.lower()) if token != '"']
+        if not tokens:
+            continue
+        phrase = '"' + ' '.join(tokens) + '"'
+        if RE_ASCII_WORD.match(tokens[-1]):
+            phrase += ' *'
+        phrases.append(phrase)
+    return ' AND '.join(phrases) if phrases else None
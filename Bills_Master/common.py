@@ -1,27 +1,27 @@
-# common.py
-
-"""
-A common module for storing shared constants and utilities, such as ANSI color codes
-for console output. This helps in maintaining consistency and makes updates easier across the project.
-"""
-
-# Standard text colors
-RED = "\033[31m"
-GREEN = "\033[32m"
-YELLOW = "\033[33m"
-BLUE = "\033[34m"
-MAGENTA = "\033[35m"
-CYAN = "\033[36m"
-WHITE = "\033[37m"
-
-# Reset to default color
-RESET = "\033[0m"
-
-# Bright/Bold text colors
-BRIGHT_RED = "\033[91m"
-BRIGHT_GREEN = "\033[92m"
-BRIGHT_YELLOW = "\033[93m"
-BRIGHT_BLUE = "\033[94m"
-BRIGHT_MAGENTA = "\033[95m"
-BRIGHT_CYAN = "\033[96m"
+# common.py
+
+"""
+A common module for storing shared constants and utilities, such as ANSI color codes
+for console output. This helps in maintaining consistency and makes updates easier across the project.
+"""
+
+# Standard text colors
+RED = "\033[31m"
+GREEN = "\033[32m"
+YELLOW = "\033[33m"
+BLUE = "\033[34m"
+MAGENTA = "\033[35m"
+CYAN = "\033[36m"
+WHITE = "\033[37m"
+
+# Reset to default color
+RESET = "\033[0m"
+
+# Bright/Bold text colors
+BRIGHT_RED = "\033[91m"
+BRIGHT_GREEN = "\033[92m"
+BRIGHT_YELLOW = "\033[93m"
+BRIGHT_BLUE = "\033[94m"
+BRIGHT_MAGENTA = "\033[95m"
+BRIGHT_CYAN = "\033[96m"
 BRIGHT_WHITE = "\033[97m"
\ No newline at end of file
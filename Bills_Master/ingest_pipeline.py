@@ -0,0 +1,265 @@
+# ingest_pipeline.py
+"""
+一站式导入流水线：每个文件依次经过 验证 → 修改 → 解析 → 写入，各阶段由有界队列连接。
+
+    读取线程   验证文件并按 modifier 配置修改（写回磁盘），把修改后的文本放入队列
+    解析线程   直接解析队列中的文本，不再从磁盘读取
+    写入线程   唯一持有 SQLite 连接的线程，按文件顺序写入，每个文件一个事务
+
+三个线程同时运行：写入第 N 个文件时，第 N+1 个文件正在解析、第 N+2 个文件正在验证和修改。
+队列有容量上限，内存中最多同时保留几个文件的内容和记录。
+
+某个文件在任一阶段失败时按 error_policy 处理：
+    'skip'   报告该文件并跳过，其余文件照常导入
+    'abort'  报告该文件并停止流水线；已提交的文件保留，尚未写入的文件不再处理
+写入失败的文件其事务被回滚，数据库中不会留下半个文件的数据。
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import ExitStack
+
+from common import RED, GREEN, YELLOW, RESET
+from profiler import profile_stage
+from Inserter.database_inserter import DatabaseManager, IMPORT_LOADERS, create_database
+from Inserter.db_config import writer_settings
+from Inserter.shard_catalog import ShardCatalog, split_records_by_year
+from Reprocessor.bill_modifier import modify_file_content
+from Reprocessor.bill_validator import validate_file
+from TextParser.text_parser import parse_bill_text
+
+INGEST_ERROR_POLICIES = ('skip', 'abort')
+STAGE_QUEUE_SIZE = 2
+# 验证失败时报告中列出的错误条数
+REPORTED_ERRORS = 3
+
+# 队列结束标记
+_DONE = object()
+
+
+class IngestError(Exception):
+    """某个文件在流水线的某一阶段失败。"""
+
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+class _IngestWriter:
+    """
+    写入端：持有本次导入的全部数据库连接，只在写入线程中创建和使用。
+    单文件模式只有一个连接；分片模式按记录所属年份路由，每个年份分片一个连接，首次用到时打开。
+    """
+
+    def __init__(self, db_config, processor_class):
+        self.settings = writer_settings(db_config)
+        self.processor_class = processor_class
+        self.db_path = db_config['db_path']
+        self.catalog = ShardCatalog(db_config['shard_dir']) if db_config['storage_mode'] == 'sharded' else None
+        self._managers = {}
+        self._stack = ExitStack()
+
+    def _manager(self, path):
+        manager = self._managers.get(path)
+        if manager is None:
+            if self.catalog is not None:
+                os.makedirs(self.catalog.shard_dir, exist_ok=True)
+            if not create_database(path, self.settings):
+                raise IngestError('insert', f"数据库 '{path}' 初始化失败")
+            manager = self._stack.enter_context(DatabaseManager(path, self.settings))
+            self._managers[path] = manager
+        return manager
+
+    def _route(self, records):
+        """返回 [(分片年份或 None, 数据库路径, 记录列表)]。"""
+        if self.catalog is None:
+            return [(None, self.db_path, records)]
+        try:
+            records_by_year = split_records_by_year(iter(records))
+        except ValueError as e:
+            raise IngestError('insert', str(e))
+        return [(year, self.catalog.shard_path(year), year_records)
+                for year, year_records in records_by_year.items()]
+
+    def write(self, records):
+        """
+        写入一个文件的全部记录并提交；失败时回滚本文件涉及的所有连接并抛出 IngestError。
+        分片模式下一个文件跨多个年份时，各分片依次提交，不是跨分片的原子操作。
+        """
+        touched = []
+        try:
+            for year, path, year_records in self._route(records):
+                manager = self._manager(path)
+                touched.append((year, manager))
+                if not self.processor_class(manager).process_stream(iter(year_records)):
+                    raise IngestError('insert', "写入数据库失败，本文件的修改已回滚")
+            for _, manager in touched:
+                manager.commit()
+        except (IngestError, sqlite3.Error) as e:
+            for _, manager in touched:
+                manager.rollback()
+            if isinstance(e, IngestError):
+                raise
+            raise IngestError('insert', f"数据库错误: {e}，本文件的修改已回滚")
+        if self.catalog is not None:
+            for year, _ in touched:
+                self.catalog.register(year)
+
+    def close(self):
+        self._stack.close()
+
+
+class IngestPipeline:
+    """
+    验证 → 修改 → 解析 → 写入 的流水线。run() 阻塞直到所有文件处理完（或按 abort 策略中止），
+    返回汇总字典：{'imported': [...], 'failed': [(文件, 阶段, 原因)], 'not_processed': [...], 'aborted': bool, 'seconds': float}。
+    """
+
+    def __init__(self, validator_config_path, modifier_config_path, db_config,
+                 error_policy='skip', queue_size=STAGE_QUEUE_SIZE):
+        if error_policy not in INGEST_ERROR_POLICIES:
+            raise ValueError(f"未知的错误处理策略 '{error_policy}'，可选: {', '.join(INGEST_ERROR_POLICIES)}")
+        processors = IMPORT_LOADERS.get(db_config['import_loader'])
+        if processors is None or db_config['import_mode'] not in processors:
+            raise ValueError(f"未知的导入方式 '{db_config['import_loader']}/{db_config['import_mode']}'")
+        self.validator_config_path = validator_config_path
+        self.modifier_config_path = modifier_config_path
+        self.db_config = db_config
+        self.error_policy = error_policy
+        self.processor_class = processors[db_config['import_mode']]
+        self.queue_size = queue_size
+        self._abort = threading.Event()
+        self._lock = threading.Lock()
+        self._imported = []
+        self._failed = []
+
+    # --- 各阶段的单文件处理 ---
+
+    def _prepare(self, file_path, _):
+        """验证并修改一个文件，返回修改后的文本。"""
+        with profile_stage('validate'):
+            is_valid, result = validate_file(file_path, self.validator_config_path)
+        if not is_valid:
+            errors = result.get('errors', [])
+            details = '; '.join(f"L{lineno}: {msg}" for lineno, msg in errors[:REPORTED_ERRORS])
+            error_count = result.get('error_count', len(errors))
+            more = f" 等 {error_count} 个错误" if error_count > REPORTED_ERRORS else ''
+            raise IngestError('validate', f"验证未通过: {details}{more}")
+        with profile_stage('modify'):
+            content = modify_file_content(file_path, self.modifier_config_path)
+        if content is None:
+            raise IngestError('modify', "修改失败")
+        return content
+
+    def _parse(self, file_path, content):
+        with profile_stage('parse'):
+            success, records = parse_bill_text(content, file_path)
+        if not success:
+            raise IngestError('parse', "解析失败")
+        return records
+
+    # --- 线程 ---
+
+    def _fail(self, file_path, error):
+        with self._lock:
+            self._failed.append((file_path, error.stage, str(error)))
+        print(f"{RED}  ✖ [{error.stage}] {os.path.basename(file_path)}: {error}{RESET}")
+        if self.error_policy == 'abort':
+            self._abort.set()
+
+    def _run_stage(self, stage, work, inbox, outbox):
+        """
+        一个阶段的线程主体：逐个取出 (文件, 数据) 交给 work 处理，把结果放入下一个队列。
+        中止后不再处理，但仍然取空上游队列直到结束标记，避免上游线程阻塞在已满的队列上。
+        """
+        try:
+            while True:
+                job = inbox.get()
+                if job is _DONE:
+                    break
+                if self._abort.is_set():
+                    continue
+                file_path, data = job
+                try:
+                    result = work(file_path, data)
+                except IngestError as e:
+                    self._fail(file_path, e)
+                    continue
+                except Exception as e:
+                    self._fail(file_path, IngestError(stage, f"意外错误: {e}"))
+                    continue
+                if outbox is not None:
+                    outbox.put((file_path, result))
+        finally:
+            if outbox is not None:
+                outbox.put(_DONE)
+
+    def _write_stage(self, inbox):
+        """写入线程：数据库连接在本线程中打开、使用和关闭。"""
+        writer = _IngestWriter(self.db_config, self.processor_class)
+
+        def write(file_path, records):
+            with profile_stage('insert'):
+                writer.write(records)
+            with self._lock:
+                self._imported.append(file_path)
+            print(f"{GREEN}  ✔ {os.path.basename(file_path)}: 已导入 {len(records)} 条记录{RESET}")
+
+        try:
+            self._run_stage('insert', write, inbox, None)
+        finally:
+            try:
+                writer.close()
+            except sqlite3.Error as e:
+                print(f"{RED}关闭数据库连接时出错: {e}{RESET}")
+
+    def run(self, file_paths):
+        start_time = time.perf_counter()
+        sources, texts, records = (queue.Queue(), queue.Queue(self.queue_size), queue.Queue(self.queue_size))
+        for file_path in file_paths:
+            sources.put((file_path, None))
+        sources.put(_DONE)
+
+        threads = [
+            threading.Thread(target=self._run_stage, args=('read', self._prepare, sources, texts), name='ingest-read'),
+            threading.Thread(target=self._run_stage, args=('parse', self._parse, texts, records), name='ingest-parse'),
+            threading.Thread(target=self._write_stage, args=(records,), name='ingest-write'),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        done = set(self._imported) | {path for path, _, _ in self._failed}
+        return {
+            'imported': list(self._imported),
+            'failed': list(self._failed),
+            'not_processed': [path for path in file_paths if path not in done],
+            'aborted': self._abort.is_set(),
+            'seconds': time.perf_counter() - start_time,
+        }
+
+
+# ==============================================================================
+# 公共接口函数
+# ==============================================================================
+
+def ingest_files(file_paths, validator_config_path, modifier_config_path, db_config, error_policy=None):
+    """
+    用流水线导入一批账单文件；error_policy 缺省时使用数据库配置中的 ingest_error_policy。
+    打印汇总并返回 IngestPipeline.run() 的结果字典。
+    """
+    pipeline = IngestPipeline(validator_config_path, modifier_config_path, db_config,
+                              error_policy or db_config['ingest_error_policy'])
+    print(f"找到 {len(file_paths)} 个文件，开始流水线导入 (出错时: {pipeline.error_policy})...")
+    summary = pipeline.run(file_paths)
+
+    color = GREEN if not summary['failed'] else (RED if summary['aborted'] else YELLOW)
+    print(f"\n{color}===== 流水线导入{'已中止' if summary['aborted'] else '完成'} ====={RESET}")
+    print(f"成功导入 {len(summary['imported'])} 个文件，失败 {len(summary['failed'])} 个，"
+          f"未处理 {len(summary['not_processed'])} 个，用时 {summary['seconds']:.2f}s。")
+    for file_path, stage, message in summary['failed']:
+        print(f"{RED}  - [{stage}] {file_path}: {message}{RESET}")
+    return summary
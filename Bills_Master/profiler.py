@@ -0,0 +1,215 @@
+# profiler.py
+"""
+按阶段采集性能数据的分析模式（parse、validate、modify、insert、query）。
+
+开启后（main.py --profile、命令行工具的 --profile，或设置环境变量 BILLS_PROFILE=1），
+每个阶段运行时都会用 cProfile 记录函数耗时，并在阶段前后各取一次 tracemalloc 快照；
+程序退出时把结果写入 profiles/<时间戳>/ 目录：
+    <阶段>.prof        pstats 格式，可用 python -m pstats 或 snakeviz 打开
+    <阶段>.tracemalloc 该阶段最后一次结束时的 tracemalloc 快照（tracemalloc.Snapshot.load）
+    summary.txt        各阶段的耗时、内存峰值、最热的函数和分配最多的代码行
+并在终端（标准错误）打印同样的汇总。
+
+未开启时 profile_stage 直接返回一个空的上下文管理器，不启动 cProfile 和 tracemalloc，没有额外开销。
+同一线程中嵌套的阶段计入外层阶段。同一时刻只有一个阶段运行 cProfile（Python 3.12 起一个进程只能
+有一个活动的分析器）；与之同时运行的其他线程中的阶段（如流水线各线程、查询服务的线程池）只记录耗时和
+内存，汇总中注明其中有多少次运行没有函数统计。内存统计是进程级的，并发时只能作为近似值。
+并行解析的子进程不在采集范围内。
+"""
+import atexit
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from common import CYAN, GREEN, RESET
+
+PROFILE_ENV = 'BILLS_PROFILE'
+PROFILE_ROOT = 'profiles'
+TOP_N = 10
+TRACEMALLOC_FRAMES = 1
+
+# 分析模式关闭时所有阶段共用的空上下文
+_NULL_STAGE = nullcontext()
+_profiler = None
+
+
+class _StageRecord:
+    """一个阶段的累计数据：多次运行的 cProfile 统计合并在一起，分配量按代码行累加。"""
+
+    def __init__(self):
+        self.runs = 0
+        self.unprofiled_runs = 0
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        self.stats = None
+        self.allocations = {}
+        self.last_snapshot = None
+
+
+class StageProfiler:
+    """为每个阶段记录 cProfile 统计和 tracemalloc 快照，并在结束时写出汇总。"""
+
+    def __init__(self, output_root=PROFILE_ROOT):
+        self.output_dir = os.path.join(output_root, datetime.now().strftime('%Y%m%d_%H%M%S'))
+        self.records = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # 持有该锁的阶段运行 cProfile；拿不到锁的并发阶段只记录耗时和内存
+        self._cprofile_lock = threading.Lock()
+        self._finished = False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    @contextmanager
+    def stage(self, name):
+        # 同一线程同时只能运行一个 cProfile，嵌套的阶段计入外层阶段
+        if getattr(self._local, 'stage', None) is not None:
+            yield
+            return
+        self._local.stage = name
+        before = self._snapshot()
+        tracemalloc.reset_peak()
+        profile = self._start_cprofile()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._cprofile_lock.release()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            after = self._snapshot()
+            self._local.stage = None
+            self._record(name, profile, elapsed, peak, before, after)
+
+    def _start_cprofile(self):
+        """没有其他阶段在运行 cProfile 时启动一个并返回，否则返回 None。"""
+        if not self._cprofile_lock.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 进程中已有其他分析工具（如外部的 cProfile 或调试器）
+            self._cprofile_lock.release()
+            return None
+        return profile
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+
+    def _record(self, name, profile, elapsed, peak, before, after):
+        with self._lock:
+            record = self.records.setdefault(name, _StageRecord())
+            record.runs += 1
+            record.seconds += elapsed
+            record.peak_bytes = max(record.peak_bytes, peak)
+            if profile is None:
+                record.unprofiled_runs += 1
+            elif record.stats is None:
+                record.stats = pstats.Stats(profile)
+            else:
+                record.stats.add(profile)
+            for stat in after.compare_to(before, 'lineno'):
+                frame = stat.traceback[0]
+                site = f"{frame.filename}:{frame.lineno}"
+                size, count = record.allocations.get(site, (0, 0))
+                record.allocations[site] = (size + stat.size_diff, count + stat.count_diff)
+            record.last_snapshot = after
+
+    # --- 汇总 ---
+
+    def _hot_functions(self, record):
+        if record.stats is None:
+            return ["  （各次运行都与其他阶段并发，没有函数统计）"]
+        rows = []
+        for (filename, lineno, func), (_, calls, tottime, cumtime, _) in record.stats.stats.items():
+            location = func if filename == '~' else f"{func} ({os.path.basename(filename)}:{lineno})"
+            rows.append((tottime, cumtime, calls, location))
+        rows.sort(reverse=True)
+        lines = [f"  {'自身耗时':>10} {'累计耗时':>10} {'调用次数':>10}  函数"]
+        for tottime, cumtime, calls, location in rows[:TOP_N]:
+            lines.append(f"  {tottime:>9.3f}s {cumtime:>9.3f}s {calls:>12}  {location}")
+        return lines
+
+    def _allocation_sites(self, record):
+        rows = sorted(record.allocations.items(), key=lambda item: item[1][0], reverse=True)
+        lines = [f"  {'净分配':>10} {'对象数':>10}  代码行"]
+        for site, (size, count) in rows[:TOP_N]:
+            lines.append(f"  {size / 1024:>8.1f}KiB {count:>13}  {site}")
+        return lines
+
+    def summary(self):
+        lines = [f"性能分析汇总 ({self.output_dir})"]
+        for name, record in self.records.items():
+            lines.append("")
+            lines.append(f"[{name}] 运行 {record.runs} 次, 共 {record.seconds:.3f}s, "
+                         f"内存峰值 {record.peak_bytes / 1024 / 1024:.1f}MiB")
+            if record.stats is not None and record.unprofiled_runs:
+                lines.append(f" 其中 {record.unprofiled_runs} 次运行与其他阶段并发，只记录了耗时和内存")
+            lines.append(f" 最热的函数 (前 {TOP_N}):")
+            lines.extend(self._hot_functions(record))
+            lines.append(f" 分配最多的代码行 (前 {TOP_N}):")
+            lines.extend(self._allocation_sites(record))
+        return '\n'.join(lines)
+
+    def finish(self):
+        """写出各阶段的 .prof、.tracemalloc 文件和 summary.txt，并打印汇总；只执行一次。"""
+        if self._finished:
+            return
+        self._finished = True
+        if not self.records:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name, record in self.records.items():
+            if record.stats is not None:
+                record.stats.dump_stats(os.path.join(self.output_dir, f"{name}.prof"))
+            record.last_snapshot.dump(os.path.join(self.output_dir, f"{name}.tracemalloc"))
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(summary + '\n')
+        # 写到标准错误，不混入导出到标准输出的数据
+        print(f"\n{CYAN}{summary}{RESET}", file=sys.stderr)
+        print(f"{GREEN}性能分析结果已写入 '{self.output_dir}'。{RESET}", file=sys.stderr)
+
+
+# ==============================================================================
+# 公共接口函数
+# ==============================================================================
+
+def profiling_requested(flag=False):
+    """命令行指定了 --profile，或环境变量 BILLS_PROFILE 的值不是空、0、false、no、off 时返回 True。"""
+    return flag or os.environ.get(PROFILE_ENV, '').strip().lower() not in ('', '0', 'false', 'no', 'off')
+
+
+def enable_profiling(output_root=PROFILE_ROOT):
+    """开启本进程的分析模式，结果在程序退出时写出。重复调用返回同一个 StageProfiler。"""
+    global _profiler
+    if _profiler is None:
+        _profiler = StageProfiler(output_root)
+        atexit.register(_profiler.finish)
+        print(f"{CYAN}性能分析模式已开启，结果将写入 '{_profiler.output_dir}'。{RESET}", file=sys.stderr)
+    return _profiler
+
+
+def profile_stage(name):
+    """
+    用法: with profile_stage('insert'): ...
+    分析模式关闭时返回共用的空上下文管理器。
+    """
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name)
@@ -0,0 +1,124 @@
+# test_database_inserter.py
+"""
+Replace-month import checks: re-importing edited months with import_mode 'replace'
+must leave the database exactly as a fresh import of the edited file would, for
+both loaders.
+Run from Bills_Master: python -m unittest discover tests
+"""
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Inserter.database_inserter import create_database, insert_data
+from Query.ledger_dump import LedgerDumpQuery
+from TextParser.text_parser import parse_bill_text
+
+ORIGINAL_BILL = """DATE:202401
+REMARK:first
+RENT房租
+rent_water
+10水费
+3电费
+rent_power
+120电费补缴
+MEAL吃饭
+meal_snacks
+12咖啡
+DATE:202402
+RENT房租
+rent_water
+11水费
+"""
+
+# 202401: an item removed, an amount changed, a child dropped and one added, the remark
+# removed, and a repeated item; 202402 is unchanged.
+EDITED_BILL = """DATE:202401
+RENT房租
+rent_water
+13电费
+MEAL吃饭
+meal_snacks
+12咖啡
+12咖啡
+meal_fruits
+5苹果
+DATE:202402
+RENT房租
+rent_water
+11水费
+"""
+
+
+def _records(text):
+    ok, records = parse_bill_text(text)
+    assert ok
+    return records
+
+
+class ReplaceMonthTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _import(self, name, imports, loader, commit_every_months=0):
+        """Creates a database and runs the (text, import_mode) imports in order; returns its path and output."""
+        db_path = os.path.join(self._tmp.name, name)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertTrue(create_database(db_path))
+            for text, import_mode in imports:
+                self.assertTrue(insert_data(iter(_records(text)), db_path, commit_every_months,
+                                            import_mode=import_mode, loader=loader))
+        return db_path, output.getvalue()
+
+    def _contents(self, db_path):
+        """Every item row with its month, titles and orders, plus the month remarks."""
+        rows = list(LedgerDumpQuery(db_path=db_path)._iter_rows())
+        conn = sqlite3.connect(db_path)
+        try:
+            remarks = conn.execute("SELECT year_month, remark FROM YearMonth ORDER BY year_month").fetchall()
+            indexed = conn.execute("SELECT rowid FROM ItemSearch ORDER BY rowid").fetchall()
+            item_ids = conn.execute("SELECT id FROM Item ORDER BY id").fetchall()
+        finally:
+            conn.close()
+        self.assertEqual(indexed, item_ids)
+        return rows, remarks
+
+    def test_replace_matches_fresh_import(self):
+        for loader in ('record', 'staging'):
+            for commit_every_months in (0, 1):
+                with self.subTest(loader=loader, commit_every_months=commit_every_months):
+                    fresh, _ = self._import(f'fresh_{loader}_{commit_every_months}.db',
+                                            [(EDITED_BILL, 'replace')], loader, commit_every_months)
+                    replaced, _ = self._import(f'replaced_{loader}_{commit_every_months}.db',
+                                               [(ORIGINAL_BILL, 'upsert'), (EDITED_BILL, 'replace')],
+                                               loader, commit_every_months)
+                    self.assertEqual(self._contents(replaced), self._contents(fresh))
+
+    def test_loaders_agree(self):
+        record, _ = self._import('record.db', [(ORIGINAL_BILL, 'upsert'), (EDITED_BILL, 'replace')], 'record')
+        staging, _ = self._import('staging.db', [(ORIGINAL_BILL, 'upsert'), (EDITED_BILL, 'replace')], 'staging')
+        self.assertEqual(self._contents(record), self._contents(staging))
+
+    def test_repeated_items_are_reported(self):
+        for loader in ('record', 'staging'):
+            with self.subTest(loader=loader):
+                db_path, output = self._import(f'repeats_{loader}.db', [(EDITED_BILL, 'replace')], loader)
+                rows, _ = self._contents(db_path)
+                self.assertEqual([row for row in rows if row[7] == '咖啡'],
+                                 [('202401', 'MEAL吃饭', 2, 'meal_snacks', 1, 1, 12.0, '咖啡')])
+                self.assertIn("Merged repeats: 1 item(s)", output)
+                self.assertIn("202401 MEAL吃饭/meal_snacks 12 '咖啡': 1 repeat(s) dropped", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+# test_shard_catalog.py
+"""
+Sharded storage checks: the same bills imported into per-year shards and into a
+single database must give the same query results, including groupings by
+category and description that span several shards.
+Run from Bills_Master: python -m unittest discover tests
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Inserter.database_inserter import create_database, insert_data, insert_data_sharded
+from Inserter.shard_catalog import ShardCatalog
+from Query.ledger_dump import LedgerDumpQuery
+from Query.query_db import (
+    CategoryBreakdownQuery, DescriptionRollupQuery, DuplicateItemsQuery, ItemSearchQuery,
+    MonthlyDetailsQuery, TopItemsQuery, TrendQuery, YearlySummaryQuery,
+)
+from TextParser.text_parser import parse_bill_text
+
+# Later years introduce titles and descriptions in a different order, so their
+# dictionary ids differ from the first shard's and have to be merged.
+BILL = """DATE:202211
+RENT房租
+rent_water
+10水费
+3电费
+MEAL吃饭
+meal_snacks
+12咖啡
+DATE:202212
+REMARK:year end
+RENT房租
+rent_water
+11水费
+DATE:202301
+TRAVEL出行
+travel_taxi
+25打车
+MEAL吃饭
+meal_snacks
+12 咖啡
+meal_fruits
+12咖啡
+5苹果
+RENT房租
+rent_water
+9水费
+DATE:202402
+MEAL吃饭
+meal_fruits
+6苹果
+TRAVEL出行
+travel_taxi
+30打车
+RENT房租
+rent_power
+120电费补缴
+"""
+
+YEARS = ['2022', '2023', '2024']
+
+
+def _rounded(value):
+    """Rounds floats inside nested results: per-shard sums may add in a different order."""
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {key: _rounded(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_rounded(item) for item in value)
+    return value
+
+
+class ShardedQueryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = tempfile.TemporaryDirectory()
+        ok, records = parse_bill_text(BILL)
+        assert ok
+        cls.db_path = os.path.join(cls._tmp.name, 'bills.db')
+        shard_dir = os.path.join(cls._tmp.name, 'shards')
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert create_database(cls.db_path)
+            assert insert_data(iter(records), cls.db_path)
+            assert insert_data_sharded(iter(records), shard_dir, max_workers=1)
+        cls.catalog = ShardCatalog(shard_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def assertSameResults(self, make_query, fetch=lambda query: query._fetch_data()):
+        """Runs make_query(database) against both storages and compares the fetched results."""
+        single = _rounded(fetch(make_query(self.db_path)))
+        sharded = _rounded(fetch(make_query(self.catalog)))
+        self.assertEqual(single, sharded)
+        return single
+
+    def test_shards_registered(self):
+        self.assertEqual(self.catalog.years(), YEARS)
+
+    def test_summaries_match(self):
+        for year in YEARS:
+            self.assertSameResults(lambda db: YearlySummaryQuery(year, db))
+        self.assertSameResults(lambda db: MonthlyDetailsQuery('2023', '01', db))
+        breakdown = self.assertSameResults(lambda db: CategoryBreakdownQuery('2022', '2024', None, db))
+        self.assertTrue(breakdown)
+        self.assertSameResults(lambda db: CategoryBreakdownQuery('2022', '2024', 'MEAL吃饭', db))
+
+    def test_trends_match(self):
+        self.assertSameResults(lambda db: TrendQuery(db_path=db))
+        self.assertSameResults(lambda db: TrendQuery(by_parent=True, db_path=db))
+        self.assertSameResults(lambda db: TrendQuery(parent_title='RENT房租', start_year_month='202212',
+                                                     end_year_month='202402', db_path=db))
+
+    def test_item_queries_match(self):
+        self.assertSameResults(lambda db: TopItemsQuery(3, None, None, None, None, None, db))
+        self.assertSameResults(lambda db: TopItemsQuery(None, 10, '202212', '202402', 'MEAL吃饭', None, db))
+        found = self.assertSameResults(lambda db: ItemSearchQuery('咖啡', None, None, db))
+        self.assertTrue(found)
+        self.assertSameResults(lambda db: ItemSearchQuery('水费', '202212', '202301', db))
+
+    def test_description_groupings_match(self):
+        rollup = self.assertSameResults(lambda db: DescriptionRollupQuery(db_path=db))
+        self.assertTrue(rollup)
+        self.assertSameResults(lambda db: DescriptionRollupQuery('202212', None, None, None, db))
+        duplicates = self.assertSameResults(lambda db: DuplicateItemsQuery(db_path=db))
+        self.assertTrue(duplicates)
+
+    def test_ledger_dump_matches(self):
+        self.assertSameResults(lambda db: LedgerDumpQuery(db_path=db),
+                               fetch=lambda query: list(query._iter_rows()))
+
+    def test_merged_views(self):
+        conn = self.catalog.connect(read_only=True)
+        try:
+            for table, column in ShardCatalog.DICTIONARIES.items():
+                values = [row[0] for row in conn.execute(f"SELECT {column} FROM {table}")]
+                self.assertEqual(len(values), len(set(values)), table)
+            # Every item resolves to a listed title and description.
+            orphans = conn.execute('''
+                SELECT COUNT(*) FROM Item i
+                JOIN Child c ON c.id = i.child_id
+                LEFT JOIN Category cc ON cc.id = c.title_id
+                LEFT JOIN Description d ON d.id = i.description_id
+                WHERE cc.id IS NULL OR d.id IS NULL''').fetchone()[0]
+            self.assertEqual(orphans, 0)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM Item WHERE fingerprint IS NULL").fetchone()[0], 0)
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# test_text_parser.py
+"""
+解析路径的等价性检查：不论记录来自内存文本、源文件、解析缓存（写入和命中）、偏移索引读出的单月、
+并行解析还是压缩归档，得到的记录都必须与文本解析完全相同。
+在 Bills_Master 目录下运行: python -m unittest discover tests
+"""
+import gzip
+import lzma
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from TextParser import offset_index
+from TextParser.offset_index import parse_bill_file_parallel, parse_month
+from TextParser.parse_cache import tokenize_buffer, tokenize_file, tokenize_text
+from TextParser.text_parser import parse_bill_file, parse_bill_text
+
+# 混合了 \n、\r\n 和单独的 \r，空白行、行首尾空白（含全角空格）以及重复出现的月份
+SAMPLE_BILL = (
+    "DATE:202401\n"
+    "REMARK:一月\n"
+    "\n"
+    "RENT房租\r\n"
+    "\r\n"
+    "rent_water\n"
+    "  10.5水费\n"
+    "3电费　\n"
+    "rent_power\r"
+    "120电费补缴\r"
+    "\n"
+    "MEAL吃饭\n"
+    "meal_snacks\n"
+    "12咖啡\n"
+    "12咖啡\n"
+    "8.00 零食\n"
+    "DATE:202402\n"
+    "\n"
+    "RENT房租\n"
+    "rent_water\n"
+    "11水费\n"
+    "DATE:202401\n"
+    "REMARK:一月补记\n"
+    "MEAL吃饭\n"
+    "meal_fruits\n"
+    "5苹果\n"
+)
+
+
+class ParsePathEquivalenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        # 解析缓存写在当前目录下的 cache/parsed
+        os.chdir(self._tmp.name)
+        self.path = os.path.join(self._tmp.name, 'bill.txt')
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            f.write(SAMPLE_BILL)
+        ok, self.expected = parse_bill_text(SAMPLE_BILL, self.path)
+        self.assertTrue(ok)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def test_token_streams_match(self):
+        expected = list(tokenize_text(SAMPLE_BILL))
+        self.assertEqual(list(tokenize_file(self.path)), expected)
+        self.assertEqual(list(tokenize_buffer(SAMPLE_BILL.encode('utf-8'))), expected)
+
+    def test_file_and_cache_match_text(self):
+        self.assertEqual(parse_bill_file(self.path, use_cache=False), (True, self.expected))
+        # 第一次写入缓存，第二次命中缓存
+        self.assertEqual(parse_bill_file(self.path), (True, self.expected))
+        self.assertTrue(os.listdir(os.path.join('cache', 'parsed')))
+        self.assertEqual(parse_bill_file(self.path), (True, self.expected))
+
+    def test_month_matches_text(self):
+        for year_month in ('202401', '202402'):
+            month_records, current = [], None
+            for record in self.expected:
+                if record['type'] == 'year_month':
+                    current = record['value']
+                if current == year_month:
+                    month_records.append(record)
+            self.assertEqual(parse_month(self.path, year_month), (True, month_records))
+
+    def test_parallel_matches_text(self):
+        threshold = offset_index.PARALLEL_PARSE_THRESHOLD
+        offset_index.PARALLEL_PARSE_THRESHOLD = 0
+        try:
+            self.assertEqual(parse_bill_file_parallel(self.path, max_workers=3), (True, self.expected))
+            # 并行解析写入的缓存与顺序解析的结果一致
+            self.assertEqual(parse_bill_file(self.path), (True, self.expected))
+        finally:
+            offset_index.PARALLEL_PARSE_THRESHOLD = threshold
+
+    def test_compressed_matches_text(self):
+        for suffix, module in (('.gz', gzip), ('.xz', lzma)):
+            path = self.path + suffix
+            with module.open(path, 'wb') as f:
+                f.write(SAMPLE_BILL.encode('utf-8'))
+            self.assertEqual(parse_bill_file(path, use_cache=False), (True, self.expected))
+            self.assertEqual(parse_bill_file(path), (True, self.expected))
+            self.assertEqual(offset_index.build_offset_index(path)['blocks'],
+                             offset_index.build_offset_index(self.path)['blocks'])
+
+
+if __name__ == '__main__':
+    unittest.main()